@@ -1,23 +1,32 @@
 import asyncio
+import heapq
+import itertools
 import json
 import logging
+import math
 import os
 import random
 import tempfile
 import time
 from datetime import datetime
 from random import randint
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import httpx
 import numpy as np
-import requests
-from cassandra.concurrent import execute_concurrent, execute_concurrent_with_args
+from cassandra.concurrent import execute_concurrent
 from fastapi import HTTPException
 
-from cassandra import ConsistencyLevel, Unauthorized
+from cassandra import ConsistencyLevel, InvalidRequest, Unauthorized
 from cassandra.auth import PlainTextAuthProvider
-from cassandra.cluster import Cluster, DriverException, NoHostAvailable
+from cassandra.cluster import (
+    EXEC_PROFILE_DEFAULT,
+    Cluster,
+    DriverException,
+    ExecutionProfile,
+    NoHostAvailable,
+    _NOT_SET,
+)
 from cassandra.policies import RetryPolicy
 from cassandra.query import (
     UNSET_VALUE,
@@ -41,7 +50,19 @@ from impl.models import (
     QueryResult,
     QueryWithEmbedding,
 )
+from impl.bundle_cache import bundle_cache
+from impl.run_events import RUN_EVENTS_TRANSPORTS, CassandraRunEventStore
+from impl.embedding_dimensions import EmbeddingDimensionRegistry, dimension_from_type
+from impl.services.embedding_cache import (
+    CHUNK_DEDUP,
+    CHUNK_DEDUP_TTL_SECONDS,
+    EMBEDDING_CACHE_CASSANDRA,
+    CassandraEmbeddingStore,
+)
 from impl.services.inference_utils import get_embeddings
+from impl.schema_cache import SchemaCache
+from impl.schema_migrations import SCHEMA_VERSION, migrate
+from impl.statement_cache import PreparedStatementCache
 from openapi_server.models.message_content_text_object import MessageContentTextObject
 from openapi_server.models.message_content_text_object_text import MessageContentTextObjectText
 from openapi_server.models.run_object_required_action import RunObjectRequiredAction
@@ -59,12 +80,102 @@ CASSANDRA_KEYSPACE = os.getenv("CASSANDRA_KEYSPACE", "assistant_api")
 CASSANDRA_USER = "token"
 DEFAULT_DB_NAME = "assistant_api_db"
 ASTRA_URL = os.getenv("ASTRA_URL", "https://api.astra.datastax.com/v2/databases")
+# rows shaped by the driver, pass execution_profile=DICT_PROFILE to get dicts, the default profile returns named tuples
+DICT_PROFILE = "dict"
+# max in flight requests per call for fan-out queries (ann search over many files, chunk inserts)
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", 100))
+# rows asked of each partition in the first round of a multi partition ann search
+ANN_MIN_PARTITION_LIMIT = int(os.getenv("ANN_MIN_PARTITION_LIMIT", 5))
 
 TOKEN_AUTH_FAILURE_MESSAGE = """
 Unauthorized to connect to AstraDB. Please ensure you're passing a token starting with `ASTRACS:...` from https://astra.datastax.com and ensure it has the right scope.
 """
 
 
+def execution_profiles() -> Dict[Any, ExecutionProfile]:
+    return {
+        EXEC_PROFILE_DEFAULT: ExecutionProfile(
+            consistency_level=ConsistencyLevel.LOCAL_QUORUM, row_factory=named_tuple_factory
+        ),
+        DICT_PROFILE: ExecutionProfile(consistency_level=ConsistencyLevel.LOCAL_QUORUM, row_factory=dict_factory),
+    }
+
+
+def ann_search_plan(num_partitions: int, limit: int) -> Tuple[int, int]:
+    """(rows per partition in the first round, concurrency) for an ann search over `num_partitions` partitions.
+
+    A few partitions each get asked for enough rows to fill the top `limit` twice over, many partitions only for
+    ANN_MIN_PARTITION_LIMIT rows since the winners are spread across them.
+    """
+    if num_partitions <= 1:
+        return limit, 1
+    first_limit = min(limit, max(ANN_MIN_PARTITION_LIMIT, math.ceil(2 * limit / num_partitions)))
+    return first_limit, min(num_partitions, QUERY_CONCURRENCY)
+
+
+class TopK:
+    """Bounded min-heap keeping the `k` highest scoring keys seen, duplicates are ignored."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap = []
+        self._keys = set()
+        self._counter = itertools.count()
+
+    def push(self, score: float, key) -> bool:
+        if key in self._keys:
+            return False
+        entry = (score, next(self._counter), key)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif score > self._heap[0][0]:
+            evicted = heapq.heapreplace(self._heap, entry)
+            self._keys.discard(evicted[2])
+        else:
+            return False
+        self._keys.add(key)
+        return True
+
+    def threshold(self) -> float:
+        """Score a new key has to beat to make the cut."""
+        if len(self._heap) < self.k:
+            return float("-inf")
+        return self._heap[0][0]
+
+    def items(self) -> List[Tuple[float, Any]]:
+        return [(score, key) for score, _, key in sorted(self._heap, key=lambda entry: (-entry[0], entry[1]))]
+
+
+def _result_future(response_future) -> asyncio.Future:
+    """Bridge a driver ResponseFuture to an asyncio future that resolves to the rows of every page."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    rows = []
+
+    def set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(exception):
+        if not future.done():
+            future.set_exception(exception)
+
+    # callbacks run on the driver's event loop thread
+    def on_page(page):
+        if page:
+            rows.extend(page)
+        if response_future.has_more_pages:
+            response_future.start_fetching_next_page()
+        else:
+            loop.call_soon_threadsafe(set_result, rows)
+
+    def on_error(exception):
+        loop.call_soon_threadsafe(set_exception, exception)
+
+    response_future.add_callbacks(on_page, on_error)
+    return future
+
+
 class Payload(BaseModel):
     args: Dict[str, Any]
 
@@ -170,20 +281,53 @@ class CassandraClient:
         self.token = token
         self.dbid = dbid
         self.session = None  # Initialize session to None
+        self.statement_cache = None
+        self.schema_cache = None
+        self.embedding_store = None
+        self.chunk_embedding_store = None
+        self.run_event_store = None
+        self.embedding_dimensions = None
 
     async def async_setup(self):
         if self.dbid is None:
             await self.get_or_create_db()
 
-        # Attempt to connect synchronously (assuming connect is a sync method)
-        session = self.connect()
+        bundlepath = await self.get_secure_bundle()
+        # cluster.connect blocks until the control connection and pools are up, keep it off the event loop
+        try:
+            session = await asyncio.to_thread(self.connect, bundlepath)
+        except HTTPException as e:
+            if e.status_code == 401:
+                raise
+            session = await self.reconnect_with_new_bundle(e)
+        except Exception as e:
+            session = await self.reconnect_with_new_bundle(e)
         if session:
             self.session = session
+            self.statement_cache = PreparedStatementCache(session.prepare)
+            self.schema_cache = SchemaCache(session, CASSANDRA_KEYSPACE, self.query_columns, self.query_indexes)
+            self.embedding_dimensions = EmbeddingDimensionRegistry(session, self.prepare, CASSANDRA_KEYSPACE)
+            if EMBEDDING_CACHE_CASSANDRA:
+                self.embedding_store = CassandraEmbeddingStore(session, self.prepare, CASSANDRA_KEYSPACE)
+            if "cassandra" in RUN_EVENTS_TRANSPORTS:
+                self.run_event_store = CassandraRunEventStore(
+                    session, self.prepare, self.execute_async, CASSANDRA_KEYSPACE
+                )
+            if CHUNK_DEDUP:
+                self.chunk_embedding_store = CassandraEmbeddingStore(
+                    session, self.prepare, CASSANDRA_KEYSPACE, ttl=CHUNK_DEDUP_TTL_SECONDS, table="chunk_embeddings"
+                )
             # Perform async table creation
             await self.create_table()
         else:
             raise Exception("Failed to connect to AstraDB")
 
+    async def reconnect_with_new_bundle(self, error):
+        # the cached bundle may have been rotated out from under us
+        logger.warning(f"Failed to connect to {self.dbid} with the cached secure bundle, downloading it again: {error}")
+        bundlepath = await self.get_secure_bundle(refresh=True)
+        return await asyncio.to_thread(self.connect, bundlepath)
+
     async def get_or_create_db(self):
         logger.info("get or create db")
         token = self.token
@@ -195,7 +339,8 @@ class CassandraClient:
             "Content-Type": "application/json",
         }
 
-        response = requests.get(url, headers=headers)
+        async with httpx.AsyncClient() as client:
+            response = await client.get(url, headers=headers)
         handled_response = self.handle_response_errors(response)
         if handled_response is not None:
             logger.error(f"Failed to create AstraDBs {handled_response.detail}")
@@ -216,19 +361,19 @@ class CassandraClient:
                     self.dbid = database["id"]
                     await self.make_keyspace()
                     logger.info(f"Waking up hibernated db {database['id']}")
-                    time.sleep(5)
+                    await asyncio.sleep(5)
                     await self.get_or_create_db()
                     return
                 if status == "TERMINATING":
                     is_terminating = True
                 else:
-                    time.sleep(5)
+                    await asyncio.sleep(5)
                     logger.info(f"Waiting for {database['id']} to come up")
                     await self.get_or_create_db()
                     return
 
         if is_terminating:
-            time.sleep(5)
+            await asyncio.sleep(5)
             logger.info(f"Waiting for {database['id']} to terminate")
             await self.get_or_create_db()
             return
@@ -255,7 +400,8 @@ class CassandraClient:
         logger.info(f"{url = }")
         logger.info(f"{headers = }")
         logger.info(f"{payload = }")
-        response = requests.post(url, headers=headers, json=payload)
+        async with httpx.AsyncClient() as client:
+            response = await client.post(url, headers=headers, json=payload)
         handled_response = self.handle_response_errors(response)
         if handled_response is not None:
             logger.error(f"Failed to create AstraDBs {handled_response.detail}")
@@ -264,7 +410,7 @@ class CassandraClient:
         await self.get_or_create_db()
         return
 
-    def handle_response_errors(self, response: requests.Response) -> HandledResponse:
+    def handle_response_errors(self, response: httpx.Response) -> HandledResponse:
         if response.status_code == 401:
             # Forward the auth error to return from FastAPI
             return HandledResponse(
@@ -280,7 +426,7 @@ class CassandraClient:
             )
         try:
             response.raise_for_status()
-        except requests.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             if e.response.status_code == 401:
                 # Forward the auth error to return from FastAPI
                 return HandledResponse(
@@ -321,7 +467,7 @@ class CassandraClient:
             return None
 
 
-    def get_astra_bundle_url(self):
+    async def get_astra_bundle_url(self):
         dbid = self.dbid
         token = self.token
 
@@ -338,41 +484,38 @@ class CassandraClient:
         payload = {}
 
         # Make the POST request
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        async with httpx.AsyncClient() as client:
+            response = await client.post(url, headers=headers, content=json.dumps(payload))
 
         handled_response = self.handle_response_errors(response)
         if handled_response is not None:
             if handled_response.retryable:
-                time.sleep(5)
-                return self.get_astra_bundle_url()
+                await asyncio.sleep(5)
+                return await self.get_astra_bundle_url()
             else:
                 logger.error(f"Failed to get AstraDB bundle URL " + handled_response.detail)
                 raise HTTPException(detail=handled_response.detail, status_code=handled_response.status_code)
 
         return response.json()["downloadURL"]
 
-    def connect(self, retry=False):
+    async def get_secure_bundle(self, refresh=False) -> str:
+        return await bundle_cache.get(self.dbid, self.get_astra_bundle_url, refresh=refresh)
+
+    def connect(self, bundlepath, retry=False):
         dbid = self.dbid
         token = self.token
         if dbid is not None:
             try:
-                # connect to Astra
-                bundlepath = f"/tmp/{dbid}.zip"
-                if not os.path.exists(bundlepath):
-                    url = self.get_astra_bundle_url()
-                    if url:
-                        # Download the secure connect bundle and extract it
-                        r = requests.get(url)
-                        with open(bundlepath, "wb") as f:
-                            f.write(r.content)
                 # Connect to the cluster
                 cloud_config = {"secure_connect_bundle": bundlepath}
                 auth_provider = PlainTextAuthProvider(CASSANDRA_USER, token)
                 cluster = Cluster(
-                    cloud=cloud_config, auth_provider=auth_provider, connect_timeout=60
+                    cloud=cloud_config,
+                    auth_provider=auth_provider,
+                    connect_timeout=60,
+                    execution_profiles=execution_profiles(),
                 )
                 session = cluster.connect()
-                session.default_consistency_level = ConsistencyLevel.LOCAL_QUORUM
                 return session
             except Unauthorized as e:
                 raise HTTPException(401, f"{TOKEN_AUTH_FAILURE_MESSAGE}: {e}")
@@ -394,12 +537,22 @@ class CassandraClient:
                 # sleep and retry
                 time.sleep(5)
                 if retry:
-                    return self.connect(retry=False)
+                    return self.connect(bundlepath, retry=False)
                 else:
                     raise
         else:
             raise Exception("Failed to connect to AstraDB")
 
+    def prepare(self, query_string, consistency_level=ConsistencyLevel.QUORUM) -> PreparedStatement:
+        return self.statement_cache.get(query_string, consistency_level)
+
+    async def execute_async(self, statement, parameters=None, timeout=_NOT_SET) -> List[Dict[str, Any]]:
+        """Execute without blocking the event loop, rows come back as dicts."""
+        response_future = self.session.execute_async(
+            statement, parameters, timeout=timeout, execution_profile=DICT_PROFILE
+        )
+        return await _result_future(response_future)
+
     async def make_keyspace(self):
         # Define the URL
         url = f"https://api.astra.datastax.com/v2/databases/{self.dbid}/keyspaces/{CASSANDRA_KEYSPACE}"
@@ -432,281 +585,58 @@ class CassandraClient:
         embedding = get_embeddings(
             texts=["test"],
             model=model,
+            store=self.embedding_store,
             **litellm_kwargs
         )
         return len(embedding[0])
 
-    def maybe_alter_file_chunks(self, model, litellm_kwargs):
-        # TODO: optimize - check cluster schema metadata to see if this alter is necessary
-        dims = self.infer_embedding_dim(model, litellm_kwargs)
-        model_string = model.replace("-", "_").replace(".", "_").replace("/", "_")
-        try:
-            self.session.execute(
-                f"""alter TABLE assistant_api.file_chunks ADD embedding_{model_string} VECTOR<float, {dims}>;"""
-            )
-        except Exception as e:
-            logger.info(f"Exception adding column: {e}")
-        try:
-            statement = SimpleStatement(
-                f"CREATE CUSTOM INDEX IF NOT EXISTS ON {CASSANDRA_KEYSPACE}.file_chunks (embedding_{model_string}) USING 'StorageAttachedIndex';",
-                consistency_level=ConsistencyLevel.QUORUM,
-            )
-            self.session.execute(statement)
-        except Exception as e:
-            logger.info(f"Exception adding index for column: {e}")
-
-    async def create_table(self):
-        try:
-            await self.make_keyspace()
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.assistants (
-                id text primary key,
-                created_at timestamp,
-                name text,
-                description text,
-                model text,
-                instructions text,
-                tools List<text>,
-                file_ids List<text>,
-                metadata Map<text, text>,
-                object text
-            );"""
-            )
-
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.assistants_v2 (
-                id text primary key,
-                object text,
-                created_at bigint,
-                name text,
-                description text,
-                model text,
-                instructions text,
-                tools list<text>,
-                metadata Map<text, text>,
-                tool_resources text,
-                top_p float,
-                temperature float,
-                response_format text
-            );"""
-            )
+    def maybe_alter_file_chunks(self, model, litellm_kwargs, dims=None):
+        """Add the embedding column (and its index) for `model` to file_chunks if it is missing.
 
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.files(
-                id text primary key,
-                object text,
-                purpose text,
-                created_at timestamp,
-                filename text,
-                format text,
-                bytes int,
-                status text
-            );"""
-            )
-            try:
-                self.session.execute(
-                    f"""alter TABLE assistant_api.files ADD embedding_model text;"""
-                )
-            except Exception as e:
-                logger.info(f"alter table attempt: {e}")
-
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.file_chunks (
-                file_id text,
-                chunk_id text,
-                content text,
-                created_at timestamp,
-                embedding VECTOR<float, 1536>,
-                PRIMARY KEY ((file_id), chunk_id)
-            );"""
-            )
-
-            try:
-                self.session.execute(
-                    f"""alter TABLE assistant_api.file_chunks ADD embedding_openai_text_embedding_ada_002 VECTOR<float, 1536>;"""
-                )
-            except Exception as e:
-                logger.info(f"alter table attempt: {e}")
-            try:
-                statement = SimpleStatement(
-                    f"CREATE CUSTOM INDEX IF NOT EXISTS ON {CASSANDRA_KEYSPACE}.file_chunks (embedding_openai_text_embedding_ada_002) USING 'StorageAttachedIndex';",
-                    consistency_level=ConsistencyLevel.QUORUM,
+        `dims` is the width of an embedding already in hand, without it the width comes from the dimension registry.
+        """
+        model_string = model.replace("-", "_").replace(".", "_").replace("/", "_")
+        column_name = f"embedding_{model_string}"
+        column = next(
+            (column for column in self.get_columns("file_chunks") if column["column_name"] == column_name), None
+        )
+        if column is not None and column_name in self.get_indexes("file_chunks"):
+            return
+        if column is not None:
+            existing_dims = dimension_from_type(column["type"])
+            if existing_dims is not None:
+                self.embedding_dimensions.learn(model, existing_dims)
+        else:
+            if dims is not None:
+                self.embedding_dimensions.learn(model, dims)
+            else:
+                dims = self.embedding_dimensions.get(
+                    model, litellm_kwargs, lambda: self.infer_embedding_dim(model, litellm_kwargs)
                 )
-                self.session.execute(statement)
-            except Exception as e:
-                logger.info(f"index creation attempt: {e}")
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.threads (
-                    id text primary key,
-                    object text,
-                    created_at timestamp,
-                    metadata Map<text, text>
-            );"""
-            )
-
             try:
                 self.session.execute(
-                    f"""alter TABLE {CASSANDRA_KEYSPACE}.threads ADD tool_resources Map<text,text>;"""
+                    f"""alter TABLE {CASSANDRA_KEYSPACE}.file_chunks ADD {column_name} VECTOR<float, {dims}>;"""
                 )
+                self.schema_cache.add_column("file_chunks", column_name, f"vector<float, {dims}>")
             except Exception as e:
-                logger.info(f"alter table attempt: {e}")
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.messages (
-                    id text,
-                    object text,
-                    created_at timestamp,
-                    thread_id text,
-                    role text,
-                    content List<text>,
-                    assistant_id text,
-                    run_id text,
-                    file_ids List<text>,
-                    metadata Map<text, text>,
-                    PRIMARY KEY ((thread_id), id)
-            );"""
-            )
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.messages_v2 (
-                    id text,
-                    object text,
-                    created_at bigint,
-                    thread_id text,
-                    status text,
-                    incomplete_details text,
-                    completed_at bigint,
-                    incomplete_at bigint,
-                    role text,
-                    content List<text>,
-                    assistant_id text,
-                    run_id text,
-                    attachments List<text>,
-                    metadata Map<text, text>,
-                    PRIMARY KEY ((thread_id), created_at, id)
-            );"""
-            )
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.runs(
-                id text,
-                object text,
-                created_at timestamp,
-                thread_id text,
-                assistant_id text,
-                status text,
-                required_action text,
-                last_error text,
-                expires_at timestamp,
-                started_at timestamp,
-                cancelled_at timestamp,
-                failed_at timestamp,
-                completed_at timestamp,
-                model text,
-                instructions text,
-                tools list<text>,
-                file_ids list<text>,
-                metadata map<text, text>,
-                PRIMARY KEY((thread_id), id)
-            ); """
-            )
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.runs_v2(
-                id text,
-                object text,
-                created_at bigint,
-                assistant_id text,
-                thread_id text,
-                status text,
-                required_action text,
-                started_at bigint,
-                expires_at bigint,
-                cancelled_at bigint,
-                failed_at bigint,
-                completed_at bigint,
-                last_error text,
-                model text,
-                instructions text,
-                tools list<text>,
-                metadata map<text, text>,
-                incomplete_details text,
-                usage text,
-                temperature float,
-                top_p float,
-                max_prompt_tokens int,
-                max_completion_tokens int,
-                truncation_strategy text,
-                response_format text,
-                tool_choice text,
-                PRIMARY KEY((thread_id), id)
-            ); """
-            )
-
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.run_steps(
-                id text,
-                assistant_id text,
-                cancelled_at timestamp,
-                completed_at timestamp,
-                created_at timestamp,
-                expired_at timestamp,
-                failed_at timestamp,
-                last_error text,
-                metadata map<text, text>,
-                object text,
-                run_id text,
-                status text,
-                step_details text,
-                thread_id text,
-                type text,
-                usage text,
-                PRIMARY KEY((run_id), id)
-            ); """
-            )
-
-
+                logger.info(f"Exception adding column: {e}")
+        try:
             statement = SimpleStatement(
-                f"CREATE CUSTOM INDEX IF NOT EXISTS ON {CASSANDRA_KEYSPACE}.file_chunks (embedding) USING 'StorageAttachedIndex';",
+                f"CREATE CUSTOM INDEX IF NOT EXISTS ON {CASSANDRA_KEYSPACE}.file_chunks ({column_name}) USING 'StorageAttachedIndex';",
                 consistency_level=ConsistencyLevel.QUORUM,
             )
             self.session.execute(statement)
+            self.schema_cache.add_index("file_chunks", column_name)
+        except Exception as e:
+            logger.info(f"Exception adding index for column: {e}")
+        # file_chunks has a new column, statements prepared against the old schema are stale
+        self.statement_cache.invalidate("file_chunks")
 
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.vector_stores(
-                id TEXT PRIMARY KEY,
-                object TEXT,
-                created_at BIGINT,
-                usage_bytes BIGINT,
-                last_active_at BIGINT,
-                name TEXT,
-                status TEXT,
-                file_counts TEXT,
-                metadata MAP<TEXT, TEXT>,
-                expires_at BIGINT,
-                expires_after TEXT,
-            );"""
-            )
-
-            self.session.execute(f"""
-            create table if not exists {CASSANDRA_KEYSPACE}.vector_store_files(
-                vector_store_id TEXT,
-                id TEXT,
-                object TEXT,
-                usage_bytes INT,
-                created_at BIGINT,
-                status TEXT,
-                last_error TEXT,
-                PRIMARY KEY ((vector_store_id), created_at, id)
-            );"""
-            )
-
-
+    async def create_table(self):
+        try:
+            version = await migrate(self, CASSANDRA_KEYSPACE, make_keyspace=self.make_keyspace)
+            if version == SCHEMA_VERSION:
+                logger.info(f"keyspace {CASSANDRA_KEYSPACE} is already at schema version {SCHEMA_VERSION}")
         except Exception as e:
             logger.info(f"Exception creating table or index: {e}")
             raise e
@@ -716,8 +646,7 @@ class CassandraClient:
         DELETE FROM {CASSANDRA_KEYSPACE}.assistants WHERE id = ?;  
         """
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(query_string)
         bound = statement.bind((id,))
         self.session.execute(bound)
         return True
@@ -727,21 +656,16 @@ class CassandraClient:
         SELECT * FROM {CASSANDRA_KEYSPACE}.run_steps WHERE id = ? and run_id = ?;  
         """
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
+        statement = self.prepare(query_string)
         bound = statement.bind(
             (
                 id,
                 run_id,
             )
         )
-        rows = self.session.execute(bound)
-        result = [dict(row) for row in rows]
-        if result is None or len(result) == 0:
+        json_rows = self.session.execute(bound, execution_profile=DICT_PROFILE).one()
+        if json_rows is None:
             return None
-        json_rows = result[0]
-        self.session.row_factory = named_tuple_factory
 
         metadata = json_rows["metadata"]
         if metadata is None:
@@ -804,21 +728,16 @@ class CassandraClient:
         SELECT * FROM {CASSANDRA_KEYSPACE}.runs WHERE id = ? and thread_id = ?;  
         """
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
+        statement = self.prepare(query_string)
         bound = statement.bind(
             (
                 id,
                 thread_id,
             )
         )
-        rows = self.session.execute(bound)
-        result = [dict(row) for row in rows]
-        if result is None or len(result) == 0:
+        json_rows = self.session.execute(bound, execution_profile=DICT_PROFILE).one()
+        if json_rows is None:
             return None
-        json_rows = result[0]
-        self.session.row_factory = named_tuple_factory
 
         toolsJson = json_rows["tools"]
         tools = []
@@ -877,17 +796,12 @@ class CassandraClient:
         SELECT * FROM {CASSANDRA_KEYSPACE}.assistants WHERE id = ?;  
         """
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
+        statement = self.prepare(query_string)
         bound = statement.bind((id,))
-        rows = self.session.execute(bound)
-        result = [dict(row) for row in rows]
-        if result is None or len(result) == 0:
+        json_row = self.session.execute(bound, execution_profile=DICT_PROFILE).one()
+        if json_row is None:
             return None
-        json_row = result[0]
         logger.info(f"fetched this row: {json_row}")
-        self.session.row_factory = named_tuple_factory
 
         toolsJson = json_row["tools"]
         tools = []
@@ -938,18 +852,31 @@ class CassandraClient:
 
 
     def delete_by_pk(self, key, value, table):
+        self.session.execute(self._delete_by_pk_statement(key, value, table))
+        return True
+
+    async def delete_by_pk_async(self, key, value, table):
+        await self.execute_async(self._delete_by_pk_statement(key, value, table))
+        return True
+
+    def _delete_by_pk_statement(self, key, value, table):
         query_string = f"""
         DELETE FROM {CASSANDRA_KEYSPACE}.{table} WHERE {key} = ?;  
         """
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        bound = statement.bind((value,))
-        self.session.execute(bound)
-        return True
+        statement = self.prepare(query_string)
+        return statement.bind((value,))
 
 
     def delete_by_pks(self, keys, values, table):
+        self.session.execute(self._delete_by_pks_statement(keys, values, table))
+        return True
+
+    async def delete_by_pks_async(self, keys, values, table):
+        await self.execute_async(self._delete_by_pks_statement(keys, values, table))
+        return True
+
+    def _delete_by_pks_statement(self, keys, values, table):
         query_string = f"DELETE FROM {CASSANDRA_KEYSPACE}.{table} WHERE "
         i = 0
         for key in keys:
@@ -958,11 +885,8 @@ class CassandraClient:
                 query_string += " AND "
             i += 1
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        bound = statement.bind(values)
-        self.session.execute(bound)
-        return True
+        statement = self.prepare(query_string)
+        return statement.bind(values)
 
 
     def update_run_status(self, id, thread_id, status):
@@ -970,8 +894,7 @@ class CassandraClient:
         UPDATE {CASSANDRA_KEYSPACE}.runs SET status = ? WHERE id = ? and thread_id = ?;  
         """
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(query_string)
         bound = statement.bind(
             (
                 status,
@@ -984,6 +907,12 @@ class CassandraClient:
 
 
     def upsert_run_step(self, run_step : RunStepObject):
+        self.session.execute(*self._run_step_statement(run_step))
+
+    async def upsert_run_step_async(self, run_step : RunStepObject):
+        await self.execute_async(*self._run_step_statement(run_step))
+
+    def _run_step_statement(self, run_step : RunStepObject):
         query_string = f"""insert into {CASSANDRA_KEYSPACE}.run_steps(
             id,
             assistant_id,
@@ -1004,8 +933,7 @@ class CassandraClient:
             ) VALUES (
             ?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
         );"""
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(query_string)
 
         id = run_step.id
         assistant_id = run_step.assistant_id
@@ -1024,7 +952,7 @@ class CassandraClient:
         type = run_step.type
         usage = run_step.usage
 
-        self.session.execute(
+        return (
             statement,
             (
                 id,
@@ -1090,8 +1018,7 @@ class CassandraClient:
             ) VALUES (
             ?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
             );"""
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(query_string)
 
         toolsJson = []
         for tool in tools:
@@ -1190,8 +1117,7 @@ class CassandraClient:
             ) VALUES (
             ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
             );"""
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(query_string)
         self.session.execute(
             statement,
             (
@@ -1267,8 +1193,7 @@ class CassandraClient:
             ?, ?, ?, ?, ?, ?, ?, ?
             );"""
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(query_string)
         self.session.execute(
             statement,
             (id, object, purpose, created_at, filename, format, bytes, status),
@@ -1289,8 +1214,45 @@ class CassandraClient:
             self, id, created_at, object, purpose, filename, format, bytes, chunks, embedding_model, **litellm_kwargs,
     ):
         self.upsert_chunks(chunks, embedding_model, **litellm_kwargs)
-        status = "processed"
+        statement, params, file = self._file_statement(
+            id, created_at, object, purpose, filename, format, bytes, embedding_model
+        )
+        self.session.execute(statement, params)
+        return file
+
+    async def upsert_file_async(
+            self, id, created_at, object, purpose, filename, format, bytes, chunks, embedding_model, **litellm_kwargs,
+    ):
+        await self.upsert_chunks_async(chunks, embedding_model, **litellm_kwargs)
+        statement, params, file = self._file_statement(
+            id, created_at, object, purpose, filename, format, bytes, embedding_model
+        )
+        await self.execute_async(statement, params)
+        return file
 
+    async def insert_file_async(
+            self, id, created_at, object, purpose, filename, format, bytes, embedding_model, status, status_details=None,
+    ):
+        """The files row for an upload whose chunks are written later, by an ingestion job."""
+        statement, params, file = self._file_statement(
+            id, created_at, object, purpose, filename, format, bytes, embedding_model, status
+        )
+        await self.execute_async(statement, params)
+        await self.update_file_status_async(id, status, status_details)
+        file.status_details = status_details
+        return file
+
+    async def update_file_status_async(
+            self, id, status, status_details=None, chunks_total=None, chunks_completed=None, chunks_reused=None,
+    ):
+        statement = self.prepare(
+            f"UPDATE {CASSANDRA_KEYSPACE}.files SET status = ?, status_details = ?, chunks_total = ?, "
+            f"chunks_completed = ?, chunks_reused = ? WHERE id = ?;"
+        )
+        await self.execute_async(statement, (status, status_details, chunks_total, chunks_completed, chunks_reused, id))
+
+    def _file_statement(self, id, created_at, object, purpose, filename, format, bytes, embedding_model,
+                        status="processed"):
         query_string = f"""insert into {CASSANDRA_KEYSPACE}.files (
                     id,
                     object,
@@ -1305,12 +1267,8 @@ class CassandraClient:
             ?, ?, ?, ?, ?, ?, ?, ?, ?
             );"""
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.execute(
-            statement,
-            (id, object, purpose, created_at, filename, format, bytes, status, embedding_model),
-        )
+        statement = self.prepare(query_string)
+        params = (id, object, purpose, created_at, filename, format, bytes, status, embedding_model)
         file = OpenAIFile(
             id=id,
             object=object,
@@ -1322,9 +1280,9 @@ class CassandraClient:
             status=status,
             embedding_model=embedding_model,
         )
-        return file
+        return statement, params, file
 
-    def upsert_thread(
+    def _thread_statement(
             self,
             id,
             object,
@@ -1349,21 +1307,26 @@ class CassandraClient:
         if metadata is None:
             metadata = UNSET_VALUE
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.execute(
-            statement,
-            (
-                id,
-                object,
-                created_at,
-                metadata
-            ),
-        )
+        statement = self.prepare(query_string)
+        return statement, (id, object, created_at, metadata)
+
+    def upsert_thread(self, id, object, created_at, metadata):
+        self.session.execute(*self._thread_statement(id, object, created_at, metadata))
         return self.get_thread(id)
 
+    async def upsert_thread_async(self, id, object, created_at, metadata):
+        await self.execute_async(*self._thread_statement(id, object, created_at, metadata))
+        return await self.get_thread_async(id)
+
     def get_thread(self, id):
         rows = self.select_from_table_by_pk(table="threads", partition_keys=["id"], args={"id": id})
+        return self._thread_from_rows(id, rows)
+
+    async def get_thread_async(self, id):
+        rows = await self.select_from_table_by_pk_async(table="threads", partition_keys=["id"], args={"id": id})
+        return self._thread_from_rows(id, rows)
+
+    def _thread_from_rows(self, id, rows):
         if rows is not None and len(rows) > 0:
             row = rows[0]
             created_at = row["created_at"]
@@ -1385,47 +1348,48 @@ class CassandraClient:
 
     def upsert_table_from_dict(self, table_name : str, obj : Dict):
         logger.info(f"going to upsert table {table_name} using {obj}")
-        fields = ', '.join(obj.keys())
-        placeholders = ', '.join(['?' for _ in range(len(obj.keys()))])
-
-        values_list = []
-
-        for field in obj.keys():
-            value = obj.get(field)
-            if value is None:
-                formatted_value = UNSET_VALUE
-            #elif isinstance(value, str):
-            #    formatted_value = f"'{value}'"
-            else:
-                formatted_value = value
-            values_list.append(formatted_value)
-
-        query_string = f"""insert into {CASSANDRA_KEYSPACE}.{table_name}(
-                {fields}
-            ) VALUES (
-                {placeholders}
-            );"""
+        try:
+            self.session.execute(*self._upsert_statement(table_name, obj))
+        except Exception as e:
+            logger.error(f"failed to upsert {table_name}: {obj}")
+            raise e
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+    async def upsert_table_from_dict_async(self, table_name : str, obj : Dict):
+        logger.info(f"going to upsert table {table_name} using {obj}")
         try:
-            response = self.session.execute(
-                statement,
-                tuple(values_list)
-            )
+            await self.execute_async(*self._upsert_statement(table_name, obj))
         except Exception as e:
             logger.error(f"failed to upsert {table_name}: {obj}")
             raise e
 
     def upsert_table_from_base_model(self, table_name : str, obj : BaseModel):
         logger.info(f"going to upsert table {table_name} using {obj}")
-        fields = ', '.join(obj.__fields__.keys())
-        placeholders = ', '.join(['?' for _ in range(len(obj.__fields__.keys()))])
+        values = {field: getattr(obj, field) for field in obj.__fields__.keys()}
+        try:
+            self.session.execute(*self._upsert_statement(table_name, values))
+        except Exception as e:
+            logger.error(f"failed to upsert {table_name}: {obj}")
+            raise e
+        return obj
+
+    async def upsert_table_from_base_model_async(self, table_name : str, obj : BaseModel):
+        logger.info(f"going to upsert table {table_name} using {obj}")
+        values = {field: getattr(obj, field) for field in obj.__fields__.keys()}
+        try:
+            await self.execute_async(*self._upsert_statement(table_name, values))
+        except Exception as e:
+            logger.error(f"failed to upsert {table_name}: {obj}")
+            raise e
+        return obj
+
+    def _upsert_statement(self, table_name : str, obj : Dict):
+        fields = ', '.join(obj.keys())
+        placeholders = ', '.join(['?' for _ in range(len(obj.keys()))])
 
         values_list = []
 
-        for field in obj.__fields__.keys():
-            value = getattr(obj, field)
+        for field in obj.keys():
+            value = obj.get(field)
             if value is None:
                 formatted_value = UNSET_VALUE
             #elif isinstance(value, str):
@@ -1440,17 +1404,8 @@ class CassandraClient:
                 {placeholders}
             );"""
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        try:
-            response = self.session.execute(
-                statement,
-                tuple(values_list)
-            )
-        except Exception as e:
-            logger.error(f"failed to upsert {table_name}: {obj}")
-            raise e
-        return obj
+        statement = self.prepare(query_string)
+        return statement, tuple(values_list)
 
 
 
@@ -1496,8 +1451,7 @@ class CassandraClient:
         for tool in tools:
             toolsJson.append(tool.json())
 
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(query_string)
         try:
             response = self.session.execute(
                 statement,
@@ -1518,23 +1472,34 @@ class CassandraClient:
             logger.error(f"failed to upsert assistant: {id} {e}")
             raise e
 
+    def shutdown(self):
+        # the Cluster owns the connections and driver threads, shutting down the session alone leaks them
+        if self.session is not None:
+            self.session.cluster.shutdown()
+
     def __del__(self):
         # close the connection when the client is destroyed
-        self.session.shutdown()
+        self.shutdown()
 
     # TODO: make these async
     def selectAllFromTable(self, table):
         queryString = f"""SELECT * FROM {CASSANDRA_KEYSPACE}.{table} limit 1000"""
-        statement = self.session.prepare(queryString)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(statement)
-        json_rows = [dict(row) for row in rows]
-        self.session.row_factory = named_tuple_factory
-        return json_rows
+        statement = self.prepare(queryString)
+        return list(self.session.execute(statement, execution_profile=DICT_PROFILE))
 
     def select_from_table_by_pk(self, table: str, partition_keys: List[str], args: Dict[str, Any], limit: int = None,
                                 order: str = None, allow_filtering: bool = False) -> object:
+        statement = self._select_by_pk_statement(table, partition_keys, args, limit, order, allow_filtering)
+        return list(self.session.execute(statement, execution_profile=DICT_PROFILE))
+
+    async def select_from_table_by_pk_async(self, table: str, partition_keys: List[str], args: Dict[str, Any],
+                                            limit: int = None, order: str = None,
+                                            allow_filtering: bool = False) -> object:
+        statement = self._select_by_pk_statement(table, partition_keys, args, limit, order, allow_filtering)
+        return await self.execute_async(statement)
+
+    def _select_by_pk_statement(self, table: str, partition_keys: List[str], args: Dict[str, Any], limit: int = None,
+                                order: str = None, allow_filtering: bool = False):
         limit_string = ""
         if limit is not None:
             limit_string = f"limit {limit}"
@@ -1559,22 +1524,104 @@ class CassandraClient:
                     i += 1
                 # remove the last comma
                 query_string = query_string[:-1]
-                # TODO: figure out how to do a migration to get rid of ALLOW FILTERING
-                query_string = query_string + limit_string + " ALLOW FILTERING;"
-            else:
-                query_string = query_string + limit_string
-                if (allow_filtering):
-                    query_string = query_string + " ALLOW FILTERING;"
-        # TODO - make a prepared statement cache
-        statement = self.session.prepare(query_string)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+            # ordering by clustering columns within a partition doesn't need ALLOW FILTERING
+            query_string = query_string + limit_string
+            if (allow_filtering):
+                query_string = query_string + " ALLOW FILTERING;"
+        statement = self.prepare(query_string)
         if partition_key_values is not None:
             statement = statement.bind(partition_key_values)
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(statement)
-        json_rows = [dict(row) for row in rows]
-        self.session.row_factory = named_tuple_factory
-        return json_rows
+        return statement
+
+    async def select_page_async(
+            self, table: str, partition_key: str, value: Any, limit: Optional[int], order: str = "desc",
+            after: Optional[str] = None, before: Optional[str] = None,
+            tiebreak: Callable[[Dict[str, Any]], Any] = lambda row: 0,
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        A page of the rows in one partition of a table clustered by (created_at, id), and whether there are more.
+
+        Rows are ordered by created_at, then tiebreak(row), then id, descending unless order is "asc". after and
+        before are the ids of rows on the previous page, the way the OpenAI list endpoints paginate. The order,
+        limit and cursor are pushed down to Cassandra so a page reads about `limit` rows however long the
+        partition is. Rows that share a created_at are always read together, the tiebreak orders them.
+        """
+        descending = order != "asc"
+        if before is not None:
+            # the rows right before the cursor are the first ones after it in the other direction
+            rows, has_more = await self.select_page_async(
+                table, partition_key, value, limit, "asc" if descending else "desc", before, None, tiebreak
+            )
+            rows.reverse()
+            return rows, has_more
+
+        def key(row):
+            return row["created_at"], tiebreak(row), row["id"]
+
+        select = f"SELECT * FROM {CASSANDRA_KEYSPACE}.{table} WHERE {partition_key} = ?"
+        rows = []
+        range_params = ()
+        range_filter = ""
+        if after is not None:
+            cursor = await self.select_by_id_async(table, partition_key, value, after)
+            if len(cursor) == 0:
+                raise HTTPException(status_code=400, detail=f"No object found for cursor {after}.")
+            cursor_key = key(cursor[0])
+            rows = [
+                row for row in await self._select_created_at(select, value, cursor_key[0])
+                if (key(row) < cursor_key if descending else key(row) > cursor_key)
+            ]
+            range_filter = f" AND created_at {'<' if descending else '>'} ?"
+            range_params = (cursor_key[0],)
+
+        wanted = None if limit is None else limit + 1 - len(rows)
+        if wanted is None or wanted > 0:
+            query = f"{select}{range_filter} ORDER BY created_at {'DESC' if descending else 'ASC'}"
+            if wanted is not None:
+                query += f" LIMIT {wanted}"
+            page = await self.execute_async(self.prepare(query + ";"), (value, *range_params))
+            if wanted is not None and len(page) == wanted:
+                # the page may end in the middle of rows sharing a created_at, read all of them
+                last_created_at = page[-1]["created_at"]
+                page = [row for row in page if row["created_at"] != last_created_at]
+                page.extend(await self._select_created_at(select, value, last_created_at))
+            rows.extend(page)
+
+        rows.sort(key=key, reverse=descending)
+        if limit is None:
+            return rows, False
+        return rows[:limit], len(rows) > limit
+
+    async def select_by_ids_async(self, table: str, partition_key: str, value: Any, ids: List[str]) -> List[Dict[str, Any]]:
+        """The rows of a partition clustered by id with one of `ids`, in the order of `ids`."""
+        if not ids:
+            return []
+        rows = await self.execute_async(
+            self.prepare(f"SELECT * FROM {CASSANDRA_KEYSPACE}.{table} WHERE {partition_key} = ? AND id IN ?;"),
+            (value, ids),
+        )
+        by_id = {row["id"]: row for row in rows}
+        return [by_id[id] for id in ids if id in by_id]
+
+    async def select_by_id_async(self, table: str, partition_key: str, value: Any, id: str) -> List[Dict[str, Any]]:
+        """The row with `id` in a partition clustered by (created_at, id), a point lookup through the id index."""
+        try:
+            return await self.execute_async(
+                self.prepare(f"SELECT * FROM {CASSANDRA_KEYSPACE}.{table} WHERE {partition_key} = ? AND id = ?;"),
+                (value, id),
+            )
+        except InvalidRequest as e:
+            # the index is created by the schema migration, keyspaces that haven't run it yet filter the partition
+            logger.warning(f"no id index on {table} yet, filtering the partition: {e}")
+            return await self.execute_async(
+                self.prepare(
+                    f"SELECT * FROM {CASSANDRA_KEYSPACE}.{table} WHERE {partition_key} = ? AND id = ? ALLOW FILTERING;"
+                ),
+                (value, id),
+            )
+
+    async def _select_created_at(self, select: str, value: Any, created_at) -> List[Dict[str, Any]]:
+        return await self.execute_async(self.prepare(f"{select} AND created_at = ?;"), (value, created_at))
 
 
     def upsert_chunks(self, chunks: Dict[str, List[DocumentChunk]], model: str, **litellm_kwargs: Any) -> List[str]:
@@ -1588,6 +1635,25 @@ class CassandraClient:
                     created_at timestamp,
                     embedding VECTOR<float,EMB_SIZE>
         """
+        statements_and_params = self._chunk_statements(chunks, model, **litellm_kwargs)
+        self.upsert_chunks_concurrently(statements_and_params)
+
+    async def upsert_chunks_async(self, chunks: Dict[str, List[DocumentChunk]], model: str, **litellm_kwargs: Any):
+        # building the statements may ALTER file_chunks for a new model, keep that off the event loop
+        statements_and_params = await asyncio.to_thread(self._chunk_statements, chunks, model, **litellm_kwargs)
+        semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+
+        async def execute(statement, params):
+            async with semaphore:
+                await self.execute_async(statement, params)
+
+        try:
+            await asyncio.gather(*[execute(statement, params) for statement, params in statements_and_params])
+        except Exception as e:
+            logger.warning(f"Exception inserting into table: {e}")
+            raise
+
+    def _chunk_statements(self, chunks: Dict[str, List[DocumentChunk]], model: str, **litellm_kwargs: Any):
         statements_and_params = []
         for document_id, document_chunks in chunks.items():
             for chunk in document_chunks:
@@ -1599,7 +1665,7 @@ class CassandraClient:
                 }
                 # self.do_upsert_chunks(json, model, **litellm_kwargs)
                 statements_and_params = self.queue_up_chunks(statements_and_params, json, model, **litellm_kwargs)
-        self.upsert_chunks_concurrently(statements_and_params)
+        return statements_and_params
 
     def load_auth_file(self, file_id):
         rows = self.select_from_table_by_pk(table="file_chunks", partition_keys=["file_id", "chunk_id"],
@@ -1619,11 +1685,9 @@ class CassandraClient:
             queryString = f"""
                         insert into {CASSANDRA_KEYSPACE}.{table} 
                         (file_id, chunk_id, content, created_at) 
-                        VALUES (%s, %s, %s, %s);
+                        VALUES (?, ?, ?, ?);
                     """
-            statement = SimpleStatement(
-                queryString, consistency_level=ConsistencyLevel.QUORUM
-            )
+            statement = self.prepare(queryString)
 
             self.session.execute(
                 statement,
@@ -1706,17 +1770,14 @@ class CassandraClient:
                 break
 
         if missing:
-            self.maybe_alter_file_chunks(embedding_model, litellm_kwargs)
+            self.maybe_alter_file_chunks(embedding_model, litellm_kwargs, dims=len(json["embedding"]))
 
         queryString = f"""
             insert into {CASSANDRA_KEYSPACE}.{table} 
             (file_id, chunk_id, content, created_at, embedding_{model_string}) 
             VALUES (?, ?, ?, ?, ?);
         """
-        statement = self.session.prepare(
-            queryString
-        )
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(queryString)
         return statement
 
     async def _delete_by_filters(self, table: str, filter: DocumentMetadataFilter):
@@ -1784,8 +1845,7 @@ class CassandraClient:
 
     def get_keyspaces(self):
         queryString = "SELECT DISTINCT keyspace_name FROM system_schema.tables"
-        statement = self.session.prepare(queryString)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(queryString)
         rows = self.session.execute(statement)
         keyspaces = [row.keyspace_name for row in rows]
         keyspaces.remove("system_auth")
@@ -1801,8 +1861,7 @@ class CassandraClient:
 
     def get_tables(self, keyspace):
         queryString = f"""SELECT table_name FROM system_schema.tables WHERE keyspace_name='{keyspace}'"""
-        statement = self.session.prepare(queryString)
-        statement.consistency_level = ConsistencyLevel.QUORUM
+        statement = self.prepare(queryString)
         rows = self.session.execute(statement)
         tables = [row.table_name for row in rows]
         if keyspace == CASSANDRA_KEYSPACE and "documents" in tables:
@@ -1810,37 +1869,35 @@ class CassandraClient:
         return tables
 
     def get_indexes(self, table):
+        return self.schema_cache.get_indexes(table)
+
+    def get_columns(self, table):
+        return self.schema_cache.get_columns(table)
+
+    def query_indexes(self, table):
         queryString = f"""
-        SELECT options FROM system_schema.indexes 
+        SELECT kind, options FROM system_schema.indexes 
         WHERE keyspace_name='{CASSANDRA_KEYSPACE}' 
-        and table_name = '{table}'
-        and kind = 'CUSTOM' ALLOW FILTERING;
+        and table_name = '{table}';
         """
-        statement = self.session.prepare(queryString)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(statement)
-        indexes = [row["options"] for row in rows]
+        statement = self.prepare(queryString)
+        rows = self.session.execute(statement, execution_profile=DICT_PROFILE)
+        # kind isn't part of the primary key, filtering on it in the query would need ALLOW FILTERING
+        indexes = [row["options"] for row in rows if row["kind"] == "CUSTOM"]
         indexed_columns = []
         for index in indexes:
             options = dict(index)
             # TODO - extract whether it's dot vs cosine for vector types
             if "StorageAttachedIndex" in options["class_name"]:
                 indexed_columns.append(options["target"])
-        self.session.row_factory = named_tuple_factory
         return indexed_columns
 
-    def get_columns(self, table):
+    def query_columns(self, table):
         queryString = f"""select column_name, kind, type, position from system_schema."columns" WHERE keyspace_name = '{CASSANDRA_KEYSPACE}' and table_name = '{table}';"""
-        statement = self.session.prepare(queryString)
-        statement.consistency_level = ConsistencyLevel.QUORUM
-        self.session.row_factory = dict_factory
-        rows = self.session.execute(statement)
-        json_rows = [dict(row) for row in rows]
-        self.session.row_factory = named_tuple_factory
-        return json_rows
+        statement = self.prepare(queryString)
+        return list(self.session.execute(statement, execution_profile=DICT_PROFILE))
 
-    def annSearch(
+    async def annSearch_async(
             self,
             table,
             vector_index_column,
@@ -1852,117 +1909,117 @@ class CassandraClient:
             # Todo: make this configurable or based on model token limit
             limit=20,
     ):
+        """ANN search over `partitions`, merged into a single top `limit` ordered by score.
 
-        queryString = f"SELECT "
-        embeddings = []
-        columns = self.get_columns(table)
-        indexes = self.get_indexes(table)
-
-        model_string = embedding_model.replace("-", "_").replace(".", "_").replace("/", "_")
-
-        missing = True
-        for column in columns:
-            if column["column_name"] == f"embedding_{model_string}":
-                missing = False
-                break
-
-        if missing:
-            raise HTTPException(f"Missing file embeddings for {model_string}, please resubmit the file.")
-
-        # TODO: we may have to check if there aren't any populated embeddings for the model as well
+        The per partition queries only return the primary key and score. Every partition is first asked for a few
+        rows, partitions whose whole page could still make the cut are asked again for `limit` rows, and only the
+        final winners are read in full.
+        """
+        columns, vector_index_column = self._ann_columns(table, vector_index_column, embedding_model)
+        partition_key, clustering_key = self._ann_key_columns(columns)
+        embedding = await asyncio.to_thread(
+            self._search_embedding, search_string, litellm_kwargs, embedding_model, embedding_api_key
+        )
+        statement = self.prepare(
+            f"SELECT {partition_key}, {clustering_key}, similarity_cosine(?, {vector_index_column}) as score "
+            f"FROM {CASSANDRA_KEYSPACE}.{table} WHERE {partition_key} = ? "
+            f"ORDER BY {vector_index_column} ann of ? LIMIT ?",
+            ConsistencyLevel.LOCAL_ONE,
+        )
+        statement.retry_policy = VectorRetryPolicy()
 
-        vector_index_column = vector_index_column + "_" + model_string
+        first_limit, concurrency = ann_search_plan(len(partitions), limit)
+        semaphore = asyncio.Semaphore(concurrency)
+        top = TopK(limit)
 
-        for column in columns:
-            if (
-                    vector_index_column in indexes
-                    and column["column_name"] == vector_index_column
-            ):
-                litellm_kwargs_embedding = litellm_kwargs.copy()
-                litellm_kwargs_embedding["api_key"] = embedding_api_key
-                embeddings.append(get_embeddings([search_string], model=embedding_model, **litellm_kwargs_embedding)[0])
-                queryString += f"similarity_cosine(?, {column['column_name']}) as score, "
-            elif 'embedding' not in column['column_name'] and column['column_name'] != 'created_at':
-                queryString += f"{column['column_name']}, "
-        queryString = queryString[:-2]
-
-        queryString += f""" FROM {CASSANDRA_KEYSPACE}.{table} """
-        if len(partitions) > 1:
-            return self.handle_multiple_partitions(embeddings, limit, queryString, vector_index_column, partitions)
-        else:
-            return self.finish_ann_query_and_get_json(embeddings, limit, queryString, vector_index_column, partitions)
+        async def query_partition(partition, partition_limit):
+            async with semaphore:
+                rows = await self.execute_async(
+                    statement, (embedding, partition, embedding, partition_limit), timeout=100
+                )
+            for row in rows:
+                top.push(row["score"], (row[partition_key], row[clustering_key]))
+            return rows
 
-    # TODO: make this async and or fix the data model
-    def handle_multiple_partitions(self, embeddings, limit, queryString, vector_index_column, partitions):
-        json_rows = []
+        results = await asyncio.gather(
+            *[query_partition(partition, first_limit) for partition in partitions], return_exceptions=True
+        )
+        failures = [result for result in results if isinstance(result, Exception)]
+        for failure in failures:
+            logger.error(f"problem with async query: {failure}")
+        if len(partitions) > 0 and len(failures) == len(partitions):
+            raise HTTPException(status_code=500, detail=f"Exception during recall")
+
+        if first_limit < limit:
+            # a partition that filled its page with rows scoring at least the current cutoff may have more winners
+            threshold = top.threshold()
+            again = [
+                partition for partition, rows in zip(partitions, results)
+                if not isinstance(rows, Exception) and len(rows) == first_limit and rows[-1]["score"] >= threshold
+            ]
+            if len(again) > 0:
+                logger.debug(f"ann search re-querying {len(again)} of {len(partitions)} partitions")
+                await asyncio.gather(
+                    *[query_partition(partition, limit) for partition in again], return_exceptions=True
+                )
 
-        queryString += f"WHERE file_id = ? "
-        queryString += f"ORDER BY "
-        queryString += f"""
-                {vector_index_column} ann of ?
-                """
-        # TODO make limit configurable
-        queryString += f"LIMIT {limit}"
-        statement = self.session.prepare(queryString)
-        statement.retry_policy = VectorRetryPolicy()
-        statement.consistency_level = ConsistencyLevel.LOCAL_ONE
-        self.session.row_factory = dict_factory
-        parameters = []
-        for partition in partitions:
-            parameters.append([embeddings[0], partition, embeddings[0]])
-        rows = execute_concurrent_with_args(self.session, statement, parameters, concurrency=100)
+        return await self._hydrate_ann_rows(table, columns, partition_key, clustering_key, top.items())
 
-        json_rows = []
-        for (success, result) in rows:
-            if not success:
-                logger.error(f"problem with async query: {result}")  # result will be an Exception
-            else:
-                for row in result:
-                    json_rows.append(dict(row))
-        json_rows = [
-            {k: v for k, v in row.items() if k not in [vector_index_column]}
-            for row in json_rows
+    async def _hydrate_ann_rows(self, table, columns, partition_key, clustering_key, winners):
+        content_columns = [
+            column["column_name"] for column in columns
+            if 'embedding' not in column["column_name"] and column["column_name"] != 'created_at'
         ]
-        self.session.row_factory = named_tuple_factory
-
-        #sort json_rows by score
-        json_rows = sorted(json_rows, key=lambda x: x["score"], reverse=True)
+        statement = self.prepare(
+            f"SELECT {', '.join(content_columns)} FROM {CASSANDRA_KEYSPACE}.{table} "
+            f"WHERE {partition_key} = ? AND {clustering_key} IN ?"
+        )
+        scores = {}
+        by_partition: Dict[Any, List[Any]] = {}
+        for score, (partition, clustering) in winners:
+            scores[(partition, clustering)] = score
+            by_partition.setdefault(partition, []).append(clustering)
+
+        results = await asyncio.gather(*[
+            self.execute_async(statement, (partition, clustering_values))
+            for partition, clustering_values in by_partition.items()
+        ])
+        json_rows = []
+        for rows in results:
+            for row in rows:
+                row["score"] = scores[(row[partition_key], row[clustering_key])]
+                json_rows.append(row)
+        json_rows.sort(key=lambda x: x["score"], reverse=True)
+        return json_rows
 
-        #trim limit
-        json_rows = json_rows[:limit]
+    def _ann_columns(self, table, vector_index_column, embedding_model):
+        columns = self.get_columns(table)
+        indexes = self.get_indexes(table)
 
-        return json_rows
+        model_string = embedding_model.replace("-", "_").replace(".", "_").replace("/", "_")
+        vector_index_column = vector_index_column + "_" + model_string
 
-    def finish_ann_query_and_get_json(self, embeddings, limit, queryString, vector_index_column, partitions):
-        queryString += f"WHERE file_id = '{partitions[0]}' "
-        queryString += f"ORDER BY "
-        queryString += f"""
-                {vector_index_column} ann of ?
-                """
-        # TODO make limit configurable
-        queryString += f"LIMIT {limit}"
-        statement = self.session.prepare(queryString)
-        statement.retry_policy = VectorRetryPolicy()
-        statement.consistency_level = ConsistencyLevel.LOCAL_ONE
-        boundStatement = statement.bind([embeddings[0], embeddings[0]])
-        self.session.row_factory = dict_factory
-        json_rows = self.execute_and_get_json(boundStatement, vector_index_column)
-        return json_rows
+        if not any(column["column_name"] == vector_index_column for column in columns):
+            raise HTTPException(
+                status_code=400, detail=f"Missing file embeddings for {model_string}, please resubmit the file."
+            )
+        if vector_index_column not in indexes:
+            raise HTTPException(status_code=400, detail=f"Missing vector index for {model_string}.")
 
-    def execute_and_get_json(self, boundStatement, vector_index_column, tries=0):
-        try:
-            rows = self.session.execute(boundStatement, timeout=100)
-            json_rows = [dict(row) for row in rows]
-            json_rows = [
-                {k: v for k, v in row.items() if k not in [vector_index_column]}
-                for row in json_rows
-            ]
-            self.session.row_factory = named_tuple_factory
-            return json_rows
-        except Exception as e:
-            if tries < 3:
-                logger.warning(f"Exception during query (retrying): {e}")
-                time.sleep(1)
-                return self.execute_and_get_json(boundStatement, vector_index_column, tries + 1)
-            else:
-                raise HTTPException(status_code=500, detail=f"Exception during recall")
+        # TODO: we may have to check if there aren't any populated embeddings for the model as well
+        return columns, vector_index_column
+
+    @staticmethod
+    def _ann_key_columns(columns):
+        partition_keys = [column["column_name"] for column in columns if column["kind"] == "partition_key"]
+        clustering_keys = [column["column_name"] for column in columns if column["kind"] == "clustering"]
+        if len(partition_keys) != 1 or len(clustering_keys) != 1:
+            raise HTTPException(status_code=500, detail="ann search needs exactly one partition and clustering key")
+        return partition_keys[0], clustering_keys[0]
+
+    def _search_embedding(self, search_string, litellm_kwargs, embedding_model, embedding_api_key):
+        litellm_kwargs_embedding = litellm_kwargs.copy()
+        litellm_kwargs_embedding["api_key"] = embedding_api_key
+        return get_embeddings(
+            [search_string], model=embedding_model, store=self.embedding_store, **litellm_kwargs_embedding
+        )[0]
@@ -1,5 +1,9 @@
 import asyncio
 import logging
+from contextlib import ExitStack
+
+from impl.connection_manager import connection_manager
+from impl.run_events import run_event_bus
 
 logger = logging.getLogger(__name__)
 background_task_set = set()
@@ -8,15 +12,29 @@ event_loop = asyncio.new_event_loop()
 
 async def add_background_task(function, run_id, thread_id, astradb):
     logger.debug("Creating background task")
+    # streams on this worker follow the run through its events instead of polling
+    run_event_bus.open(run_id, astradb.run_event_store)
+    # the run can go longer than the eviction grace period without a request to its tenant's database
+    hold = ExitStack()
+    hold.enter_context(connection_manager.hold(astradb))
     task = asyncio.create_task(
         function, name=run_id
     )
     background_task_set.add(task)
-    task.add_done_callback(lambda t: on_task_completion(t, astradb=astradb, run_id=run_id, thread_id=thread_id))
+    task.add_done_callback(lambda t: on_task_completion(t, astradb=astradb, run_id=run_id, thread_id=thread_id, hold=hold))
+
+
+def on_task_completion(task, astradb, run_id, thread_id, hold=None):
+    try:
+        _on_task_completion(task, astradb, run_id, thread_id)
+    finally:
+        if hold is not None:
+            hold.close()
 
 
-def on_task_completion(task, astradb, run_id, thread_id):
+def _on_task_completion(task, astradb, run_id, thread_id):
     background_task_set.remove(task)
+    run_event_bus.close(run_id)
     logger.debug(f"Task stopped for run_id: {run_id} and thread_id: {thread_id}")
 
     if task.cancelled():
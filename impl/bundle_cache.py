@@ -0,0 +1,124 @@
+import asyncio
+import fcntl
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_CACHE_DIR = os.getenv("ASTRA_BUNDLE_CACHE_DIR", tempfile.gettempdir())
+# bundles rotate (certificates expire), refetch after this long even if connecting still works
+BUNDLE_MAX_AGE_SECONDS = float(os.getenv("ASTRA_BUNDLE_MAX_AGE_SECONDS", 7 * 24 * 3600))
+
+
+class SecureBundleCache:
+    """Secure connect bundles on disk, shared by every worker on the host.
+
+    One worker downloads a bundle while holding an flock on `<dbid>.zip.lock`, the others poll the lock with
+    asyncio.sleep and then use the file it wrote. Bundles are written to a temporary file and
+    renamed into place, so readers never see a partial zip.
+    """
+
+    def __init__(self, directory: str = BUNDLE_CACHE_DIR, max_age: float = BUNDLE_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.max_age = max_age
+
+    def path(self, dbid: str) -> str:
+        return os.path.join(self.directory, f"{dbid}.zip")
+
+    async def get(self, dbid: str, get_url: Callable[[], Awaitable[str]], refresh: bool = False) -> str:
+        """Path to a valid bundle for `dbid`, downloading it from the url `get_url` returns when needed.
+
+        `refresh` forces a new download, unless another worker replaced the bundle while we waited for the lock.
+        """
+        path = self.path(dbid)
+        requested_at = time.time()
+        if not refresh and self._is_fresh(path):
+            return path
+
+        os.makedirs(self.directory, exist_ok=True)
+        lock_fd = await self._lock(path)
+        try:
+            mtime = self._mtime(path)
+            if self._is_fresh(path) and (not refresh or (mtime is not None and mtime >= requested_at)):
+                return path
+            url = await get_url()
+            logger.info(f"downloading secure connect bundle for DB: {dbid}")
+            async with httpx.AsyncClient() as client:
+                response = await client.get(url)
+                response.raise_for_status()
+            await asyncio.to_thread(self._write, path, response.content)
+            return path
+        finally:
+            self._unlock(lock_fd)
+
+    def invalidate(self, dbid: str):
+        try:
+            os.remove(self.path(dbid))
+        except FileNotFoundError:
+            pass
+
+    def _is_fresh(self, path: str) -> bool:
+        mtime = self._mtime(path)
+        if mtime is None or time.time() - mtime > self.max_age:
+            return False
+        return is_valid_bundle(path)
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    async def _lock(path: str) -> int:
+        fd = os.open(f"{path}.lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    await asyncio.sleep(0.1)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    @staticmethod
+    def _unlock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _write(self, path: str, content: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".bundle-", suffix=".zip")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            if not is_valid_bundle(tmp_path):
+                raise ValueError("downloaded secure connect bundle is not a valid zip")
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+
+def is_valid_bundle(path: str) -> bool:
+    try:
+        with zipfile.ZipFile(path) as bundle:
+            return "config.json" in bundle.namelist() and bundle.testzip() is None
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+bundle_cache = SecureBundleCache()
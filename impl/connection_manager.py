@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge
+
+from impl.astra_vector import AstraVectorDataStore, CassandraClient
+
+logger = logging.getLogger(__name__)
+
+MAX_CLUSTERS_PER_WORKER = int(os.getenv("MAX_CLUSTERS_PER_WORKER", 128))
+MAX_CONNECTIONS_PER_WORKER = int(os.getenv("MAX_CONNECTIONS_PER_WORKER", 512))
+# background runs keep using a client after the request that fetched it returned
+EVICTION_GRACE_SECONDS = float(os.getenv("CLUSTER_EVICTION_GRACE_SECONDS", 30))
+# the pool gauges walk every tenant's pool state, they are sampled on a timer instead of on every request
+METRICS_REFRESH_SECONDS = float(os.getenv("CASSANDRA_METRICS_REFRESH_SECONDS", 15))
+
+CLUSTERS = Gauge(
+    name="cassandra_clusters",
+    documentation="Open Cluster objects (one per database and token) in this worker.",
+    multiprocess_mode="livesum",
+)
+POOL_CONNECTIONS = Gauge(
+    name="cassandra_pool_connections",
+    documentation="Open connections to Cassandra hosts, including control connections.",
+    multiprocess_mode="livesum",
+)
+IN_FLIGHT = Gauge(
+    name="cassandra_in_flight_requests",
+    documentation="Requests sent to Cassandra that have not been answered yet.",
+    multiprocess_mode="livesum",
+)
+EVICTIONS = Counter(
+    name="cassandra_cluster_evictions_total",
+    documentation="Clusters shut down by the connection manager, by reason.",
+    labelnames=("reason",),
+)
+
+
+class _Tenant:
+    def __init__(self, client: CassandraClient):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.holds = 0
+
+    def pool_state(self) -> Tuple[int, int]:
+        """(open connections, in flight requests), the control connection counts as one connection."""
+        session = self.client.session
+        if session is None:
+            return 0, 0
+        connections = 1
+        in_flight = 0
+        for state in session.get_pool_state().values():
+            connections += state.get("open_count", 0)
+            in_flight += sum(state.get("in_flights", []))
+        return connections, in_flight
+
+
+class TenantConnectionManager:
+    """The CassandraClient of every (database, token) this worker talks to, least recently used ones are shut down
+    past `max_clusters` or `max_connections`."""
+
+    def __init__(self, max_clusters: int = MAX_CLUSTERS_PER_WORKER,
+                 max_connections: int = MAX_CONNECTIONS_PER_WORKER, grace: float = EVICTION_GRACE_SECONDS):
+        self.max_clusters = max_clusters
+        self.max_connections = max_connections
+        self.grace = grace
+        self._tenants: OrderedDict[Tuple[str, Optional[str]], _Tenant] = OrderedDict()
+        self._pending: Dict[Tuple[str, Optional[str]], asyncio.Future] = {}
+        self._metrics_task: Optional[asyncio.Task] = None
+
+    async def get_client(self, token: str, dbid: Optional[str]) -> CassandraClient:
+        # Astra authorizes connections, a Cluster shared by two tokens would run one with the other's role
+        key = (hashlib.sha256(token.encode("utf-8")).hexdigest(), dbid)
+        tenant = self._tenants.get(key)
+        if tenant is not None:
+            self._tenants.move_to_end(key)
+            tenant.last_used = time.monotonic()
+            return tenant.client
+
+        # concurrent requests for a tenant that isn't connected yet wait on the same setup
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self._pending[key] = pending
+        try:
+            self._make_room(reserve=1)
+            logger.debug(f"Client not in cache for DB: {dbid}")
+            client = await AstraVectorDataStore().setupSession(token, dbid)
+            self._tenants[key] = _Tenant(client)
+            self._make_room(reserve=0)
+            pending.set_result(client)
+            return client
+        except Exception as e:
+            pending.set_exception(e)
+            # nobody else may be waiting, don't let the loop complain about an unretrieved exception
+            pending.exception()
+            raise
+        except BaseException:
+            pending.cancel()
+            raise
+        finally:
+            del self._pending[key]
+            self._refresh_metrics()
+
+    @contextmanager
+    def hold(self, client: CassandraClient):
+        """Keep `client` from being evicted while background work (e.g. file ingestion) uses it."""
+        tenant = next((tenant for tenant in self._tenants.values() if tenant.client is client), None)
+        if tenant is not None:
+            tenant.holds += 1
+        try:
+            yield client
+        finally:
+            if tenant is not None:
+                tenant.holds -= 1
+                tenant.last_used = time.monotonic()
+
+    def start(self):
+        """Sample the pool gauges every METRICS_REFRESH_SECONDS on the running loop."""
+        if self._metrics_task is None:
+            self._metrics_task = asyncio.get_running_loop().create_task(self._sample_metrics())
+
+    def shutdown(self):
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+            self._metrics_task = None
+        while self._tenants:
+            _, tenant = self._tenants.popitem(last=False)
+            self._shutdown(tenant, "shutdown")
+        self._refresh_metrics()
+
+    def stats(self) -> Dict[str, int]:
+        connections, in_flight = self._totals()
+        return {
+            "clusters": len(self._tenants),
+            "connections": connections,
+            "in_flight": in_flight,
+            "max_clusters": self.max_clusters,
+            "max_connections": self.max_connections,
+        }
+
+    def _make_room(self, reserve: int):
+        """Evict idle clusters until `reserve` more fit under both caps."""
+        while len(self._tenants) + reserve > self.max_clusters:
+            if not self._evict_idle("max_clusters"):
+                logger.warning(f"{len(self._tenants)} clusters open and all of them are busy")
+                break
+
+        while self._totals()[0] >= self.max_connections and reserve > 0:
+            if not self._evict_idle("max_connections"):
+                raise HTTPException(
+                    status_code=503,
+                    detail="Too many open database connections on this server, please retry shortly.",
+                )
+
+    def _evict_idle(self, reason: str) -> bool:
+        now = time.monotonic()
+        for key, tenant in self._tenants.items():
+            if tenant.holds == 0 and now - tenant.last_used > self.grace and tenant.pool_state()[1] == 0:
+                del self._tenants[key]
+                self._shutdown(tenant, reason)
+                return True
+        return False
+
+    def _shutdown(self, tenant: _Tenant, reason: str):
+        logger.info(f"shutting down cluster for DB: {tenant.client.dbid} ({reason})")
+        EVICTIONS.labels(reason).inc()
+        try:
+            tenant.client.shutdown()
+        except Exception as e:
+            logger.warning(f"failed to shut down cluster for DB: {tenant.client.dbid}: {e}")
+
+    def _totals(self) -> Tuple[int, int]:
+        connections = 0
+        in_flight = 0
+        for tenant in self._tenants.values():
+            tenant_connections, tenant_in_flight = tenant.pool_state()
+            connections += tenant_connections
+            in_flight += tenant_in_flight
+        return connections, in_flight
+
+    async def _sample_metrics(self):
+        while True:
+            await asyncio.sleep(METRICS_REFRESH_SECONDS)
+            try:
+                self._refresh_metrics()
+            except Exception as e:
+                logger.warning(f"failed to sample connection metrics: {e}")
+
+    def _refresh_metrics(self):
+        connections, in_flight = self._totals()
+        CLUSTERS.set(len(self._tenants))
+        POOL_CONNECTIONS.set(connections)
+        IN_FLIGHT.set(in_flight)
+
+
+connection_manager = TenantConnectionManager()
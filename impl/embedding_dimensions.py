@@ -0,0 +1,93 @@
+import logging
+import re
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# widths of the default output of well known embedding models, models that take a `dimensions` argument
+# report what was asked for instead
+KNOWN_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "embed-english-v3.0": 1024,
+    "embed-multilingual-v3.0": 1024,
+    "embed-english-light-v3.0": 384,
+    "embed-multilingual-light-v3.0": 384,
+    "embed-english-v2.0": 4096,
+    "amazon.titan-embed-text-v1": 1536,
+    "amazon.titan-embed-text-v2:0": 1024,
+    "cohere.embed-english-v3": 1024,
+    "cohere.embed-multilingual-v3": 1024,
+    "voyage-2": 1024,
+    "voyage-large-2": 1536,
+    "voyage-code-2": 1536,
+    "mistral-embed": 1024,
+    "textembedding-gecko": 768,
+    "text-embedding-004": 768,
+    "nomic-embed-text": 768,
+}
+
+_VECTOR_TYPE = re.compile(r"vector<\s*float\s*,\s*(\d+)\s*>", re.IGNORECASE)
+
+
+def dimension_from_type(cql_type: str) -> Optional[int]:
+    """N for a `vector<float, N>` column type, None for anything else."""
+    match = _VECTOR_TYPE.fullmatch(cql_type.strip())
+    return int(match.group(1)) if match else None
+
+
+def known_dimension(model: str, litellm_kwargs: Dict[str, Any]) -> Optional[int]:
+    if litellm_kwargs.get("dimensions") is not None:
+        return int(litellm_kwargs["dimensions"])
+    dims = KNOWN_DIMENSIONS.get(model)
+    if dims is None and "/" in model:
+        # provider prefixed names, e.g. openai/text-embedding-3-small or bedrock/amazon.titan-embed-text-v1
+        dims = KNOWN_DIMENSIONS.get(model.split("/", 1)[1])
+    return dims
+
+
+class EmbeddingDimensionRegistry:
+    """Vector width of each embedding model, so adding a column for a model doesn't need a live embedding request.
+
+    Looked up in order: the built-in KNOWN_DIMENSIONS, this worker's memory, then the `embedding_dimensions` table
+    in the tenant keyspace, which every worker shares. `infer` (a provider round trip) is the last resort, and
+    whatever it returns is written back to the table.
+    """
+
+    def __init__(self, session, prepare: Callable[[str], Any], keyspace: str):
+        self.session = session
+        self.prepare = prepare
+        self._dimensions: Dict[str, int] = {}
+        self._select = f"SELECT dimensions FROM {keyspace}.embedding_dimensions WHERE model = ?"
+        self._insert = f"INSERT INTO {keyspace}.embedding_dimensions (model, dimensions) VALUES (?, ?)"
+
+    def get(self, model: str, litellm_kwargs: Dict[str, Any], infer: Callable[[], int]) -> int:
+        dims = known_dimension(model, litellm_kwargs)
+        if dims is not None:
+            return dims
+        dims = self._dimensions.get(model)
+        if dims is not None:
+            return dims
+
+        try:
+            row = self.session.execute(self.prepare(self._select), (model,)).one()
+            dims = row.dimensions if row is not None else None
+        except Exception as e:
+            logger.warning(f"failed to read embedding dimension for {model}: {e}")
+        if dims is None:
+            logger.info(f"inferring embedding dimension for {model} with an embedding request")
+            dims = infer()
+            self.learn(model, dims)
+        self._dimensions[model] = dims
+        return dims
+
+    def learn(self, model: str, dims: int):
+        """Record a width seen elsewhere, e.g. the length of an embedding or the type of an existing column."""
+        if self._dimensions.get(model) == dims or known_dimension(model, {}) == dims:
+            return
+        self._dimensions[model] = dims
+        try:
+            self.session.execute(self.prepare(self._insert), (model, dims))
+        except Exception as e:
+            logger.warning(f"failed to record embedding dimension for {model}: {e}")
@@ -0,0 +1,210 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge
+
+from impl.astra_vector import CassandraClient
+from impl.connection_manager import connection_manager
+from impl.models import DocumentChunk
+from impl.services.chunks import iter_document_chunks
+from impl.services.embedding_cache import CHUNK_DEDUP
+from impl.services.embedding_pipeline import embed_texts, embed_texts_deduplicated
+from impl.services.file import iter_text_from_filepath
+
+logger = logging.getLogger(__name__)
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 4))
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", 32))
+# chunks extracted, embedded and written together, bounds how much of a file a job holds in memory
+INGESTION_CHUNK_BATCH = int(os.getenv("INGESTION_CHUNK_BATCH", 512))
+# how often a running job writes its progress counters to the files table
+INGESTION_PROGRESS_INTERVAL_SECONDS = float(os.getenv("INGESTION_PROGRESS_INTERVAL_SECONDS", 2))
+
+QUEUE_DEPTH = Gauge(
+    name="file_ingestion_queue_depth",
+    documentation="File ingestion jobs waiting for a worker.",
+    multiprocess_mode="livesum",
+)
+JOBS = Counter(
+    name="file_ingestion_jobs_total",
+    documentation="File ingestion jobs by result (processed, error, rejected).",
+    labelnames=("result",),
+)
+CHUNKS = Counter(
+    name="file_ingestion_chunks_total",
+    documentation="Chunks of ingested files by whether their embedding was computed or reused (embedded, reused).",
+    labelnames=("source",),
+)
+
+# files keep the OpenAI file statuses, vector store files use the vector store ones
+FILE_STATUS_IN_PROGRESS = "uploaded"
+FILE_STATUS_COMPLETED = "processed"
+FILE_STATUS_FAILED = "error"
+
+
+def vector_store_file_status(file: Optional[Dict[str, Any]]) -> str:
+    if file is None or file.get("status") in (FILE_STATUS_COMPLETED, "success"):
+        return "completed"
+    if file.get("status") == FILE_STATUS_FAILED:
+        return "failed"
+    if file.get("status") == FILE_STATUS_IN_PROGRESS and file.get("purpose") == "assistants":
+        return "in_progress"
+    return "completed"
+
+
+class IngestionJob:
+    def __init__(
+            self,
+            astradb: CassandraClient,
+            file_id: str,
+            path: str,
+            mimetype: Optional[str],
+            format: str,
+            embedding_model: str,
+            litellm_kwargs: Dict[str, Any],
+    ):
+        self.astradb = astradb
+        self.file_id = file_id
+        self.path = path
+        self.mimetype = mimetype
+        self.format = format
+        self.embedding_model = embedding_model
+        self.litellm_kwargs = litellm_kwargs
+        # only known once the whole file has been chunked
+        self.chunks_total: Optional[int] = None
+        self.chunks_completed = 0
+        self.chunks_reused = 0
+        self.progress_saved_at = 0.0
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if not CHUNK_DEDUP:
+            embeddings = await embed_texts(texts, model=self.embedding_model, **self.litellm_kwargs)
+            CHUNKS.labels("embedded").inc(len(texts))
+            return embeddings
+        embeddings, reused = await embed_texts_deduplicated(
+            texts, self.embedding_model, store=self.astradb.chunk_embedding_store, **self.litellm_kwargs
+        )
+        self.chunks_reused += reused
+        CHUNKS.labels("reused").inc(reused)
+        CHUNKS.labels("embedded").inc(len(texts) - reused)
+        return embeddings
+
+    async def save_progress(self, status_details: str, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.progress_saved_at < INGESTION_PROGRESS_INTERVAL_SECONDS:
+            return
+        self.progress_saved_at = now
+        await self.astradb.update_file_status_async(
+            self.file_id, FILE_STATUS_IN_PROGRESS, status_details, self.chunks_total, self.chunks_completed,
+            self.chunks_reused,
+        )
+
+
+class IngestionPool:
+    """Ingests uploaded files in the background, `workers` jobs at a time, 503 once `queue_size` jobs wait."""
+
+    def __init__(self, workers: int = INGESTION_WORKERS, queue_size: int = INGESTION_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, job: IngestionJob):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._tasks = [
+                asyncio.create_task(self._work(), name=f"ingestion-worker-{i}") for i in range(self.workers)
+            ]
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            JOBS.labels("rejected").inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Too many files are being processed on this server, please retry shortly.",
+                headers={"Retry-After": "5"},
+            )
+        QUEUE_DEPTH.set(self._queue.qsize())
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error(f"failed to record the outcome of ingesting {job.file_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: IngestionJob):
+        with connection_manager.hold(job.astradb):
+            try:
+                await job.save_progress("extracting text", force=True)
+                # text is extracted, chunked, embedded and written a batch of chunks at a time, the next batch is
+                # extracted while the current one is embedded
+                document_chunks = iter_document_chunks(
+                    job.file_id, iter_text_from_filepath(job.path, job.mimetype), None, job.format
+                )
+                next_batch = asyncio.ensure_future(asyncio.to_thread(take, document_chunks, INGESTION_CHUNK_BATCH))
+                try:
+                    while batch := await next_batch:
+                        next_batch = asyncio.ensure_future(
+                            asyncio.to_thread(take, document_chunks, INGESTION_CHUNK_BATCH)
+                        )
+                        embeddings = await job.embed([chunk.text for chunk in batch])
+                        for chunk, embedding in zip(batch, embeddings):
+                            chunk.embedding = embedding
+                        await job.astradb.upsert_chunks_async(
+                            {job.file_id: batch}, job.embedding_model, **job.litellm_kwargs
+                        )
+                        job.chunks_completed += len(batch)
+                        await job.save_progress("embedding")
+                finally:
+                    # the thread extracting the next batch can't be interrupted, it reads the file that is removed
+                    # below and its outcome decides nothing once the job is done, so wait for it before going on
+                    await asyncio.wait({next_batch})
+                    if not next_batch.cancelled():
+                        next_batch.exception()
+                job.chunks_total = job.chunks_completed
+                await job.astradb.update_file_status_async(
+                    job.file_id, FILE_STATUS_COMPLETED, None, job.chunks_total, job.chunks_total, job.chunks_reused
+                )
+                JOBS.labels("processed").inc()
+                logger.info(f"File processed {job.file_id} ({job.chunks_total} chunks, {job.chunks_reused} reused)")
+            except (Exception, asyncio.CancelledError) as e:
+                if isinstance(e, asyncio.CancelledError):
+                    detail = "File processing was interrupted by a server shutdown, please resubmit the file."
+                else:
+                    detail = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.error(f"failed to ingest {job.file_id}: {detail}")
+                JOBS.labels("error").inc()
+                await job.astradb.update_file_status_async(
+                    job.file_id, FILE_STATUS_FAILED, detail, job.chunks_total, job.chunks_completed, job.chunks_reused
+                )
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+            finally:
+                try:
+                    os.remove(job.path)
+                except FileNotFoundError:
+                    pass
+
+
+def take(chunks: Iterator[DocumentChunk], n: int) -> List[DocumentChunk]:
+    return list(itertools.islice(chunks, n))
+
+
+ingestion_pool = IngestionPool()
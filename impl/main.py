@@ -15,6 +15,9 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 
 from impl.background import background_task_set
+from impl.connection_manager import connection_manager
+from impl.ingestion import ingestion_pool
+from impl.run_events import run_event_bus
 from impl.rate_limiter import limiter
 from impl.routes import stateless, assistants, files, health, threads
 from impl.routes_v2 import assistants_v2, threads_v2, vector_stores
@@ -187,12 +190,16 @@ async def startup_event():
         timeout=300,
     )
     app.state.client = client
+    connection_manager.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     client = app.state.client
     await client.aclose()
+    await ingestion_pool.shutdown()
+    await run_event_bus.shutdown()
+    connection_manager.shutdown()
 
 
 @app.exception_handler(Exception)
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from cassandra.query import BatchStatement, BatchType
+from prometheus_client import Counter
+
+from impl.astra_vector import CASSANDRA_KEYSPACE
+from impl.run_events import run_event_bus
+from openapi_server_v2.models.message_content_text_object import (
+    MessageContentTextObject,
+)
+from openapi_server_v2.models.message_content_text_object_text import (
+    MessageContentTextObjectText,
+)
+
+logger = logging.getLogger(__name__)
+
+# how often the text of a message being generated is saved while streams follow its run
+MESSAGE_CHECKPOINT_SECONDS = float(os.getenv("MESSAGE_CHECKPOINT_SECONDS", 1))
+# how often it is saved when no stream on this worker follows the run. Streams on hosts the run's events don't reach
+# and GET /messages pollers read the checkpoints, 0 only writes the completed message.
+MESSAGE_CHECKPOINT_IDLE_SECONDS = float(os.getenv("MESSAGE_CHECKPOINT_IDLE_SECONDS", 3))
+# pending checkpoints of every run on the worker are written together every FLUSH, in batches of up to BATCH_BYTES
+MESSAGE_CHECKPOINT_FLUSH_SECONDS = float(os.getenv("MESSAGE_CHECKPOINT_FLUSH_SECONDS", 0.5))
+MESSAGE_CHECKPOINT_BATCH_BYTES = int(os.getenv("MESSAGE_CHECKPOINT_BATCH_BYTES", 32 * 1024))
+# deltas of messages whose run never completed are dropped after this long
+MESSAGE_DELTAS_TTL_SECONDS = int(os.getenv("MESSAGE_DELTAS_TTL_SECONDS", 24 * 3600))
+
+# a message's deltas are clustered by their character offset in its text: appending one is idempotent and a reader
+# that has the first N characters reads the rest with position >= N
+DELTA_INSERT = f"""insert into {CASSANDRA_KEYSPACE}.message_deltas (
+        thread_id, message_id, position, delta
+    ) VALUES (?, ?, ?, ?) USING TTL ? AND TIMESTAMP ?;"""
+DELTAS_DELETE = f"delete from {CASSANDRA_KEYSPACE}.message_deltas USING TIMESTAMP ? WHERE thread_id = ? AND message_id = ?;"
+DELTAS_SELECT = (
+    f"SELECT position, delta FROM {CASSANDRA_KEYSPACE}.message_deltas "
+    f"WHERE thread_id = ? AND message_id = ? AND position >= ?;"
+)
+
+CHECKPOINTS = Counter(
+    name="message_checkpoints_total",
+    documentation="In-progress message checkpoints by result (written, coalesced, failed).",
+    labelnames=("result",),
+)
+CHECKPOINT_BYTES = Counter(
+    name="message_checkpoint_bytes_total",
+    documentation="Bytes of message text written by checkpoints.",
+)
+
+# pending statements are (astradb, query, params, bytes of text)
+Pending = Tuple[object, str, tuple, int]
+
+
+class MessageCheckpointWriter:
+    """Writes the in-progress text of every message on this worker to message_deltas, in unlogged batches."""
+
+    def __init__(self, flush_seconds: float = MESSAGE_CHECKPOINT_FLUSH_SECONDS,
+                 batch_bytes: int = MESSAGE_CHECKPOINT_BATCH_BYTES):
+        self.flush_seconds = flush_seconds
+        self.batch_bytes = batch_bytes
+        self._pending: Dict[str, Pending] = {}
+        self._flush_scheduled = False
+
+    def append(self, astradb, thread_id, message_id, position: int, delta: str):
+        pending = self._pending.get(message_id)
+        if pending is not None and pending[1] == DELTA_INSERT:
+            CHECKPOINTS.labels("coalesced").inc()
+            position, delta = pending[2][2], pending[2][3] + delta
+        params = (thread_id, message_id, position, delta, MESSAGE_DELTAS_TTL_SECONDS, _timestamp())
+        self._queue(message_id, (astradb, DELTA_INSERT, params, len(delta.encode("utf-8"))))
+
+    def delete(self, astradb, thread_id, message_id):
+        self._queue(message_id, (astradb, DELTAS_DELETE, (_timestamp(), thread_id, message_id), 0))
+
+    def _queue(self, message_id, pending: Pending):
+        self._pending[message_id] = pending
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_later(self.flush_seconds, self._flush)
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._flush_scheduled = False
+        if pending:
+            # preparing the statements the first time blocks on the cluster, keep it off the event loop
+            asyncio.get_running_loop().run_in_executor(None, self._write, list(pending.values()))
+
+    def _write(self, pending: List[Pending]):
+        by_client: Dict[int, List[Pending]] = {}
+        for statement in pending:
+            by_client.setdefault(id(statement[0]), []).append(statement)
+        for statements in by_client.values():
+            astradb = statements[0][0]
+            try:
+                for batch in self._batches(statements):
+                    statement = BatchStatement(batch_type=BatchType.UNLOGGED)
+                    for _, query, params, _ in batch:
+                        statement.add(astradb.prepare(query), params)
+                    future = astradb.session.execute_async(statement)
+                    future.add_callbacks(self._written, self._failed, callback_args=(batch,), errback_args=(batch,))
+            except Exception as e:
+                self._failed(e, statements)
+
+    def _batches(self, statements: List[Pending]):
+        batch, size = [], 0
+        for statement in statements:
+            if batch and size + statement[3] > self.batch_bytes:
+                yield batch
+                batch, size = [], 0
+            batch.append(statement)
+            size += statement[3]
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _written(_, batch: List[Pending]):
+        CHECKPOINTS.labels("written").inc(sum(1 for _, query, _, _ in batch if query == DELTA_INSERT))
+        CHECKPOINT_BYTES.inc(sum(size for _, _, _, size in batch))
+
+    @staticmethod
+    def _failed(e, batch: List[Pending]):
+        CHECKPOINTS.labels("failed").inc(sum(1 for _, query, _, _ in batch if query == DELTA_INSERT))
+        logger.warning(f"failed to write {len(batch)} message checkpoints: {e}")
+
+
+def _timestamp() -> int:
+    # taken when a statement is queued, so a delta still waiting to be written can't outlive the message's delete
+    return int(time.time() * 1_000_000)
+
+
+message_checkpoint_writer = MessageCheckpointWriter()
+
+
+class MessageCheckpointer:
+    """Decides when a message's new text is checkpointed, call `complete` once the message is written."""
+
+    def __init__(self, astradb, thread_id, message_id, run_id,
+                 writer: MessageCheckpointWriter = message_checkpoint_writer):
+        self.astradb = astradb
+        self.thread_id = thread_id
+        self.message_id = message_id
+        self.run_id = run_id
+        self.writer = writer
+        self._saved_at = time.monotonic()
+        self._position = 0
+
+    def update(self, text: str):
+        if len(text) <= self._position:
+            return
+        interval = self.interval()
+        if interval is None:
+            return
+        now = time.monotonic()
+        if now - self._saved_at < interval:
+            return
+        self._saved_at = now
+        self.writer.append(self.astradb, self.thread_id, self.message_id, self._position, text[self._position:])
+        self._position = len(text)
+
+    def interval(self) -> Optional[float]:
+        """Seconds between checkpoints, None for no checkpoints."""
+        log = run_event_bus.get(self.run_id)
+        interval = MESSAGE_CHECKPOINT_SECONDS if log is not None and log.subscribers else MESSAGE_CHECKPOINT_IDLE_SECONDS
+        return interval if interval > 0 else None
+
+    def complete(self):
+        if self._position:
+            self.writer.delete(self.astradb, self.thread_id, self.message_id)
+
+
+async def read_message_deltas(astradb, thread_id, message_id, position: int = 0) -> str:
+    """The text checkpointed for an in-progress message from character `position` on."""
+    rows = await astradb.execute_async(astradb.prepare(DELTAS_SELECT), (thread_id, message_id, position))
+    text = ""
+    for row in rows:
+        end = position + len(text)
+        if row["position"] > end:
+            # a checkpoint that failed to write, the text after it shows up when the message completes
+            break
+        text += row["delta"]
+    return text
+
+
+def message_text_content(text: str) -> str:
+    """`text` as the content of a messages_v2 row."""
+    return json.dumps(MessageContentTextObject(
+        text=MessageContentTextObjectText(
+            value=text,
+            annotations=[],
+        ),
+        type="text"
+    ).to_dict())
@@ -7,6 +7,9 @@ from openapi_server_v2.models.open_ai_file import OpenAIFile as OpenAIFileGenera
 class OpenAIFile(OpenAIFileGenerated):
     purpose: StrictStr = Field(description="The intended purpose of the file. Supported values are `fine-tune`, `fine-tune-results`, `assistants`, `assistants_output` and `auth`.")
     embedding_model: Optional[str] = Field(default=None, description="The embedding model to use for the file. This is only required if the purpose is `assistants`.")
+    chunks_total: Optional[int] = Field(default=None, description="Number of chunks the file was split into, once known.")
+    chunks_completed: Optional[int] = Field(default=None, description="Number of chunks embedded so far.")
+    chunks_reused: Optional[int] = Field(default=None, description="Number of those chunks whose embedding was reused from identical chunks embedded before, instead of computed.")
 
     @field_validator('purpose')
     def purpose_validate_enum(cls, value):
@@ -1,3 +1,4 @@
+import os
 import time
 import logging
 from datetime import datetime
@@ -18,8 +19,8 @@ from litellm import utils
 from slowapi import Limiter
 
 from impl.astra_vector import CassandraClient
-from impl.services.chunks import get_document_chunks
-from impl.services.file import get_document_from_file
+from impl.ingestion import FILE_STATUS_FAILED, FILE_STATUS_IN_PROGRESS, IngestionJob, ingestion_pool
+from impl.services.file import spool_upload
 from openapi_server_v2.models.delete_file_response import DeleteFileResponse
 from openapi_server_v2.models.list_files_response import ListFilesResponse
 
@@ -32,7 +33,7 @@ from .utils import (
 )
 from ..model.open_ai_file import OpenAIFile
 from ..rate_limiter import limiter
-from ..utils import generate_id_from_upload_file
+from ..utils import generate_id_from_upload_file, upload_size
 
 router = APIRouter()
 
@@ -75,8 +76,7 @@ async def create_file(
         obj = "file"
         filename = file.filename
         fmt = file.content_type
-        bytes = len(file.file.read())
-        file.file.seek(0)
+        bytes = upload_size(file)
 
         content = file.file.read().decode("utf-8")
 
@@ -96,15 +96,14 @@ async def create_file(
     obj = "file"
     filename = file.filename
     fmt = file.content_type
-    bytes = len(file.file.read())
-    file.file.seek(0)
+    bytes = upload_size(file)
     existing_file = None
     try:
         existing_file = await retrieve_file(file_id, astradb)
     except HTTPException as e:
         if e.status_code != 404:
             raise HTTPException(status_code=400, detail="Error retrieving file")
-    if existing_file is not None:
+    if existing_file is not None and existing_file.status != FILE_STATUS_FAILED:
         existing_embedding_model_name_only = existing_file.embedding_model.split('/', 1)[-1]
         embedding_model_name_only = embedding_model.split('/', 1)[-1]
         if existing_embedding_model_name_only == embedding_model_name_only:
@@ -112,8 +111,6 @@ async def create_file(
         if existing_embedding_model_name_only != embedding_model_name_only:
             raise HTTPException(status_code=409, detail=f"File ({existing_file.id}) already exists but with different embedding model (existing: {existing_file.embedding_model}, requested {embedding_model}). Please delete the existing file and try again if you wish to switch models.")
     else:
-        document = await get_document_from_file(file, file_id)
-
         litellm_kwargs_embedding = litellm_kwargs[1].copy()
         triple = utils.get_llm_provider(embedding_model)
         provider = triple[1]
@@ -125,30 +122,40 @@ async def create_file(
                 litellm_kwargs_embedding.pop("aws_secret_access_key")
             if litellm_kwargs_embedding.get("aws_region_name") is not None:
                 litellm_kwargs_embedding.pop("aws_region_name")
-        logger.info("getting chunks")
-        format = file.filename.format()
-        chunks = get_document_chunks(
-            documents=[document],
-            chunk_token_size=None,
-            embedding_model=embedding_model,
-            format=format,
-            **litellm_kwargs_embedding,
-        )
-        # TODO: make this a background task
-        logger.info("upserting file and chunks")
-        openAIFile = astradb.upsert_file(
-            id=file_id,
-            object=obj,
-            purpose=purpose,
-            created_at=created_at,
-            filename=filename,
-            format=fmt,
-            bytes=bytes,
-            chunks=chunks,
-            embedding_model=embedding_model,
-            **litellm_kwargs_embedding,
-        )
-        logger.info(f"File created {openAIFile}")
+        # extracting, chunking, embedding and writing chunks can take minutes, an ingestion job does it after
+        # we return, retrieve_file reports its progress
+        path = await spool_upload(file)
+        try:
+            openAIFile = await astradb.insert_file_async(
+                id=file_id,
+                object=obj,
+                purpose=purpose,
+                created_at=created_at,
+                filename=filename,
+                format=fmt,
+                bytes=bytes,
+                embedding_model=embedding_model,
+                status=FILE_STATUS_IN_PROGRESS,
+                status_details="queued",
+            )
+            try:
+                ingestion_pool.submit(IngestionJob(
+                    astradb=astradb,
+                    file_id=file_id,
+                    path=path,
+                    mimetype=fmt,
+                    format=os.path.splitext(file.filename)[1].lstrip(".").lower(),
+                    embedding_model=embedding_model,
+                    litellm_kwargs=litellm_kwargs_embedding,
+                ))
+            except HTTPException:
+                # the queue is full, don't leave a file behind that will never be processed
+                await astradb.delete_by_pk_async(key="id", value=file_id, table="files")
+                raise
+        except BaseException:
+            os.remove(path)
+            raise
+        logger.info(f"File queued for ingestion {openAIFile}")
         return openAIFile
 
 
@@ -238,7 +245,7 @@ async def retrieve_file(
     file_id: str = Path(..., description="The ID of the file to use for this request."),
     astradb: CassandraClient = Depends(verify_db_client),
 ) -> OpenAIFile:
-    response = astradb.select_from_table_by_pk(
+    response = await astradb.select_from_table_by_pk_async(
         table="files", partition_keys=["id"], args={"id":file_id}
     )
     if len(response) > 0:
@@ -249,6 +256,9 @@ async def retrieve_file(
         embedding_model = None
         if "embedding_model" in raw_file:
             embedding_model= raw_file["embedding_model"]
+        chunks_total = raw_file.get("chunks_total")
+        chunks_completed = raw_file.get("chunks_completed")
+        chunks_reused = raw_file.get("chunks_reused")
 
         return OpenAIFile(
             id=raw_file["id"],
@@ -260,5 +270,8 @@ async def retrieve_file(
             status=raw_file["status"],
             status_details=status_details,
             embedding_model=embedding_model,
+            chunks_total=chunks_total,
+            chunks_completed=chunks_completed,
+            chunks_reused=chunks_reused,
         )
     raise HTTPException(status_code=404, detail="File not found")
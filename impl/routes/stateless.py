@@ -1,4 +1,5 @@
 """The stateless endpoints that do not depend on information from DB"""
+import asyncio
 import logging
 import time
 from typing import Any, Dict
@@ -315,8 +316,12 @@ async def create_embedding(
     if create_embedding_request.user is not None:
         litellm_kwargs["user"] = create_embedding_request.user
 
-    embedding_response = get_embeddings_response(
-        texts=create_embedding_request.input,
+    texts = create_embedding_request.input
+    texts = getattr(texts, "actual_instance", texts)
+    # not served from the embedding cache, the provider has to see the caller's credentials and bill the request
+    embedding_response = await asyncio.to_thread(
+        get_embeddings_response,
+        texts=texts,
         model=create_embedding_request.model,
         **litellm_kwargs,
     )
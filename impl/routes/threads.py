@@ -777,7 +777,7 @@ async def process_rag(
             # TODO incorporate file_ids into the search using where in
             if len(file_ids) > 0:
                 created_at = int(time.mktime(datetime.now().timetuple()))
-                context_json = astradb.annSearch(
+                context_json = await astradb.annSearch_async(
                     table="file_chunks",
                     vector_index_column="embedding",
                     search_string=search_string,
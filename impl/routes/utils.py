@@ -4,7 +4,6 @@ from json import JSONDecodeError
 from functools import lru_cache
 from typing import Any, Dict, Optional, Tuple, Type
 
-from async_lru import alru_cache
 from fastapi import Depends, Header, HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, APIKeyHeader
 from fastapi.security.utils import get_authorization_scheme_param
@@ -15,7 +14,8 @@ from starlette.background import BackgroundTask
 from starlette.responses import StreamingResponse
 from typing_extensions import Annotated
 
-from impl.astra_vector import AstraVectorDataStore, CassandraClient
+from impl.astra_vector import CassandraClient
+from impl.connection_manager import connection_manager
 
 
 def verify_server_admin(api_key: str = Depends(APIKeyHeader(name="api-key"))) -> bool:
@@ -260,15 +260,11 @@ async def forward_request(request: Request) -> StreamingResponse:
 
 # Since we may have no control over client, using global DB connections cache
 # keyed by DB ID and token instead of sessions
-@alru_cache(maxsize=128)
 async def datastore_cache(
     token: str,
     dbid: str,
 ) -> CassandraClient:
-    logger.debug(f"Client not in cache for DB: {dbid}")
-    datastore = AstraVectorDataStore()
-    client = await datastore.setupSession(token, dbid)
-    return client
+    return await connection_manager.get_client(token, dbid)
 
 
 async def verify_db_client(
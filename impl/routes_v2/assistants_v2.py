@@ -51,7 +51,7 @@ async def list_assistants(
         ),
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> ListAssistantsResponse:
-    assistants: [AssistantObject] = read_objects(
+    assistants: [AssistantObject] = await read_objects(
         astradb=astradb,
         target_class=AssistantObject,
         table_name="assistants_v2",
@@ -167,7 +167,7 @@ async def delete_assistant(
         assistant_id: str,
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> DeleteAssistantResponse:
-    astradb.delete_assistant(id=assistant_id)
+    await astradb.delete_by_pk_async(key="id", value=assistant_id, table="assistants")
     return DeleteAssistantResponse(
         id=str(assistant_id), deleted=True, object="assistant"
     )
@@ -191,7 +191,7 @@ async def get_assistant(
     return assistant.to_dict()
 
 async def get_assistant_obj(astradb, assistant_id):
-    assistant = read_object(
+    assistant = await read_object(
         astradb=astradb,
         target_class=AssistantObject,
         table_name="assistants_v2",
@@ -13,6 +13,7 @@ from starlette.responses import StreamingResponse
 
 from impl.astra_vector import CassandraClient
 from impl.background import background_task_set, add_background_task
+from impl.message_checkpoints import MessageCheckpointer, message_text_content, read_message_deltas
 from impl.model_v2.create_run_request import CreateRunRequest
 from impl.model_v2.message_object import MessageObject
 from impl.model_v2.modify_message_request import ModifyMessageRequest
@@ -21,8 +22,17 @@ from impl.routes.files import retrieve_file
 from impl.routes.utils import verify_db_client, get_litellm_kwargs, infer_embedding_model, infer_embedding_api_key
 from impl.routes_v2.assistants_v2 import get_assistant_obj
 from impl.routes_v2.vector_stores import read_vsf
+from impl.run_events import MESSAGE_DELTA, RUN_STATUS, RUN_STEP_COMPLETED, TERMINAL_RUN_STATUSES, run_event_bus
+from impl.services.context_window import (
+    CONTEXT_PAGE_SIZE,
+    CONTEXT_RETRIEVAL_SHARE,
+    message_tokens,
+    pack_chunks,
+    prompt_budget,
+    select_history,
+)
 from impl.services.inference_utils import get_chat_completion, get_async_chat_completion_response
-from impl.utils import map_model, store_object, read_object, read_objects, generate_id
+from impl.utils import map_model, store_object, read_object, generate_id, rows_to_objects
 from openapi_server_v2.models.assistants_api_response_format_option import AssistantsApiResponseFormatOption
 from openapi_server_v2.models.assistants_api_tool_choice_option import AssistantsApiToolChoiceOption
 from openapi_server_v2.models.message_delta_object_delta_content_inner import MessageDeltaObjectDeltaContentInner
@@ -101,14 +111,14 @@ async def create_thread(
             message = MessageObject.from_dict(raw_message)
             messages.append(message)
 
-            astradb.upsert_table_from_base_model("messages_v2", message)
+            await astradb.upsert_table_from_base_model_async("messages_v2", message)
 
     thread = map_model(
         source_instance=create_thread_request,
         target_model_class=ThreadObject,
         extra_fields={"object": "thread", "id": thread_id, "created_at": created_at}
     )
-    return astradb.upsert_table_from_base_model("threads", thread)
+    return await astradb.upsert_table_from_base_model_async("threads", thread)
 
 @router.get(
     "/threads/{thread_id}",
@@ -124,7 +134,7 @@ async def get_thread(
         thread_id: str = Path(..., description="The ID of the thread to retrieve."),
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> ThreadObject:
-    return astradb.get_thread(thread_id)
+    return await astradb.get_thread_async(thread_id)
 
 
 @router.post(
@@ -143,7 +153,7 @@ async def modify_thread(
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> ThreadObject:
     metadata = modify_thread_request.metadata
-    return astradb.upsert_thread(
+    return await astradb.upsert_thread_async(
         id=thread_id,
         object="thread",
         created_at=None,
@@ -164,7 +174,7 @@ async def delete_thread(
         thread_id: str = Path(..., description="The ID of the thread to delete."),
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> DeleteThreadResponse:
-    astradb.delete_by_pk(table="threads", key="id", value=thread_id)
+    await astradb.delete_by_pk_async(table="threads", key="id", value=thread_id)
     return DeleteThreadResponse(
         id=thread_id,
         object="thread",
@@ -230,17 +240,25 @@ async def get_message(
         message_id: str = Path(..., description="The ID of the message to retrieve."),
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> MessageObject:
-    messages = astradb.select_from_table_by_pk(
-        table="messages_v2",
-        partition_keys=["id", "thread_id"],
-        args={"id": message_id, "thread_id": thread_id},
-        allow_filtering=True
-    )
+    messages = await astradb.select_by_id_async("messages_v2", "thread_id", thread_id, message_id)
     if len(messages) == 0:
         raise HTTPException(status_code=404, detail="Message not found.")
+    await merge_message_deltas(astradb, messages)
     message = messages_json_to_objects(messages)[0]
     return message
 
+
+async def merge_message_deltas(astradb, raw_messages):
+    """Messages being generated keep their text in message_deltas until it is compacted into their row."""
+    in_progress = [raw for raw in raw_messages if raw.get("status") == "in_progress" and raw.get("role") == "assistant"]
+    texts = await asyncio.gather(*[
+        read_message_deltas(astradb, raw["thread_id"], raw["id"]) for raw in in_progress
+    ])
+    for raw_message, text in zip(in_progress, texts):
+        if text:
+            raw_message["content"] = [message_text_content(text)]
+
+
 def messages_json_to_objects(raw_messages):
     messages = []
     for raw_message in raw_messages:
@@ -307,7 +325,7 @@ async def delete_message(
         message_id: str = Path(..., description="The ID of the message to delete."),
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> DeleteMessageResponse:
-    astradb.delete_by_pks(table="messages", keys=["id", "thread_id"], values=[message_id, thread_id])
+    await astradb.delete_by_pks_async(table="messages", keys=["id", "thread_id"], values=[message_id, thread_id])
     return DeleteMessageResponse(
         id=message_id,
         object="thread.message.deleted",
@@ -481,7 +499,7 @@ async def run_event_stream(run, message_id, astradb):
             #yield f"data: {event_json}\n\n"
 
             # persist run step
-            astradb.upsert_run_step(run_step)
+            await astradb.upsert_run_step_async(run_step)
 
             async for event in yield_event_from_object(obj=run, target_class=RunStreamEvent, obj_status=run.status, event=f"thread.run.{run.status}"):
                 yield event
@@ -494,7 +512,7 @@ async def run_event_stream(run, message_id, astradb):
         # this works because we make the run_step id the same as the message_id
         run_step_id = message_id.replace("msg_", "step_")
         try:
-            run_step = read_object(
+            run_step = await read_object(
                 astradb=astradb,
                 target_class=RunStepObject,
                 table_name="run_steps",
@@ -534,8 +552,17 @@ async def run_event_stream(run, message_id, astradb):
             #    retrieval_tool_call_deltas.append(tool_call)
             # tool_call_delta_object = ToolCallDeltaObject(type="tool_calls", tool_calls=retrieval_tool_call_deltas)
 
+            run_events = await run_event_bus.find(run.id, astradb.run_event_store)
+            if run_events is not None:
+                async for run_event in run_events.follow():
+                    if run_event.type == RUN_STEP_COMPLETED:
+                        run_step = RunStepObject.from_dict(run_event.data)
+                        break
+                    if run_event.type == RUN_STATUS and run_event.data in TERMINAL_RUN_STATUSES:
+                        break
+            # the run executes on another worker, poll for its progress
             while run_step.status != "completed":
-                run_step = read_object(
+                run_step = await read_object(
                     astradb=astradb,
                     target_class=RunStepObject,
                     table_name="run_steps",
@@ -568,7 +595,12 @@ async def run_event_stream(run, message_id, astradb):
             #event_json = event.json()
             #yield f"data: {event_json}\n\n"
 
-        async for event in stream_message_events(astradb, run.thread_id, 1, "desc", None, None, run):
+        run_events = await run_event_bus.find(run.id, astradb.run_event_store)
+        if run_events is not None:
+            message_events = stream_run_message_events(astradb, run, message_id, run_events)
+        else:
+            message_events = stream_message_events(astradb, run.thread_id, 1, "desc", None, None, run)
+        async for event in message_events:
             yield event
     except Exception as e:
         # This usually means the client is broken
@@ -627,10 +659,10 @@ async def stream_message_events(astradb, thread_id, limit, order, after, before,
         if run_id is None:
             run_id = messages[0].run_id
         while True:
-            message = await get_message(thread_id, last_message.id, astradb)
-            if message.content != last_message.content:
-
-                message_delta, last_message_length = await extract_message_delta(message, last_message_length, i)
+            # only the text checkpointed since the last poll
+            text_delta = await read_message_deltas(astradb, thread_id, last_message.id, last_message_length)
+            if text_delta:
+                message_delta = make_message_delta(last_message.id, last_message.role, text_delta, i)
                 async for event in yield_event_from_object(
                         obj=message_delta,
                         target_class=MessageStreamEvent,
@@ -641,14 +673,14 @@ async def stream_message_events(astradb, thread_id, limit, order, after, before,
                 #                                                       last_message_length)
                 #event_json = await make_text_delta_event(i, json_data, message, run)
                 #yield f"data: {event_json}\n\n"
-                last_message.content = message.content
+                last_message_length += len(text_delta)
             await asyncio.sleep(1)
             assert run_id is not None, "run_id missing from message"
             run = await read_run(thread_id, run_id, astradb)
             if (run.status == "completed"):
-                # do a final pass
+                # do a final pass over the completed message
                 message = await get_message(thread_id, last_message.id, astradb)
-                if message.content != last_message.content:
+                if message.content and len(message.content[0].text.value) > last_message_length:
 
                     message_delta, last_message_length = await extract_message_delta(message, last_message_length, i)
 
@@ -671,6 +703,34 @@ async def stream_message_events(astradb, thread_id, limit, order, after, before,
 
 
 
+async def stream_run_message_events(astradb, run, message_id, run_events):
+    """stream_message_events for a run executing on this worker, its deltas are forwarded as they are generated."""
+    try:
+        message = await get_message(run.thread_id, message_id, astradb)
+        async for event in yield_events_from_object(
+            obj=message,
+            target_class=MessageStreamEvent,
+            obj_statuses=["in_progress", "in_progress"],
+            events=["thread.message.created", "thread.message.in_progress"],
+            extra_fields={"content": []}
+        ):
+            yield event
+
+        async for run_event in run_events.follow():
+            if run_event.type == MESSAGE_DELTA and run_event.message_id == message_id:
+                message_delta = make_message_delta(message_id, message.role, run_event.data, 0)
+                async for event in yield_event_from_object(
+                        obj=message_delta,
+                        target_class=MessageStreamEvent,
+                        event="thread.message.delta"
+                ):
+                    yield event
+            elif run_event.type == RUN_STATUS and run_event.data in TERMINAL_RUN_STATUSES:
+                break
+    except Exception as e:
+        logger.error(e)
+
+
 # TODO - add attachments?
 async def init_message(thread_id, assistant_id, run_id, astradb, created_at, content=None):
     if content is None:
@@ -745,12 +805,21 @@ async def create_run(
         model = assistant.model
         tool_resources = assistant.tool_resources
 
-    messages = get_messages_by_thread(astradb, thread_id, order="asc")
-
     instructions = create_run_request.instructions
     if instructions is None:
         instructions = assistant.instructions
 
+    budget = prompt_budget(model, create_run_request.max_prompt_tokens, create_run_request.max_completion_tokens)
+    if create_run_request.max_completion_tokens is not None:
+        litellm_kwargs[0]["max_tokens"] = create_run_request.max_completion_tokens
+    history_budget = budget
+    if any(tool.actual_instance.type == "file_search" for tool in tools):
+        # leave room for the chunks file_search retrieves
+        history_budget = int(budget * (1 - CONTEXT_RETRIEVAL_SHARE))
+    message_content = await build_run_context(
+        astradb, thread_id, instructions, model, history_budget, create_run_request.truncation_strategy
+    )
+
     toolsJson = []
     if len(tools) == 0:
 
@@ -761,16 +830,16 @@ async def create_run(
             run_id,
             thread_id,
             tool_resources,
-            messages.data,
+            message_content,
             model,
-            instructions,
             astradb,
             litellm_kwargs,
             embedding_model,
             assistant.id,
             message_id,
             embedding_api_key,
-            created_at
+            created_at,
+            budget,
         )
         await add_background_task(function=bkd_task, run_id=run_id, thread_id=thread_id, astradb=astradb)
 
@@ -819,16 +888,15 @@ async def create_run(
                 usage=None,
             )
             logger.info(f"creating run_step {run_step}")
-            astradb.upsert_run_step(run_step)
+            await astradb.upsert_run_step_async(run_step)
 
             # async calls to rag
             bkd_task = process_rag(
                 run_id,
                 thread_id,
                 tool_resources,
-                messages.data,
+                message_content,
                 model,
-                instructions,
                 astradb,
                 litellm_kwargs,
                 embedding_model,
@@ -836,6 +904,7 @@ async def create_run(
                 message_id,
                 embedding_api_key,
                 created_at,
+                budget,
                 run_step.id
             )
             await add_background_task(function=bkd_task, run_id=run_id, thread_id=thread_id, astradb=astradb)
@@ -852,7 +921,6 @@ async def create_run(
             litellm_kwargs[0]["tool_choice"] = create_run_request.tool_choice.to_dict()
         else:
             litellm_kwargs[0]["tool_choice"] = "auto"
-        message_content = summarize_message_content(instructions, messages.data, False)
         message = await get_chat_completion(messages=message_content, model=model, **litellm_kwargs[0])
 
         tool_call_object_id = generate_id("call")
@@ -989,6 +1057,7 @@ async def update_run_status(thread_id, id, status, astradb):
         response_format=None,
     )
     run = await store_object(astradb=astradb, obj=obj, target_class=RunObject, table_name="runs_v2", extra_fields={})
+    run_event_bus.publish(id, RUN_STATUS, status)
     return run
 
 
@@ -1026,43 +1095,54 @@ async def store_run(id, created_at, thread_id, assistant_id, status, required_ac
         "response_format": response_format,
 
     }
-    run = await store_object(astradb=astradb, obj=create_run_request, target_class=RunObject, table_name="runs_v2", extra_fields=extra_fields)
+    run, _ = await asyncio.gather(
+        store_object(astradb=astradb, obj=create_run_request, target_class=RunObject, table_name="runs_v2", extra_fields=extra_fields),
+        astradb.upsert_table_from_dict_async(
+            "runs_v2_by_created_at", {"thread_id": thread_id, "created_at": created_at, "id": id}
+        ),
+    )
     return run
 
 
-def summarize_message_content(instructions, messages, filter_user_messages=False):
-    message_content = []
-    if instructions is None:
-        instructions = ""
-    message_content.append({"role": "system", "content": instructions})
-    for message in messages:
-        role = message.role
-        contentList = message.content
-        for content in contentList:
-            message_content.append({"role": role, "content": content.text.value})
-
-    # filter messages to only include user messages
-    user_content = [message for message in message_content if message["role"] == "user"]
-
-    if filter_user_messages:
-        return user_content
-    else:
-        return message_content  # maybe trim message history?
+async def build_run_context(astradb, thread_id, instructions, model, budget, truncation_strategy):
+    """The run's instructions followed by the newest messages of the thread that fit in `budget` tokens."""
+    system_message = {"role": "system", "content": instructions or ""}
+    last_messages = None
+    if truncation_strategy is not None and truncation_strategy.type == "last_messages":
+        last_messages = truncation_strategy.last_messages
+    history, _ = await select_history(
+        iter_chat_messages(astradb, thread_id),
+        budget - message_tokens(system_message, model),
+        last_messages,
+        model,
+    )
+    return [system_message] + history
 
 
+async def iter_chat_messages(astradb, thread_id):
+    """The thread's messages as chat messages, newest first, read a page at a time as they are consumed."""
+    after = None
+    while True:
+        messages, has_more = await get_messages_page(astradb, thread_id, CONTEXT_PAGE_SIZE, "desc", after, None)
+        for message in messages:
+            for content in reversed(message.content):
+                yield {"role": message.role, "content": content.text.value}
+        if not has_more or len(messages) == 0:
+            return
+        after = messages[-1].id
 
 
 # https://platform.openai.com/docs/assistants/tools/file-search/how-it-works
 async def process_rag(
-        run_id, thread_id, tool_resources, messages, model, instructions, astradb, litellm_kwargs, embedding_model,
-        assistant_id, message_id, embedding_api_key, created_at, run_step_id=None
+        run_id, thread_id, tool_resources, context, model, astradb, litellm_kwargs, embedding_model,
+        assistant_id, message_id, embedding_api_key, created_at, budget, run_step_id=None
 ):
     try:
         logger.info(f"Processing RAG {run_id}")
         # TODO: Deal with run status better
         message_content = []
         if run_step_id is not None:
-            message_content = summarize_message_content(instructions, messages, True)
+            message_content = [message for message in context if message["role"] == "user"]
             search_string_messages = message_content.copy()
 
             # TODO: enforce this with instructor?
@@ -1090,7 +1170,7 @@ async def process_rag(
                             file_ids.append(vector_store_file.id)
             if len(file_ids) > 0:
                 created_at = int(time.mktime(datetime.now().timetuple())*1000)
-                context_json = astradb.annSearch(
+                context_json = await astradb.annSearch_async(
                     table="file_chunks",
                     vector_index_column="embedding",
                     search_string=search_string,
@@ -1158,11 +1238,13 @@ async def process_rag(
                     usage=None,
                 )
                 logger.info(f"creating run_step {run_step}")
-                astradb.upsert_run_step(run_step)
+                await astradb.upsert_run_step_async(run_step)
+                run_event_bus.publish(run_id, RUN_STEP_COMPLETED, run_step.to_dict())
 
                 user_message = message_content.pop()
                 message_content.append({"role": "system",
                                         "content": "Important, ALWAYS use the following information to craft your responses. Include the relevant file_name and chunk_id references in parenthesis as part of your response i.e. (chunk_id dbd94b44-cb13-11ee-a868-fd1abaa6ff88_18)."})
+                chunk_messages = []
                 for context in context_json_meta:
                     # TODO improve citations https://platform.openai.com/docs/guides/prompt-engineering/six-strategies-for-getting-better-results
                     content = (
@@ -1174,11 +1256,14 @@ async def process_rag(
                             + context["content"]
                             + ":\n"
                     )
-                    message_content.append({"role": "system", "content": content})
+                    chunk_messages.append({"role": "system", "content": content})
+                # the most relevant chunks that fit in what the conversation left of the budget
+                used = sum(message_tokens(message, model) for message in message_content + [user_message])
+                message_content.extend(pack_chunks(chunk_messages, budget - used, model))
                 message_content.append(user_message)
 
         else:
-            message_content = summarize_message_content(instructions, messages, False)
+            message_content = context
 
         litellm_kwargs[0]["stream"] = True
 
@@ -1207,16 +1292,14 @@ async def process_rag(
 
     try:
         text = ""
-        start_time = time.time()
-        frequency_in_seconds = 1
+        checkpointer = MessageCheckpointer(astradb, thread_id, message_id, run_id)
 
         if 'gemini' in model:
             async for part in response:
                 if part.choices[0].delta.content is not None:
                     text += part.choices[0].delta.content
-                    start_time = await maybe_checkpoint(assistant_id, astradb,
-                                                        frequency_in_seconds, message_id,
-                                                        run_id, start_time, text, thread_id, created_at)
+                    run_event_bus.publish(run_id, MESSAGE_DELTA, part.choices[0].delta.content, message_id)
+                    checkpointer.update(text)
         else:
             done = False
             while not done:
@@ -1226,13 +1309,13 @@ async def process_rag(
                     delta = part.choices[0].delta.content
                     if delta is not None and isinstance(delta, str):
                         text += delta
-                    start_time = await maybe_checkpoint(assistant_id, astradb,
-                                                        frequency_in_seconds, message_id,
-                                                        run_id, start_time, text, thread_id, created_at)
+                        run_event_bus.publish(run_id, MESSAGE_DELTA, delta, message_id)
+                    checkpointer.update(text)
 
 
         # final message upsert
         await complete_message_with_text(assistant_id, astradb, message_id, run_id, text, thread_id, created_at)
+        checkpointer.complete()
 
         await update_run_status(thread_id=thread_id, id=run_id, status="completed", astradb=astradb)
         logger.info(f"processed rag for run_id {run_id} thread_id {thread_id}")
@@ -1284,42 +1367,6 @@ async def complete_message_with_content(assistant_id, astradb, message_id, run_i
     await store_object(astradb=astradb, obj=message, target_class=MessageObject, table_name="messages_v2", extra_fields={})
 
 
-async def maybe_checkpoint(assistant_id, astradb, frequency_in_seconds, message_id, run_id,
-                           start_time, text, thread_id, created_at):
-    current_time = time.time()
-    if current_time - start_time >= frequency_in_seconds:
-        logger.info("Checkpointing message")
-        logger.debug(f"text: {text}")
-
-        content = MessageContentTextObject(
-            text=MessageContentTextObjectText(
-                value=text,
-                annotations=[],
-            ),
-            type="text"
-        )
-        message = MessageObject.construct(
-            id=message_id,
-            object="thread.message",
-            created_at=created_at,
-            thread_id=thread_id,
-            status="in_progress",
-            role="assistant",
-            content=[content],
-            assistant_id=assistant_id,
-            run_id=run_id,
-            incomplete_details=None,
-            completed_at=None,
-            incomplete_at=None,
-            metadata={},
-            attachments=None
-        )
-        await store_object(astradb=astradb, obj=message, target_class=MessageObject, table_name="messages_v2", extra_fields={})
-        start_time = time.time()
-        return start_time
-    return start_time
-
-
 @router.get(
     "/threads/{thread_id}/runs",
     responses={
@@ -1351,21 +1398,13 @@ async def list_runs(
         ),
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> ListRunsResponse:
-    runs: [RunObject] = read_objects(
-        astradb=astradb,
-        target_class=RunObject,
-        table_name="runs_v2",
-        partition_keys=[],
-        args={}
-    )
-    first_id = runs[0].id
-    last_id = runs[len(runs) - 1].id
+    runs, has_more = await get_runs_page(astradb, thread_id, limit, order, after, before)
     runs_response = ListRunsResponse(
         data=runs,
         object="assistants",
-        first_id=first_id,
-        last_id=last_id,
-        has_more=False,
+        first_id=runs[0].id if runs else "none",
+        last_id=runs[-1].id if runs else "none",
+        has_more=has_more,
     )
     return runs_response.to_dict()
 
@@ -1393,7 +1432,7 @@ async def get_run(
 
 
 async def read_run(thread_id, run_id, astradb):
-    run: RunObject = read_object(
+    run: RunObject = await read_object(
         astradb=astradb,
         target_class=RunObject,
         table_name="runs_v2",
@@ -1436,61 +1475,68 @@ async def list_messages(
     if limit is None:
         limit = 20
     # default is desc
-    messages = get_messages_by_thread(astradb, thread_id, limit, order, after, before)
+    messages = await get_messages_by_thread(astradb, thread_id, limit, order, after, before)
     return messages.to_dict()
 
 
-def get_and_process_messages(astradb, thread_id, limit, order, after, before):
-    # TODO: implement pagination
-    if after is not None or before is not None:
-        raise HTTPException(
-            status_code=500,
-            detail="Pagination is not yet implemented for this endpoint, do not pass after or before.",
-        )
-    raw_messages = None
-    # TODO fix datamodel to support sorting and limit pushdown
-    raw_messages = astradb.select_from_table_by_pk(
-        table="messages_v2", partition_keys=["thread_id"], args={"thread_id": thread_id}
-    )
-
-    # sort raw_messages by created_at desc
-    if order is None or order == "desc":
-        # First sort by 'role' in ascending order, this is a tie-breaker and assistant comes before user
-        raw_messages.sort(key=lambda x: x["role"], reverse=False)
-        # Then sort by 'created_at' in descending order, which maintains the previous ordering for ties
-        raw_messages.sort(key=lambda x: x["created_at"], reverse=True)
-    else:
-        # viceversa
-        raw_messages.sort(key=lambda x: x["role"], reverse=True)
-        raw_messages.sort(key=lambda x: x["created_at"], reverse=False)
+async def get_and_process_messages(astradb, thread_id, limit, order, after, before):
+    messages, _ = await get_messages_page(astradb, thread_id, limit, order, after, before)
+    return messages
 
-    if limit is not None:
-        raw_messages = raw_messages[:limit]
 
+async def get_messages_page(astradb, thread_id, limit, order, after, before):
+    raw_messages, has_more = await astradb.select_page_async(
+        table="messages_v2",
+        partition_key="thread_id",
+        value=thread_id,
+        limit=limit,
+        order=order,
+        after=after,
+        before=before,
+        # messages created in the same second: user messages come before the assistant's reply
+        tiebreak=lambda row: row["role"] != "user",
+    )
+    await merge_message_deltas(astradb, raw_messages)
     messages = messages_json_to_objects(raw_messages)
-    return messages
+    return messages, has_more
+
+
+async def get_runs_page(astradb, thread_id, limit, order, after, before):
+    # runs_v2 is clustered by id, the page is read from runs_v2_by_created_at and its runs looked up by id
+    index_rows, has_more = await astradb.select_page_async(
+        table="runs_v2_by_created_at",
+        partition_key="thread_id",
+        value=thread_id,
+        limit=limit,
+        order=order,
+        after=after,
+        before=before,
+    )
+    raw_runs = await astradb.select_by_ids_async(
+        table="runs_v2", partition_key="thread_id", value=thread_id, ids=[row["id"] for row in index_rows]
+    )
+    return rows_to_objects(RunObject, "runs_v2", raw_runs), has_more
 
 
-def get_messages_by_thread(astradb, thread_id, limit=None, order=None, after=None, before=None):
-    messages = get_and_process_messages(astradb, thread_id, limit, order, after, before)
+async def get_messages_by_thread(astradb, thread_id, limit=None, order=None, after=None, before=None):
+    messages, has_more = await get_messages_page(astradb, thread_id, limit, order, after, before)
 
     if len(messages) == 0:
-        return ListMessagesResponse(data=[], object="runs", first_id="none", last_id="none", has_more=False)
+        return ListMessagesResponse(data=[], object="runs", first_id="none", last_id="none", has_more=has_more)
 
     first_id = messages[0].id
     last_id = messages[len(messages) - 1].id
 
     return ListMessagesResponse(
-        data=messages, object="runs", first_id=first_id, last_id=last_id, has_more=False
+        data=messages, object="runs", first_id=first_id, last_id=last_id, has_more=has_more
     )
 
 
 async def get_and_process_assistant_messages(astradb, thread_id, limit, order, after, before):
-    messages = get_and_process_messages(astradb, thread_id, limit, order, after, before)
-
-    if len(messages) == 0 or messages[0].run_id is None:
+    messages = await get_and_process_messages(astradb, thread_id, limit, order, after, before)
+    while len(messages) == 0 or messages[0].run_id is None:
         await asyncio.sleep(1)
-        return await get_and_process_assistant_messages(astradb, thread_id, limit, order, after, before)
+        messages = await get_and_process_messages(astradb, thread_id, limit, order, after, before)
     return messages
 
 
@@ -1501,6 +1547,10 @@ async def extract_message_delta(message, last_message_length, index):
     if message.content is not None and len(message.content) > 0:
         text_delta = message.content[0].text.value[last_message_length:]
         this_message_length = len(message.content[0].text.value)
+    return make_message_delta(message.id, message.role, text_delta, index), this_message_length
+
+
+def make_message_delta(message_id, role, text_delta, index):
     # TODO maybe support annotations here?
     text_object_text = MessageDeltaContentTextObjectText(
         value=text_delta,
@@ -1511,14 +1561,14 @@ async def extract_message_delta(message, last_message_length, index):
         text=text_object_text,
     )
     message_delta = MessageDeltaObject(
-        id=message.id,
+        id=message_id,
         object='thread.message.delta',
         delta=MessageDeltaObjectDelta(
             content=[MessageDeltaObjectDeltaContentInner(actual_instance=text_object)],
-            role=message.role,
+            role=role,
         )
     )
-    return message_delta, this_message_length
+    return message_delta
 
 
 @router.post(
@@ -1549,13 +1599,24 @@ async def submit_tool_ouputs_to_run(
             raise HTTPException(status_code=404, detail="Assistant not found")
         model = assistant.model
 
-        messages = get_messages_by_thread(astradb, thread_id, order="asc")
-        message_content = summarize_message_content(assistant.instructions, messages.data)
+        tool_output_messages = []
         for tool_output in submit_tool_outputs_run_request.tool_outputs:
             # some models do not allow system messages in the middle, maybe this should be model specific?
             # message_content.append({"role": "system", "content": f"tool response for {tool_output.tool_call_id} is {tool_output.output}"})
-            message_content.append(
+            tool_output_messages.append(
                 {"role": "user", "content": f"tool response for {tool_output.tool_call_id} is {tool_output.output}"})
+        budget = prompt_budget(model, run.max_prompt_tokens, run.max_completion_tokens)
+        if run.max_completion_tokens is not None:
+            litellm_kwargs[0]["max_tokens"] = run.max_completion_tokens
+        message_content = await build_run_context(
+            astradb,
+            thread_id,
+            assistant.instructions,
+            model,
+            budget - sum(message_tokens(message, model) for message in tool_output_messages),
+            run.truncation_strategy,
+        )
+        message_content.extend(tool_output_messages)
         # TODO MAKE THIS BIT DRY
         if not submit_tool_outputs_run_request.stream:
             message = await get_chat_completion(
@@ -1702,8 +1763,7 @@ async def message_delta_streamer(message_id, created_at, response, run, astradb)
         #yield f"data: {event_json}\n\n"
 
         text = ""
-        start_time = time.time()
-        frequency_in_seconds = 1
+        checkpointer = MessageCheckpointer(astradb, run.thread_id, message_id, run.id)
         i = 0
 
         if 'gemini' in run.model:
@@ -1720,9 +1780,7 @@ async def message_delta_streamer(message_id, created_at, response, run, astradb)
                     i += 1
                     #yield f"data: {event_json}\n\n"
                     text += delta
-                    start_time = await maybe_checkpoint(run.assistant_id, astradb,
-                                                        frequency_in_seconds, message_id,
-                                                        run.id, start_time, text, run.thread_id, created_at)
+                    checkpointer.update(text)
         else:
             done = False
             while not done:
@@ -1740,9 +1798,7 @@ async def message_delta_streamer(message_id, created_at, response, run, astradb)
                             yield event
                         i += 1
                         text += delta
-                    start_time = await maybe_checkpoint(run.assistant_id, astradb,
-                                                        frequency_in_seconds, message_id,
-                                                        run.id, start_time, text, run.thread_id, created_at)
+                    checkpointer.update(text)
 
         # final message upsert
         # TODO - support annotations
@@ -1756,6 +1812,7 @@ async def message_delta_streamer(message_id, created_at, response, run, astradb)
         #content = MessageObjectContentInner(actual_instance=content_text)
         message.content = [content_text]
         await store_object(astradb=astradb, obj=message, target_class=MessageObject, table_name="messages_v2", extra_fields={})
+        checkpointer.complete()
         await update_run_status(thread_id=run.thread_id, id=run.id, status="completed", astradb=astradb)
         logger.info(f"completed run_id {run.id} thread_id {run.thread_id} with tool submission")
 
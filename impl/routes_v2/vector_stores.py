@@ -1,17 +1,20 @@
+import asyncio
 from datetime import datetime
 import logging
 import time
 
-from fastapi import APIRouter, Path, Depends, Body, Query
+from fastapi import APIRouter, Path, Depends, Body, HTTPException, Query
 
 from impl.astra_vector import CassandraClient
+from impl.ingestion import vector_store_file_status
 from impl.model_v2.vector_store_object import VectorStoreObject
 from impl.routes.utils import verify_db_client
-from impl.utils import read_object, store_object, read_objects, generate_id
+from impl.utils import read_object, store_object, read_objects, read_objects_page, generate_id
 from openapi_server_v2.models.create_vector_store_file_request import CreateVectorStoreFileRequest
 from openapi_server_v2.models.create_vector_store_request import CreateVectorStoreRequest
 from openapi_server_v2.models.list_vector_store_files_response import ListVectorStoreFilesResponse
 from openapi_server_v2.models.vector_store_file_object import VectorStoreFileObject
+from openapi_server_v2.models.vector_store_file_object_last_error import VectorStoreFileObjectLastError
 from openapi_server_v2.models.vector_store_object_file_counts import VectorStoreObjectFileCounts
 
 router = APIRouter()
@@ -35,13 +38,14 @@ async def get_vector_store(
     partition_keys = ["id"]
     args = {"id": vector_store_id}
 
-    vector_store: VectorStoreObject = read_object(
+    vector_store: VectorStoreObject = await read_object(
         astradb=astradb,
         target_class=VectorStoreObject,
         table_name="vector_stores",
         partition_keys=partition_keys,
         args=args
     )
+    await refresh_vector_store_status(vector_store, astradb)
     return vector_store
 
 
@@ -62,28 +66,23 @@ async def create_vector_store(
     created_at = int(time.mktime(datetime.now().timetuple()) * 1000)
 
     usage_bytes = 0
+    statuses = []
     for file_id in create_vector_store_request.file_ids:
         request = CreateVectorStoreFileRequest(file_id=file_id)
-        await create_vector_store_file(
+        vector_store_file = await create_vector_store_file(
             vector_store_id=vector_store_id,
             create_vector_store_file_request=request,
             astradb=astradb
         )
+        statuses.append(vector_store_file.status)
         #TODO - compute usage_bytes
 
-    file_id_count = len(create_vector_store_request.file_ids)
-    file_counts = VectorStoreObjectFileCounts(
-        in_progress=0,
-        completed=file_id_count,
-        failed=0,
-        cancelled=0,
-        total=file_id_count
-    )
+    file_counts = count_files(statuses)
     extra_fields = {
         "object": "vector_store",
         "usage_bytes": usage_bytes,
         "file_counts": file_counts,
-        "status": "completed",
+        "status": vector_store_status(file_counts),
         "id": vector_store_id,
         "created_at": created_at
     }
@@ -115,6 +114,8 @@ async def create_vector_store_file(
 ) -> VectorStoreFileObject:
     created_at = int(time.mktime(datetime.now().timetuple()) * 1000)
 
+    # files are ingested in the background, the vector store file follows the file's status
+    file = await read_file_row(create_vector_store_file_request.file_id, astradb)
     extra_fields = {
         "id": create_vector_store_file_request.file_id,
         "vector_store_id": vector_store_id,
@@ -122,7 +123,8 @@ async def create_vector_store_file(
         "created_at": created_at,
         # TODO - grab from file
         "usage_bytes": -1,
-        "status": "completed"
+        "status": vector_store_file_status(file),
+        "last_error": last_error(file),
     }
     vector_store_file: VectorStoreFileObject = await store_object(
         astradb=astradb,
@@ -153,16 +155,24 @@ async def list_vector_store_files(
         filter: str = Query(None, description="Filter by file status. One of &#x60;in_progress&#x60;, &#x60;completed&#x60;, &#x60;failed&#x60;, &#x60;cancelled&#x60;."),
         astradb: CassandraClient = Depends(verify_db_client),
 ) -> ListVectorStoreFilesResponse:
-    # TODO - support limit and paging
-    vector_store_files = await read_vsf(vector_store_id, astradb)
-    first = vector_store_files[0].id
-    last = vector_store_files[len(vector_store_files)-1].id
+    vector_store_files, has_more = await read_objects_page(
+        astradb=astradb,
+        target_class=VectorStoreFileObject,
+        table_name="vector_store_files",
+        partition_key="vector_store_id",
+        value=vector_store_id,
+        limit=limit,
+        order=order,
+        after=after,
+        before=before,
+    )
+    await refresh_in_progress(vector_store_files, astradb)
     vsf_response = ListVectorStoreFilesResponse(
         data=vector_store_files,
         object="vector_store_files",
-        first_id=first,
-        last_id=last,
-        has_more=False
+        first_id=vector_store_files[0].id if vector_store_files else "none",
+        last_id=vector_store_files[-1].id if vector_store_files else "none",
+        has_more=has_more
     )
     return vsf_response
 
@@ -171,11 +181,85 @@ async def read_vsf(vector_store_id, astradb):
     partition_keys = ["vector_store_id"]
     args = {"vector_store_id": vector_store_id}
 
-    vector_store_files: [VectorStoreFileObject] = read_objects(
+    vector_store_files: [VectorStoreFileObject] = await read_objects(
         astradb=astradb,
         target_class=VectorStoreFileObject,
         table_name="vector_store_files",
         partition_keys=partition_keys,
         args=args
     )
-    return vector_store_files
\ No newline at end of file
+    await refresh_in_progress(vector_store_files, astradb)
+    return vector_store_files
+
+
+def count_files(statuses):
+    return VectorStoreObjectFileCounts(
+        in_progress=statuses.count("in_progress"),
+        completed=statuses.count("completed"),
+        failed=statuses.count("failed"),
+        cancelled=statuses.count("cancelled"),
+        total=len(statuses)
+    )
+
+
+def vector_store_status(file_counts):
+    return "in_progress" if file_counts.in_progress > 0 else "completed"
+
+
+async def refresh_vector_store_status(vector_store: VectorStoreObject, astradb):
+    """Recount the vector store's files, which are ingested in the background and may be attached after it was
+    created."""
+    try:
+        vector_store_files = await read_vsf(vector_store.id, astradb)
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+        vector_store_files = []
+    file_counts = count_files([vector_store_file.status for vector_store_file in vector_store_files])
+    status = vector_store_status(file_counts)
+    if file_counts == vector_store.file_counts and status == vector_store.status:
+        return
+    vector_store.file_counts = file_counts
+    vector_store.status = status
+    await astradb.upsert_table_from_dict_async(table_name="vector_stores", obj={
+        "id": vector_store.id,
+        "file_counts": file_counts.to_json(),
+        "status": status,
+    })
+
+
+async def refresh_in_progress(vector_store_files, astradb):
+    await asyncio.gather(*[
+        refresh_vsf_status(vector_store_file, astradb)
+        for vector_store_file in vector_store_files if vector_store_file.status == "in_progress"
+    ])
+
+
+async def refresh_vsf_status(vector_store_file: VectorStoreFileObject, astradb):
+    """Catch an in_progress vector store file up with its file, whichever worker ingested it."""
+    file = await read_file_row(vector_store_file.id, astradb)
+    status = vector_store_file_status(file)
+    if status == vector_store_file.status:
+        return
+    vector_store_file.status = status
+    vector_store_file.last_error = last_error(file)
+    await astradb.upsert_table_from_dict_async(table_name="vector_store_files", obj={
+        "vector_store_id": vector_store_file.vector_store_id,
+        "created_at": vector_store_file.created_at,
+        "id": vector_store_file.id,
+        "status": status,
+        "last_error": vector_store_file.last_error.to_json() if vector_store_file.last_error else None,
+    })
+
+
+async def read_file_row(file_id, astradb):
+    rows = await astradb.select_from_table_by_pk_async(table="files", partition_keys=["id"], args={"id": file_id})
+    return rows[0] if len(rows) > 0 else None
+
+
+def last_error(file):
+    if file is None or vector_store_file_status(file) != "failed":
+        return None
+    return VectorStoreFileObjectLastError(
+        code="internal_error", message=file.get("status_details") or "File processing failed."
+    )
\ No newline at end of file
@@ -0,0 +1,391 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from cassandra.query import BatchStatement, BatchType
+from prometheus_client import Gauge
+
+logger = logging.getLogger(__name__)
+
+# how long the events of a finished run stay around for streams that subscribe late
+RUN_EVENTS_RETENTION_SECONDS = float(os.getenv("RUN_EVENTS_RETENTION_SECONDS", 60))
+# how streams reach runs executing in other processes, comma separated:
+#   unix - workers on the same host serve their runs' events on a unix socket each
+#   cassandra - events are appended to a run_events table, for streams on other hosts
+RUN_EVENTS_TRANSPORTS = [t.strip() for t in os.getenv("RUN_EVENTS_TRANSPORT", "unix").split(",") if t.strip()]
+# private to the user the workers run as, sockets in a directory anyone else can write to are not used
+RUN_EVENTS_SOCKET_DIR = os.getenv("RUN_EVENTS_SOCKET_DIR") or (
+    os.path.join(os.environ["XDG_RUNTIME_DIR"], "assistants-run-events") if os.getenv("XDG_RUNTIME_DIR")
+    else os.path.join(tempfile.gettempdir(), f"assistants-run-events-{os.getuid()}")
+)
+RUN_EVENTS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("RUN_EVENTS_CONNECT_TIMEOUT_SECONDS", 0.5))
+# the cassandra transport writes a run's pending events every FLUSH and followers read new ones every POLL
+RUN_EVENTS_FLUSH_SECONDS = float(os.getenv("RUN_EVENTS_FLUSH_SECONDS", 0.05))
+RUN_EVENTS_POLL_SECONDS = float(os.getenv("RUN_EVENTS_POLL_SECONDS", 0.1))
+RUN_EVENTS_TTL_SECONDS = int(os.getenv("RUN_EVENTS_TTL_SECONDS", 3600))
+# a run whose worker died never writes its closed marker, its followers give up after this long without an event
+RUN_EVENTS_IDLE_TIMEOUT_SECONDS = float(os.getenv("RUN_EVENTS_IDLE_TIMEOUT_SECONDS", 300))
+
+# event types
+MESSAGE_DELTA = "message.delta"  # data: the text appended to the message
+RUN_STEP_COMPLETED = "run_step.completed"  # data: the run step, as a dict
+RUN_STATUS = "run.status"  # data: the new status
+RUN_EVENTS_CLOSED = "closed"  # last event of a run in the cassandra log
+
+TERMINAL_RUN_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete")
+
+SUBSCRIBERS = Gauge(
+    name="run_event_subscribers",
+    documentation="Streams following the events of a run executing on this worker.",
+    multiprocess_mode="livesum",
+)
+
+
+@dataclass
+class RunEvent:
+    type: str
+    data: Any = None
+    message_id: Optional[str] = None
+    seq: int = -1
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), default=str)
+
+    @classmethod
+    def from_json(cls, line) -> "RunEvent":
+        return cls(**json.loads(line))
+
+
+class RunEventLog:
+    """Every event of one run, in order, replayed from the start to each subscriber."""
+
+    def __init__(self, run_id: str, store: Optional["CassandraRunEventStore"] = None):
+        self.run_id = run_id
+        self.store = store
+        self.events: List[RunEvent] = []
+        self.closed_at: Optional[float] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def closed(self) -> bool:
+        return self.closed_at is not None
+
+    def append(self, event: RunEvent):
+        event.seq = len(self.events)
+        self.events.append(event)
+        if self.store is not None:
+            self.store.append(self.run_id, event)
+        self._wake()
+
+    def close(self):
+        if self.closed_at is None:
+            self.closed_at = time.monotonic()
+            if self.store is not None:
+                self.store.append(self.run_id, RunEvent(type=RUN_EVENTS_CLOSED, seq=len(self.events)))
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, after: int = -1) -> AsyncIterator[RunEvent]:
+        """Events with a seq greater than `after`, as they are published, until the run's log is closed."""
+        position = after + 1
+        self.subscribers += 1
+        SUBSCRIBERS.inc()
+        try:
+            while True:
+                while position < len(self.events):
+                    yield self.events[position]
+                    position += 1
+                if self.closed:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            SUBSCRIBERS.dec()
+
+
+class UnixSocketTransport:
+    """Serves the events of this worker's runs on <socket dir>/<pid>.sock and finds runs on the other workers'."""
+
+    def __init__(self, bus: "RunEventBus", directory: str = RUN_EVENTS_SOCKET_DIR):
+        self.bus = bus
+        self.directory = directory
+        self.path: Optional[str] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._starting: Optional[asyncio.Future] = None
+
+    def start(self):
+        # the pid is only known once gunicorn has forked the worker
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._serve())
+
+    async def _serve(self):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        if not self._is_private(self.directory):
+            logger.error(f"not serving run events, {self.directory} is not a directory only this user can access")
+            return
+        self.path = os.path.join(self.directory, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path, backlog=1024)
+        logger.info(f"serving run events on {self.path}")
+
+    async def shutdown(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        self._starting = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline())
+            log = self.bus.get(request["run_id"])
+            if log is None or request.get("probe"):
+                writer.write(json.dumps({"found": log is not None}).encode("utf-8") + b"\n")
+                await writer.drain()
+                return
+            async for event in log.follow(request.get("after", -1)):
+                writer.write(event.to_json().encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError, KeyError) as e:
+            logger.debug(f"run event subscriber went away: {e}")
+        finally:
+            writer.close()
+
+    async def find(self, run_id: str) -> Optional["UnixSocketRunEvents"]:
+        if not self._is_private(self.directory):
+            return None
+        paths = [
+            path for path in glob.glob(os.path.join(self.directory, "*.sock"))
+            if path != self.path and self._is_owned(path)
+        ]
+        found = await asyncio.gather(*[self._probe(path, run_id) for path in paths])
+        for path, has_run in zip(paths, found):
+            if has_run:
+                return UnixSocketRunEvents(path, run_id)
+        return None
+
+    @staticmethod
+    def _is_private(directory: str) -> bool:
+        """makedirs doesn't check a directory that already exists, another user may have created it."""
+        try:
+            st = os.lstat(directory)
+        except FileNotFoundError:
+            return False
+        return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and st.st_mode & 0o077 == 0
+
+    @staticmethod
+    def _is_owned(path: str) -> bool:
+        try:
+            return os.lstat(path).st_uid == os.getuid()
+        except FileNotFoundError:
+            return False
+
+    async def _probe(self, path: str, run_id: str) -> bool:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(path), RUN_EVENTS_CONNECT_TIMEOUT_SECONDS
+            )
+        except ConnectionRefusedError:
+            # nobody listens, the worker that created it is gone
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return False
+        except (OSError, asyncio.TimeoutError):
+            return False
+        try:
+            writer.write(json.dumps({"run_id": run_id, "probe": True}).encode("utf-8") + b"\n")
+            await writer.drain()
+            response = await asyncio.wait_for(reader.readline(), RUN_EVENTS_CONNECT_TIMEOUT_SECONDS)
+            return json.loads(response).get("found", False)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            return False
+        finally:
+            writer.close()
+
+
+class UnixSocketRunEvents:
+    """The events of a run executing in another worker on this host."""
+
+    def __init__(self, path: str, run_id: str):
+        self.path = path
+        self.run_id = run_id
+
+    async def follow(self, after: int = -1) -> AsyncIterator[RunEvent]:
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=2 ** 24)
+        try:
+            writer.write(json.dumps({"run_id": self.run_id, "after": after}).encode("utf-8") + b"\n")
+            await writer.drain()
+            while line := await reader.readline():
+                yield RunEvent.from_json(line)
+        finally:
+            writer.close()
+
+
+class CassandraRunEventStore:
+    """Append-only log of run events in the tenant's keyspace, for streams on other hosts."""
+
+    def __init__(self, session, prepare: Callable[[str], Any], execute_async: Callable[..., Awaitable[List[Dict]]],
+                 keyspace: str, ttl: int = RUN_EVENTS_TTL_SECONDS):
+        self.session = session
+        self.prepare = prepare
+        self.execute_async = execute_async
+        self.ttl = ttl
+        self._pending: Dict[str, List[RunEvent]] = {}
+        self._flush_scheduled = False
+        self._insert = f"INSERT INTO {keyspace}.run_events (run_id, seq, event) VALUES (?, ?, ?) USING TTL ?"
+        self._select = f"SELECT event FROM {keyspace}.run_events WHERE run_id = ? AND seq > ? LIMIT ?"
+
+    def append(self, run_id: str, event: RunEvent):
+        self._pending.setdefault(run_id, []).append(event)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_later(RUN_EVENTS_FLUSH_SECONDS, self._flush)
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._flush_scheduled = False
+        # preparing the first time blocks on the cluster, keep it off the event loop
+        asyncio.get_running_loop().run_in_executor(None, self._write, pending)
+
+    def _write(self, pending: Dict[str, List[RunEvent]]):
+        try:
+            insert = self.prepare(self._insert)
+            for run_id, events in pending.items():
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for event in events:
+                    batch.add(insert, (run_id, event.seq, event.to_json(), self.ttl))
+                future = self.session.execute_async(batch)
+                future.add_errback(lambda e: logger.warning(f"failed to write run events: {e}"))
+        except Exception as e:
+            logger.warning(f"failed to write run events: {e}")
+
+    async def exists(self, run_id: str) -> bool:
+        return len(await self.read(run_id, -1, limit=1)) > 0
+
+    async def read(self, run_id: str, after: int, limit: int = 1000) -> List[RunEvent]:
+        select = await asyncio.to_thread(self.prepare, self._select)
+        rows = await self.execute_async(select, (run_id, after, limit))
+        return [RunEvent.from_json(row["event"]) for row in rows]
+
+
+class CassandraRunEvents:
+    """The events of a run executing on another host, read from its log in Cassandra."""
+
+    def __init__(self, store: CassandraRunEventStore, run_id: str,
+                 idle_timeout: float = RUN_EVENTS_IDLE_TIMEOUT_SECONDS):
+        self.store = store
+        self.run_id = run_id
+        self.idle_timeout = idle_timeout
+
+    async def follow(self, after: int = -1) -> AsyncIterator[RunEvent]:
+        last_event_at = time.monotonic()
+        while True:
+            progressed = False
+            for event in await self.store.read(self.run_id, after):
+                # batches can land out of order, stop at a gap and read it again next time
+                if event.seq != after + 1:
+                    break
+                if event.type == RUN_EVENTS_CLOSED:
+                    return
+                yield event
+                if event.type == RUN_STATUS and event.data in TERMINAL_RUN_STATUSES:
+                    return
+                after = event.seq
+                progressed = True
+            if progressed:
+                last_event_at = time.monotonic()
+            elif time.monotonic() - last_event_at > self.idle_timeout:
+                logger.warning(f"no events from run {self.run_id} for {self.idle_timeout}s, stopped following it")
+                return
+            else:
+                await asyncio.sleep(RUN_EVENTS_POLL_SECONDS)
+
+
+class RunEventBus:
+    """Pub/sub keyed by run id for the runs executing on this worker, reachable from others through the transports."""
+
+    def __init__(
+            self,
+            retention_seconds: float = RUN_EVENTS_RETENTION_SECONDS,
+            transports: List[str] = RUN_EVENTS_TRANSPORTS,
+    ):
+        self.retention_seconds = retention_seconds
+        self.unix = UnixSocketTransport(self) if "unix" in transports else None
+        self.cassandra = "cassandra" in transports
+        self._logs: Dict[str, RunEventLog] = {}
+
+    def open(self, run_id: str, store: Optional[CassandraRunEventStore] = None) -> RunEventLog:
+        self._expire()
+        if self.unix is not None:
+            self.unix.start()
+        log = self._logs.get(run_id)
+        if log is None or log.closed:
+            log = self._logs[run_id] = RunEventLog(run_id, store if self.cassandra else None)
+        return log
+
+    def get(self, run_id: str) -> Optional[RunEventLog]:
+        return self._logs.get(run_id)
+
+    async def find(self, run_id: str, store: Optional[CassandraRunEventStore] = None):
+        """Something to follow the run's events with, wherever it executes, or None to poll for its progress."""
+        log = self._logs.get(run_id)
+        if log is not None:
+            return log
+        if self.unix is not None:
+            events = await self.unix.find(run_id)
+            if events is not None:
+                return events
+        if self.cassandra and store is not None:
+            try:
+                if await store.exists(run_id):
+                    return CassandraRunEvents(store, run_id)
+            except Exception as e:
+                logger.warning(f"failed to look up run events for {run_id}: {e}")
+        return None
+
+    def publish(self, run_id: str, type: str, data: Any = None, message_id: Optional[str] = None):
+        log = self._logs.get(run_id)
+        if log is None or log.closed:
+            # not a run executing on this worker, or one that already finished
+            return
+        log.append(RunEvent(type=type, data=data, message_id=message_id))
+
+    def close(self, run_id: str):
+        log = self._logs.get(run_id)
+        if log is not None:
+            log.close()
+
+    async def shutdown(self):
+        for log in self._logs.values():
+            log.close()
+        if self.unix is not None:
+            await self.unix.shutdown()
+
+    def _expire(self):
+        now = time.monotonic()
+        for run_id in [
+            run_id for run_id, log in self._logs.items()
+            if log.closed and now - log.closed_at > self.retention_seconds
+        ]:
+            del self._logs[run_id]
+
+
+run_event_bus = RunEventBus()
@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_CACHE_TTL_SECONDS = float(os.getenv("SCHEMA_CACHE_TTL_SECONDS", 300))
+
+
+class _TableSchema:
+    def __init__(self, columns: List[Dict[str, Any]], indexes: List[str], source: Any = None):
+        self.columns = columns
+        self.indexes = indexes
+        # the driver's TableMetadata object this entry was built from, the driver swaps it out when it
+        # receives a schema change event so an identity check tells us the entry is stale
+        self.source = source
+        self.loaded_at = time.monotonic()
+
+
+class SchemaCache:
+    """Per-keyspace cache of table columns and SAI indexes.
+
+    Entries are built from the driver's cluster metadata (kept current by schema change events pushed to the
+    control connection) and fall back to a single system_schema query per table when the metadata is not available.
+    Entries expire after `ttl` seconds regardless.
+    """
+
+    def __init__(
+            self,
+            session,
+            keyspace: str,
+            query_columns: Callable[[str], List[Dict[str, Any]]],
+            query_indexes: Callable[[str], List[str]],
+            ttl: float = SCHEMA_CACHE_TTL_SECONDS,
+    ):
+        self.session = session
+        self.keyspace = keyspace
+        self._query_columns = query_columns
+        self._query_indexes = query_indexes
+        self.ttl = ttl
+        self._tables: Dict[str, _TableSchema] = {}
+        self._lock = threading.Lock()
+
+    def get_columns(self, table: str) -> List[Dict[str, Any]]:
+        return self._get(table).columns
+
+    def get_indexes(self, table: str) -> List[str]:
+        return self._get(table).indexes
+
+    def has_column(self, table: str, column_name: str) -> bool:
+        return any(column["column_name"] == column_name for column in self.get_columns(table))
+
+    def add_column(self, table: str, column_name: str, type: str):
+        with self._lock:
+            entry = self._tables.get(table)
+            if entry is None:
+                return
+            if not any(column["column_name"] == column_name for column in entry.columns):
+                entry.columns = entry.columns + [
+                    {"column_name": column_name, "kind": "regular", "type": type, "position": -1}
+                ]
+
+    def add_index(self, table: str, target: str):
+        with self._lock:
+            entry = self._tables.get(table)
+            if entry is None:
+                return
+            if target not in entry.indexes:
+                entry.indexes = entry.indexes + [target]
+
+    def invalidate(self, table: Optional[str] = None):
+        with self._lock:
+            if table is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table, None)
+
+    def _get(self, table: str) -> _TableSchema:
+        table_metadata = self._table_metadata(table)
+        with self._lock:
+            entry = self._tables.get(table)
+            if entry is not None and not self._is_stale(entry, table_metadata):
+                return entry
+
+        if table_metadata is not None:
+            entry = _TableSchema(
+                columns=columns_from_metadata(table_metadata),
+                indexes=sai_indexes_from_metadata(table_metadata),
+                source=table_metadata,
+            )
+        else:
+            logger.debug(f"no driver metadata for {self.keyspace}.{table}, querying system_schema")
+            entry = _TableSchema(columns=self._query_columns(table), indexes=self._query_indexes(table))
+
+        with self._lock:
+            self._tables[table] = entry
+        return entry
+
+    def _is_stale(self, entry: _TableSchema, table_metadata) -> bool:
+        if time.monotonic() - entry.loaded_at > self.ttl:
+            return True
+        return entry.source is not None and table_metadata is not entry.source
+
+    def _table_metadata(self, table: str):
+        try:
+            keyspace_metadata = self.session.cluster.metadata.keyspaces.get(self.keyspace)
+        except AttributeError:
+            return None
+        if keyspace_metadata is None:
+            return None
+        return keyspace_metadata.tables.get(table)
+
+
+def columns_from_metadata(table_metadata) -> List[Dict[str, Any]]:
+    """Same shape as the rows of system_schema.columns that get_columns used to return."""
+    partition_key = [column.name for column in table_metadata.partition_key]
+    clustering_key = [column.name for column in table_metadata.clustering_key]
+    columns = []
+    for name, column in table_metadata.columns.items():
+        if name in partition_key:
+            kind, position = "partition_key", partition_key.index(name)
+        elif name in clustering_key:
+            kind, position = "clustering", clustering_key.index(name)
+        elif column.is_static:
+            kind, position = "static", -1
+        else:
+            kind, position = "regular", -1
+        columns.append({"column_name": name, "kind": kind, "type": column.cql_type, "position": position})
+    return columns
+
+
+def sai_indexes_from_metadata(table_metadata) -> List[str]:
+    indexed_columns = []
+    for index in table_metadata.indexes.values():
+        options = index.index_options or {}
+        if index.kind == "CUSTOM" and "StorageAttachedIndex" in options.get("class_name", ""):
+            indexed_columns.append(options.get("target"))
+    return indexed_columns
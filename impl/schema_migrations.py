@@ -0,0 +1,392 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple, Union
+
+from cassandra import ConsistencyLevel, InvalidRequest
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """A schema change. Its phases run in order, the steps of a phase concurrently, so a phase only holds steps
+    that don't depend on the rest of the phase. A step is DDL or an async function of (astradb, keyspace) and has to
+    be safe to run again: a migration that fails halfway is run from the start on the next connect."""
+    version: int
+    description: str
+    phases: List[List[Union[str, Callable[[Any, str], Awaitable[None]]]]]
+
+
+def add_columns(table: str, columns: str) -> str:
+    return f"alter TABLE {{keyspace}}.{table} ADD {columns};"
+
+
+def sai_index(table: str, column: str, name: Optional[str] = None) -> str:
+    name = f"{name} " if name else ""
+    return (
+        f"CREATE CUSTOM INDEX IF NOT EXISTS {name}ON {{keyspace}}.{table} ({column}) "
+        f"USING 'StorageAttachedIndex';"
+    )
+
+
+async def backfill_runs_by_created_at(astradb, keyspace: str):
+    """Index the runs created before runs_v2_by_created_at existed."""
+    def backfill():
+        rows = astradb.session.execute(
+            SimpleStatement(f"SELECT thread_id, created_at, id FROM {keyspace}.runs_v2;", fetch_size=1000)
+        )
+        insert = astradb.session.prepare(
+            f"insert into {keyspace}.runs_v2_by_created_at (thread_id, created_at, id) VALUES (?, ?, ?);"
+        )
+        execute_concurrent_with_args(
+            astradb.session, insert, ((row.thread_id, row.created_at, row.id) for row in rows), concurrency=50,
+            raise_on_first_error=True,
+        )
+
+    await asyncio.to_thread(backfill)
+
+
+# append only: a keyspace's recorded version is the last migration it has, so released migrations never change.
+# Versions 1 to 6 are the schemas create_table used to create whole, keyspaces recorded by it pick up from there.
+MIGRATIONS = [
+    Migration(1, "baseline tables", [
+        [
+            """
+            create table if not exists {keyspace}.assistants (
+                id text primary key,
+                created_at timestamp,
+                name text,
+                description text,
+                model text,
+                instructions text,
+                tools List<text>,
+                file_ids List<text>,
+                metadata Map<text, text>,
+                object text
+            );""",
+            """
+            create table if not exists {keyspace}.assistants_v2 (
+                id text primary key,
+                object text,
+                created_at bigint,
+                name text,
+                description text,
+                model text,
+                instructions text,
+                tools list<text>,
+                metadata Map<text, text>,
+                tool_resources text,
+                top_p float,
+                temperature float,
+                response_format text
+            );""",
+            """
+            create table if not exists {keyspace}.files(
+                id text primary key,
+                object text,
+                purpose text,
+                created_at timestamp,
+                filename text,
+                format text,
+                bytes int,
+                status text
+            );""",
+            """
+            create table if not exists {keyspace}.file_chunks (
+                file_id text,
+                chunk_id text,
+                content text,
+                created_at timestamp,
+                embedding VECTOR<float, 1536>,
+                PRIMARY KEY ((file_id), chunk_id)
+            );""",
+            """
+            create table if not exists {keyspace}.threads (
+                    id text primary key,
+                    object text,
+                    created_at timestamp,
+                    metadata Map<text, text>
+            );""",
+            """
+            create table if not exists {keyspace}.messages (
+                    id text,
+                    object text,
+                    created_at timestamp,
+                    thread_id text,
+                    role text,
+                    content List<text>,
+                    assistant_id text,
+                    run_id text,
+                    file_ids List<text>,
+                    metadata Map<text, text>,
+                    PRIMARY KEY ((thread_id), id)
+            );""",
+            """
+            create table if not exists {keyspace}.messages_v2 (
+                    id text,
+                    object text,
+                    created_at bigint,
+                    thread_id text,
+                    status text,
+                    incomplete_details text,
+                    completed_at bigint,
+                    incomplete_at bigint,
+                    role text,
+                    content List<text>,
+                    assistant_id text,
+                    run_id text,
+                    attachments List<text>,
+                    metadata Map<text, text>,
+                    PRIMARY KEY ((thread_id), created_at, id)
+            );""",
+            """
+            create table if not exists {keyspace}.runs(
+                id text,
+                object text,
+                created_at timestamp,
+                thread_id text,
+                assistant_id text,
+                status text,
+                required_action text,
+                last_error text,
+                expires_at timestamp,
+                started_at timestamp,
+                cancelled_at timestamp,
+                failed_at timestamp,
+                completed_at timestamp,
+                model text,
+                instructions text,
+                tools list<text>,
+                file_ids list<text>,
+                metadata map<text, text>,
+                PRIMARY KEY((thread_id), id)
+            ); """,
+            """
+            create table if not exists {keyspace}.runs_v2(
+                id text,
+                object text,
+                created_at bigint,
+                assistant_id text,
+                thread_id text,
+                status text,
+                required_action text,
+                started_at bigint,
+                expires_at bigint,
+                cancelled_at bigint,
+                failed_at bigint,
+                completed_at bigint,
+                last_error text,
+                model text,
+                instructions text,
+                tools list<text>,
+                metadata map<text, text>,
+                incomplete_details text,
+                usage text,
+                temperature float,
+                top_p float,
+                max_prompt_tokens int,
+                max_completion_tokens int,
+                truncation_strategy text,
+                response_format text,
+                tool_choice text,
+                PRIMARY KEY((thread_id), id)
+            ); """,
+            """
+            create table if not exists {keyspace}.run_steps(
+                id text,
+                assistant_id text,
+                cancelled_at timestamp,
+                completed_at timestamp,
+                created_at timestamp,
+                expired_at timestamp,
+                failed_at timestamp,
+                last_error text,
+                metadata map<text, text>,
+                object text,
+                run_id text,
+                status text,
+                step_details text,
+                thread_id text,
+                type text,
+                usage text,
+                PRIMARY KEY((run_id), id)
+            ); """,
+            """
+            create table if not exists {keyspace}.vector_stores(
+                id TEXT PRIMARY KEY,
+                object TEXT,
+                created_at BIGINT,
+                usage_bytes BIGINT,
+                last_active_at BIGINT,
+                name TEXT,
+                status TEXT,
+                file_counts TEXT,
+                metadata MAP<TEXT, TEXT>,
+                expires_at BIGINT,
+                expires_after TEXT,
+            );""",
+            """
+            create table if not exists {keyspace}.vector_store_files(
+                vector_store_id TEXT,
+                id TEXT,
+                object TEXT,
+                usage_bytes INT,
+                created_at BIGINT,
+                status TEXT,
+                last_error TEXT,
+                PRIMARY KEY ((vector_store_id), created_at, id)
+            );""",
+            """
+            create table if not exists {keyspace}.schema_version (
+                keyspace_name text primary key,
+                version int,
+                updated_at timestamp
+            );""",
+        ],
+        [
+            add_columns("files", "embedding_model text"),
+            add_columns("threads", "tool_resources Map<text,text>"),
+            add_columns("file_chunks", "embedding_openai_text_embedding_ada_002 VECTOR<float, 1536>"),
+            sai_index("file_chunks", "embedding"),
+        ],
+        [
+            sai_index("file_chunks", "embedding_openai_text_embedding_ada_002"),
+        ],
+    ]),
+    Migration(2, "embedding dimension registry", [[
+        """
+            create table if not exists {keyspace}.embedding_dimensions (
+                model text primary key,
+                dimensions int
+            );""",
+    ]]),
+    Migration(3, "file ingestion progress", [[
+        add_columns("files", "(status_details text, chunks_total int, chunks_completed int)"),
+    ]]),
+    Migration(4, "reused chunk embeddings", [[
+        add_columns("files", "chunks_reused int"),
+    ]]),
+    Migration(5, "in-progress message deltas", [[
+        """
+            create table if not exists {keyspace}.message_deltas (
+                    thread_id text,
+                    message_id text,
+                    position int,
+                    delta text,
+                    PRIMARY KEY ((thread_id, message_id), position)
+            );""",
+    ]]),
+    Migration(6, "id indexes for point lookups", [[
+        # see CassandraClient.select_by_id_async
+        sai_index("messages_v2", "id", name="messages_v2_id_idx"),
+        sai_index("vector_store_files", "id", name="vector_store_files_id_idx"),
+    ]]),
+    Migration(7, "runs by created_at", [
+        [
+            # runs_v2 is clustered by id, list_runs pages the thread's runs through this table
+            """
+            create table if not exists {keyspace}.runs_v2_by_created_at (
+                thread_id text,
+                created_at bigint,
+                id text,
+                PRIMARY KEY ((thread_id), created_at, id)
+            );""",
+        ],
+        [
+            sai_index("runs_v2_by_created_at", "id", name="runs_v2_by_created_at_id_idx"),
+            backfill_runs_by_created_at,
+        ],
+    ]),
+    Migration(8, "shared embedding caches and run events", [[
+        # CassandraEmbeddingStore tables: embeddings by model key and text hash, written with a TTL
+        """
+            create table if not exists {keyspace}.embedding_cache (
+                model text,
+                text_hash text,
+                embedding blob,
+                PRIMARY KEY ((model, text_hash))
+            );""",
+        """
+            create table if not exists {keyspace}.chunk_embeddings (
+                model text,
+                text_hash text,
+                embedding blob,
+                PRIMARY KEY ((model, text_hash))
+            );""",
+        # CassandraRunEventStore
+        """
+            create table if not exists {keyspace}.run_events (
+                run_id text,
+                seq int,
+                event text,
+                PRIMARY KEY (run_id, seq)
+            );""",
+    ]]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+# (dbid, keyspace) this process has seen at SCHEMA_VERSION, reconnecting to them doesn't read the version again
+_current: Set[Tuple[str, str]] = set()
+
+
+async def read_schema_version(astradb, keyspace: str) -> Optional[int]:
+    """The keyspace's recorded schema version, None when it has none (or no schema_version table)."""
+    try:
+        rows = await astradb.execute_async(
+            f"SELECT version FROM {keyspace}.schema_version WHERE keyspace_name = %s;", (keyspace,)
+        )
+    except InvalidRequest as e:
+        # anything else (a timeout, unavailable replicas) must not look like a keyspace to migrate from scratch
+        if "unconfigured table" not in str(e) and "does not exist" not in str(e):
+            raise
+        logger.debug(f"no schema version recorded for {keyspace}: {e}")
+        return None
+    return rows[0]["version"] if rows else None
+
+
+async def migrate(astradb, keyspace: str, make_keyspace=None) -> int:
+    """
+    Bring the keyspace up to SCHEMA_VERSION and return the version it was at.
+
+    A keyspace that is already current costs one read of schema_version, or nothing when this process has seen it
+    current before. Otherwise the migrations past its version run in order and the version is recorded after each one.
+    make_keyspace is awaited first for keyspaces with no recorded version, which may not exist yet.
+    """
+    key = (astradb.dbid, keyspace)
+    if key in _current:
+        return SCHEMA_VERSION
+    version = await read_schema_version(astradb, keyspace)
+    if version is None and make_keyspace is not None:
+        await make_keyspace()
+    for migration in MIGRATIONS:
+        if version is not None and migration.version <= version:
+            continue
+        logger.info(f"migrating keyspace {keyspace} to schema version {migration.version}: {migration.description}")
+        for phase in migration.phases:
+            await asyncio.gather(*[
+                _execute_ddl(astradb, step.format(keyspace=keyspace)) if isinstance(step, str) else step(astradb, keyspace)
+                for step in phase
+            ])
+        await astradb.execute_async(
+            f"insert into {keyspace}.schema_version (keyspace_name, version, updated_at) "
+            f"VALUES (%s, %s, toTimestamp(now()));",
+            (keyspace, migration.version),
+        )
+    _current.add(key)
+    return version or 0
+
+
+async def _execute_ddl(astradb, ddl: str):
+    try:
+        await astradb.execute_async(SimpleStatement(ddl, consistency_level=ConsistencyLevel.QUORUM))
+    except InvalidRequest as e:
+        # adding a column that is there already, from a migration that failed halfway or a keyspace created before
+        # schema versions were recorded
+        if "already exist" in str(e) or "conflicts with an existing column" in str(e):
+            logger.debug(f"{ddl.strip()} already applied: {e}")
+            return
+        raise
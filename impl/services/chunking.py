@@ -0,0 +1,155 @@
+import bisect
+import itertools
+import os
+from typing import List, Optional, Tuple
+
+import tiktoken
+
+# Global variables
+tokenizer = tiktoken.get_encoding(
+    "cl100k_base"
+)  # The encoding scheme to use for tokenization
+
+# Constants
+CHUNK_SIZE = 200  # The target size of each text chunk in tokens
+MIN_CHUNK_SIZE_CHARS = 350  # The minimum size of each text chunk in characters
+MIN_CHUNK_LENGTH_TO_EMBED = 5  # Discard chunks shorter than this
+MAX_NUM_CHUNKS = int(os.getenv("MAX_NUM_CHUNKS", 10000))  # The maximum number of chunks to generate from a text
+# "offsets" walks the token array once, "compat" cuts exactly the chunks the original loop did
+CHUNKING_MODE = os.getenv("CHUNKING_MODE", "offsets")
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 0))  # Tokens shared by consecutive chunks, offsets mode only
+
+PUNCTUATION = (".", "?", "!", "\n")
+
+
+def split_text(
+    text: str,
+    chunk_size: int = CHUNK_SIZE,
+    max_chunks: int = MAX_NUM_CHUNKS,
+    keep: int = 0,
+    overlap: int = CHUNK_OVERLAP,
+    mode: str = CHUNKING_MODE,
+) -> Tuple[List[str], str, int]:
+    """
+    Cut chunks of ~chunk_size tokens off the front of `text`, ending at punctuation or newlines where possible.
+
+    Stops once at most `keep` tokens or `max_chunks` chunks are left. Returns the chunks, the text that was not
+    consumed and the number of chunks counted against `max_chunks` (whitespace only chunks count but aren't kept).
+    """
+    tokens = tokenizer.encode(text, disallowed_special=())
+    if mode == "compat":
+        return _split_tokens_compat(tokens, chunk_size, max_chunks, keep)
+    return _split_tokens_offsets(text, tokens, chunk_size, max_chunks, keep, overlap)
+
+
+def _clean(chunk_text: str) -> Optional[str]:
+    # Remove any newline characters and strip any leading or trailing whitespace
+    chunk_text = chunk_text.replace("\n", " ").strip()
+    return chunk_text if len(chunk_text) > MIN_CHUNK_LENGTH_TO_EMBED else None
+
+
+def _last_punctuation(chunk_text: str) -> int:
+    return max(chunk_text.rfind(mark) for mark in PUNCTUATION)
+
+
+def _split_tokens_offsets(
+    text: str, tokens: List[int], chunk_size: int, max_chunks: int, keep: int, overlap: int
+) -> Tuple[List[str], str, int]:
+    """One pass over the tokens: token boundaries are mapped to offsets once, chunks are slices of the text.
+
+    Offsets are in bytes of the utf-8 text, tiktoken's decode_with_offsets is several times slower than encoding.
+    """
+    data = text.encode("utf-8")
+    offsets = list(itertools.accumulate(map(len, tokenizer.decode_tokens_bytes(tokens)), initial=0))
+    n = len(tokens)
+    overlap = max(0, min(overlap, chunk_size - 1))
+
+    def char_start(i: int) -> int:
+        # a token can end inside a multibyte character, the character goes to the chunk it starts in
+        offset = offsets[i]
+        while 0 < offset < len(data) and data[offset] & 0xC0 == 0x80:
+            offset -= 1
+        return offset
+
+    chunks = []
+    num_chunks = 0
+    # position as a token index and a byte offset, a chunk cut at punctuation can end inside a token
+    p = 0
+    start = 0
+    while n - p > keep and num_chunks < max_chunks:
+        end = min(p + chunk_size, n)
+        end_offset = char_start(end)
+        chunk_text = data[start:end_offset].decode("utf-8")
+        if not chunk_text or chunk_text.isspace():
+            p, start = end, end_offset
+            continue
+
+        cut = _last_punctuation(chunk_text)
+        cut_at = end_offset
+        if cut != -1 and cut > MIN_CHUNK_SIZE_CHARS:
+            chunk_text = chunk_text[: cut + 1]
+            cut_at = start + len(chunk_text.encode("utf-8"))
+        chunk = _clean(chunk_text)
+        if chunk is not None:
+            chunks.append(chunk)
+        num_chunks += 1
+
+        # the next chunk starts at the first token at or after the cut, or inside the token the cut falls in
+        i = bisect.bisect_left(offsets, cut_at, p, end + 1)
+        if i > end or offsets[i] > cut_at:
+            i -= 1
+        next_p = max(i, p + 1)
+        if overlap > 0:
+            next_p = max(next_p - overlap, p + 1)
+            start = char_start(next_p)
+        else:
+            start = max(cut_at, char_start(next_p))
+        p = next_p
+
+    return chunks, data[start:].decode("utf-8"), num_chunks
+
+
+def _split_tokens_compat(tokens: List[int], chunk_size: int, max_chunks: int, keep: int) -> Tuple[List[str], str, int]:
+    """The original get_text_chunks loop, walking an index instead of re-slicing the remaining tokens."""
+    chunks = []
+    num_chunks = 0
+    p = 0
+    n = len(tokens)
+    while n - p > keep and num_chunks < max_chunks:
+        # Take the next chunk_size tokens as a chunk
+        chunk = tokens[p: p + chunk_size]
+        chunk_text = tokenizer.decode(chunk)
+
+        # Skip the chunk if it is empty or whitespace
+        if not chunk_text or chunk_text.isspace():
+            p += len(chunk)
+            continue
+
+        # If there is a punctuation mark after MIN_CHUNK_SIZE_CHARS, truncate the chunk text at it
+        cut = _last_punctuation(chunk_text)
+        if cut != -1 and cut > MIN_CHUNK_SIZE_CHARS:
+            chunk_text = chunk_text[: cut + 1]
+        text_chunk = _clean(chunk_text)
+        if text_chunk is not None:
+            chunks.append(text_chunk)
+
+        # the original advanced by the token count of the re-encoded chunk text, which can differ from the
+        # number of tokens the chunk covers in the full encoding
+        p += len(tokenizer.encode(chunk_text, disallowed_special=()))
+        num_chunks += 1
+
+    return chunks, tokenizer.decode(tokens[p:]), num_chunks
+
+
+def chunk_document_text(text: str, chunk_token_size: Optional[int] = None) -> List[str]:
+    """All the chunks of `text`, the remainder past MAX_NUM_CHUNKS becomes one last chunk like it always did."""
+    # Return an empty list if the text is empty or whitespace
+    if not text or text.isspace():
+        return []
+    chunks, rest, _ = split_text(text, chunk_token_size or CHUNK_SIZE)
+    # Handle the remaining text
+    if rest:
+        remaining = _clean(rest)
+        if remaining is not None:
+            chunks.append(remaining)
+    return chunks
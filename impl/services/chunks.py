@@ -1,226 +1,76 @@
-import os
-import concurrent.futures
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Iterable, Iterator, List, Optional
 
-import tiktoken
+from loguru import logger
 
-from impl.models import Document, DocumentChunk, DocumentChunkMetadata
-#from impl.services.code_chunks import get_code_chunks
-from impl.services.inference_utils import get_embeddings
-from impl.utils import generate_id
+from impl.models import DocumentChunk, DocumentChunkMetadata
+from impl.services.chunking import (
+    CHUNK_SIZE,
+    MAX_NUM_CHUNKS,
+    MIN_CHUNK_LENGTH_TO_EMBED,
+    split_text,
+)
+from impl.services.code_chunks import code_language, get_code_chunks
 
-# Global variables
-tokenizer = tiktoken.get_encoding(
-    "cl100k_base"
-)  # The encoding scheme to use for tokenization
+STREAM_WINDOW_CHARS = 64 * 1024  # Text buffered before it is tokenized when chunking a stream
 
-# Constants
-CHUNK_SIZE = 200  # The target size of each text chunk in tokens
-MIN_CHUNK_SIZE_CHARS = 350  # The minimum size of each text chunk in characters
-MIN_CHUNK_LENGTH_TO_EMBED = 5  # Discard chunks shorter than this
-DEFAULT_EMBEDDINGS_BATCH_SIZE = int(
-    os.getenv("OPENAI_EMBEDDING_BATCH_SIZE", 64) # cohere maxes out at batches of 96
-)  # The number of embeddings to request at a time
-MAX_NUM_CHUNKS = 10000  # The maximum number of chunks to generate from a text
 
-
-def get_text_chunks(text: str, chunk_token_size: Optional[int]) -> List[str]:
+def iter_text_chunks(segments: Iterable[str], chunk_token_size: Optional[int]) -> Iterator[str]:
     """
-    Split a text into chunks of ~CHUNK_SIZE tokens, based on punctuation and newline boundaries.
-
-    Args:
-        text: The text to split into chunks.
-        chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
+    chunk_document_text for a text that arrives in pieces (pages, rows, blocks), yielding chunks as they are found.
 
-    Returns:
-        A list of text chunks, each of which is a string of ~CHUNK_SIZE tokens.
+    Only about STREAM_WINDOW_CHARS of text is tokenized at a time. The last chunk_token_size tokens of each window
+    are carried over to the next one, so chunk boundaries don't depend on where the pieces were split. Unlike
+    chunk_document_text, text past MAX_NUM_CHUNKS is dropped instead of becoming one oversized chunk.
     """
-    # Return an empty list if the text is empty or whitespace
-    if not text or text.isspace():
-        return []
-
-    # Tokenize the text
-    tokens = tokenizer.encode(text, disallowed_special=())
-
-    # Initialize an empty list of chunks
-    chunks = []
-
-    # Use the provided chunk token size or the default one
     chunk_size = chunk_token_size or CHUNK_SIZE
-
-    # Initialize a counter for the number of chunks
     num_chunks = 0
-
-    # Loop until all tokens are consumed
-    while tokens and num_chunks < MAX_NUM_CHUNKS:
-        # Take the first chunk_size tokens as a chunk
-        chunk = tokens[:chunk_size]
-
-        # Decode the chunk into text
-        chunk_text = tokenizer.decode(chunk)
-
-        # Skip the chunk if it is empty or whitespace
-        if not chunk_text or chunk_text.isspace():
-            # Remove the tokens corresponding to the chunk text from the remaining tokens
-            tokens = tokens[len(chunk) :]
-            # Continue to the next iteration of the loop
+    buffer: List[str] = []
+    buffered = 0
+    for segment in segments:
+        buffer.append(segment)
+        buffered += len(segment)
+        if buffered < STREAM_WINDOW_CHARS:
             continue
-
-        # Find the last period or punctuation mark in the chunk
-        last_punctuation = max(
-            chunk_text.rfind("."),
-            chunk_text.rfind("?"),
-            chunk_text.rfind("!"),
-            chunk_text.rfind("\n"),
-        )
-
-        # If there is a punctuation mark, and the last punctuation index is before MIN_CHUNK_SIZE_CHARS
-        if last_punctuation != -1 and last_punctuation > MIN_CHUNK_SIZE_CHARS:
-            # Truncate the chunk text at the punctuation mark
-            chunk_text = chunk_text[: last_punctuation + 1]
-
-        # Remove any newline characters and strip any leading or trailing whitespace
-        chunk_text_to_append = chunk_text.replace("\n", " ").strip()
-
-        if len(chunk_text_to_append) > MIN_CHUNK_LENGTH_TO_EMBED:
-            # Append the chunk text to the list of chunks
-            chunks.append(chunk_text_to_append)
-
-        # Remove the tokens corresponding to the chunk text from the remaining tokens
-        tokens = tokens[len(tokenizer.encode(chunk_text, disallowed_special=())) :]
-
-        # Increment the number of chunks
-        num_chunks += 1
-
-    # Handle the remaining tokens
-    if tokens:
-        remaining_text = tokenizer.decode(tokens).replace("\n", " ").strip()
-        if len(remaining_text) > MIN_CHUNK_LENGTH_TO_EMBED:
-            chunks.append(remaining_text)
-
-    return chunks
+        chunks, rest, used = split_text("".join(buffer), chunk_size, MAX_NUM_CHUNKS - num_chunks, keep=chunk_size)
+        num_chunks += used
+        yield from chunks
+        if num_chunks >= MAX_NUM_CHUNKS:
+            logger.warning(f"text has more than {MAX_NUM_CHUNKS} chunks, dropping the rest")
+            return
+        buffer = [rest]
+        buffered = len(rest)
+
+    text = "".join(buffer)
+    if not text or text.isspace():
+        return
+    chunks, rest, _ = split_text(text, chunk_size, MAX_NUM_CHUNKS - num_chunks)
+    yield from chunks
+    remaining_text = rest.replace("\n", " ").strip()
+    if len(remaining_text) > MIN_CHUNK_LENGTH_TO_EMBED:
+        yield remaining_text
 
 
-def create_document_chunks(
-    doc: Document,
+def iter_document_chunks(
+    doc_id: str,
+    segments: Iterable[str],
     chunk_token_size: Optional[int],
-    format: str
-) -> Tuple[List[DocumentChunk], str]:
+    format: Optional[str] = None,
+) -> Iterator[DocumentChunk]:
     """
-    Create a list of document chunks from a document object and return the document id.
-
-    Args:
-        doc: The document object to create chunks from. It should have a text attribute and optionally an id and a metadata attribute.
-        chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
+    The chunks of a document whose text arrives in pieces, e.g. from iter_text_from_filepath.
 
-    Returns:
-        A tuple of (doc_chunks, doc_id), where doc_chunks is a list of document chunks, each of which is a DocumentChunk object with an id, a document_id, a text, and a metadata attribute,
-        and doc_id is the id of the document object, generated if not provided. The id of each chunk is generated from the document id and a sequential number, and the metadata is copied from the document object.
+    Chunk ids follow the chunk_<doc_id>_<n> sequence, without embeddings. Source code is parsed whole, its
+    chunks need the syntax tree of the entire file.
     """
-    # Check if the document text is empty or whitespace
-    if not doc.text or doc.text.isspace():
-        return [], doc.id or generate_id("doc")
-
-    # Generate a document id if not provided
-    doc_id = doc.id or generate_id("doc")
-
-    # Split the document text into chunks
-    if format in ("c", "cpp", "css", "html", "java", "js", "json", "md", "php", "py", "rb", "ts", "xml"):
-        #TODO: do language specific code chunking
-        #text_chunks = get_code_chunks(doc.text, chunk_token_size, format)
-        text_chunks = get_text_chunks(doc.text, chunk_token_size, format)
-    else:
-        text_chunks = get_text_chunks(doc.text, chunk_token_size)
-
-    metadata = (
-        DocumentChunkMetadata(**doc.metadata.__dict__)
-        if doc.metadata is not None
-        else DocumentChunkMetadata()
-    )
-
+    metadata = DocumentChunkMetadata()
     metadata.document_id = doc_id
-
-    # Initialize an empty list of chunks for this document
-    doc_chunks = []
-
-    # Assign each chunk a sequential number and create a DocumentChunk object
+    if code_language(format):
+        text_chunks = iter(get_code_chunks("".join(segments), chunk_token_size, format))
+    else:
+        text_chunks = iter_text_chunks(segments, chunk_token_size)
     for i, text_chunk in enumerate(text_chunks):
-        chunk_id = f"chunk_{doc_id}_{i}"
-        doc_chunk = DocumentChunk(
-            id=chunk_id,
+        yield DocumentChunk(
+            id=f"chunk_{doc_id}_{i}",
             text=text_chunk,
             metadata=metadata,
         )
-        # Append the chunk object to the list of chunks for this document
-        doc_chunks.append(doc_chunk)
-
-    # Return the list of chunks and the document id
-    return doc_chunks, doc_id
-
-
-def get_document_chunks(
-    documents: List[Document],
-    chunk_token_size: Optional[int],
-    embedding_model: str,
-    format: str,
-    **litellm_kwargs: Any,
-) -> Dict[str, List[DocumentChunk]]:
-    """
-    Convert a list of documents into a dictionary from document id to list of document chunks.
-
-    Args:
-        documents: The list of documents to convert.
-        chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
-
-    Returns:
-        A dictionary mapping each document id to a list of document chunks, each of which is a DocumentChunk object
-        with text, metadata, and embedding attributes.
-    """
-    # Initialize an empty dictionary of lists of chunks
-    chunks: Dict[str, List[DocumentChunk]] = {}
-
-    # Initialize an empty list of all chunks
-    all_chunks: List[DocumentChunk] = []
-
-    # Loop over each document and create chunks
-    for doc in documents:
-        doc_chunks, doc_id = create_document_chunks(doc, chunk_token_size, format)
-
-        # Append the chunks for this document to the list of all chunks
-        all_chunks.extend(doc_chunks)
-
-        # Add the list of chunks for this document to the dictionary with the document id as the key
-        chunks[doc_id] = doc_chunks
-
-    # Check if there are no chunks
-    if not all_chunks:
-        return {}
-
-    EMBEDDINGS_BATCH_SIZE = DEFAULT_EMBEDDINGS_BATCH_SIZE
-    if litellm_kwargs.get("aws_access_key_id") is not None:
-        EMBEDDINGS_BATCH_SIZE=1 # bedrock can't handle batches
-
-    # Prepare your batches
-    batches = [
-        [chunk.text for chunk in all_chunks[i: i + EMBEDDINGS_BATCH_SIZE]]
-        for i in range(0, len(all_chunks), EMBEDDINGS_BATCH_SIZE)
-    ]
-
-    # Get all the embeddings for the document chunks in batches, using get_embeddings
-    embeddings: List[List[float]] = []
-
-    # Use ThreadPoolExecutor for parallel execution
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Submit tasks for each batch
-        futures = [executor.submit(get_embeddings, batch_texts, model=embedding_model, **litellm_kwargs) for batch_texts in batches]
-
-        # Retrieve and extend results as they become available
-        for future in concurrent.futures.as_completed(futures):
-            embeddings.extend(future.result())
-
-    # Update the document chunk objects with the embeddings
-    for i, chunk in enumerate(all_chunks):
-        # Assign the embedding from the embeddings list to the chunk object
-        chunk.embedding = embeddings[i]
-
-    return chunks
@@ -1,88 +1,134 @@
-from typing import List, Optional, Any, Dict, Tuple
+import functools
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from tree_sitter import Node, Parser
+from tree_sitter_languages import get_language
+
+from impl.services.chunking import CHUNK_SIZE, MAX_NUM_CHUNKS, MIN_CHUNK_LENGTH_TO_EMBED, chunk_document_text, tokenizer
+
+# file extension -> tree-sitter grammar, xml has no grammar in tree_sitter_languages and is chunked as text
+CODE_LANGUAGES = {
+    "c": "c",
+    "cpp": "cpp",
+    "css": "css",
+    "html": "html",
+    "java": "java",
+    "js": "javascript",
+    "json": "json",
+    "md": "markdown",
+    "php": "php",
+    "py": "python",
+    "rb": "ruby",
+    "ts": "typescript",
+}
+
+# grammars are loaded once per process, parsers aren't thread safe so each thread gets its own
+_language = functools.lru_cache(maxsize=None)(get_language)
+_parsers = threading.local()
+
+
+def code_language(format: Optional[str]) -> Optional[str]:
+    """The tree-sitter grammar for a file extension or file name, None when it isn't code we can parse."""
+    if not format:
+        return None
+    return CODE_LANGUAGES.get(format.rsplit(".", 1)[-1].lower())
+
+
+def get_code_parser(language: str) -> Parser:
+    parsers: Dict[str, Parser] = getattr(_parsers, "by_language", None)
+    if parsers is None:
+        parsers = _parsers.by_language = {}
+    parser = parsers.get(language)
+    if parser is None:
+        parser = Parser()
+        parser.set_language(_language(language))
+        parsers[language] = parser
+    return parser
 
-import tiktoken
-from tree_sitter_languages import get_language, get_parser
-
-tokenizer = tiktoken.get_encoding(
-    "cl100k_base"
-)  # The encoding scheme to use for tokenization
 
 def get_code_chunks(text: str, chunk_token_size: Optional[int], format: str) -> List[str]:
     """
-    Split a text into chunks of ~CHUNK_SIZE tokens, based on methods per tree sitter.
+    Split source code into chunks of at most ~CHUNK_SIZE tokens at syntax boundaries, using tree-sitter.
+
+    A definition that doesn't fit in the token budget is split at its children (methods of a class, statements of a
+    function) and so on down the tree, then consecutive pieces are packed together up to the budget. Text that
+    can't be split any further, like a very long string, is chunked as text. Formats without a grammar are chunked
+    as text.
 
     Args:
         text: The text to split into chunks.
         chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
-        format: file extension (ex. "py")
+        format: file extension (ex. "py") or file name
 
     Returns:
         A list of text chunks, each of which is a string of ~CHUNK_SIZE tokens.
     """
-    language = get_language("python")
-    parser = get_parser("python")
-
     # Return an empty list if the text is empty or whitespace
     if not text or text.isspace():
         return []
 
-    # Tokenize the text
-    tokens = tokenizer.encode(text, disallowed_special=())
-
-    # Initialize an empty list of chunks
-    chunks = []
-
-    # Use the provided chunk token size or the default one
     chunk_size = chunk_token_size or CHUNK_SIZE
-
-    # Initialize a counter for the number of chunks
-    num_chunks = 0
-
-    # Loop until all tokens are consumed
-    while tokens and num_chunks < MAX_NUM_CHUNKS:
-        # Take the first chunk_size tokens as a chunk
-        chunk = tokens[:chunk_size]
-
-        # Decode the chunk into text
-        chunk_text = tokenizer.decode(chunk)
-
-        # Skip the chunk if it is empty or whitespace
-        if not chunk_text or chunk_text.isspace():
-            # Remove the tokens corresponding to the chunk text from the remaining tokens
-            tokens = tokens[len(chunk) :]
-            # Continue to the next iteration of the loop
+    language = code_language(format)
+    if language is None:
+        return chunk_document_text(text, chunk_size)
+
+    data = text.encode("utf-8")
+    tree = get_code_parser(language).parse(data)
+    spans: List[Tuple[int, int, int]] = []
+    _split_node(tree.root_node, data, 0, len(data), chunk_size, spans)
+
+    chunks: List[str] = []
+    for start, end, tokens in _pack_spans(spans, chunk_size):
+        chunk_text = _decode(data[start:end])
+        if tokens > chunk_size:
+            # a single node too large to split at syntax boundaries, e.g. a very long string
+            chunks.extend(chunk_document_text(chunk_text, chunk_size))
             continue
+        chunk_text = chunk_text.strip()
+        if len(chunk_text) > MIN_CHUNK_LENGTH_TO_EMBED:
+            chunks.append(chunk_text)
 
-        # Find the last period or punctuation mark in the chunk
-        last_punctuation = max(
-            chunk_text.rfind("."),
-            chunk_text.rfind("?"),
-            chunk_text.rfind("!"),
-            chunk_text.rfind("\n"),
-        )
-
-        # If there is a punctuation mark, and the last punctuation index is before MIN_CHUNK_SIZE_CHARS
-        if last_punctuation != -1 and last_punctuation > MIN_CHUNK_SIZE_CHARS:
-            # Truncate the chunk text at the punctuation mark
-            chunk_text = chunk_text[: last_punctuation + 1]
-
-        # Remove any newline characters and strip any leading or trailing whitespace
-        chunk_text_to_append = chunk_text.replace("\n", " ").strip()
-
-        if len(chunk_text_to_append) > MIN_CHUNK_LENGTH_TO_EMBED:
-            # Append the chunk text to the list of chunks
-            chunks.append(chunk_text_to_append)
-
-        # Remove the tokens corresponding to the chunk text from the remaining tokens
-        tokens = tokens[len(tokenizer.encode(chunk_text, disallowed_special=())) :]
+    if len(chunks) > MAX_NUM_CHUNKS:
+        logger.warning(f"code has more than {MAX_NUM_CHUNKS} chunks, dropping the rest")
+        del chunks[MAX_NUM_CHUNKS:]
+    return chunks
 
-        # Increment the number of chunks
-        num_chunks += 1
 
-    # Handle the remaining tokens
-    if tokens:
-        remaining_text = tokenizer.decode(tokens).replace("\n", " ").strip()
-        if len(remaining_text) > MIN_CHUNK_LENGTH_TO_EMBED:
-            chunks.append(remaining_text)
+def _split_node(node: Node, data: bytes, start: int, end: int, chunk_size: int, spans: List[Tuple[int, int, int]]):
+    """Split data[start:end], which holds `node`, into (start, end, tokens) spans at the boundaries of its children.
 
-    return chunks
+    Children over chunk_size tokens are split at their own children. Every child's span runs from the end of the
+    previous one, so comments, whitespace and the node's own header (e.g. `class A:`) stay with the child that
+    follows them, and what follows the last child (e.g. a closing brace) gets a span of its own.
+    """
+    cursor = start
+    for child in node.children:
+        tokens = _count_tokens(data[cursor:child.end_byte])
+        if tokens > chunk_size and child.child_count:
+            _split_node(child, data, cursor, child.end_byte, chunk_size, spans)
+        else:
+            spans.append((cursor, child.end_byte, tokens))
+        cursor = child.end_byte
+    if cursor < end:
+        spans.append((cursor, end, _count_tokens(data[cursor:end])))
+
+
+def _pack_spans(spans: List[Tuple[int, int, int]], chunk_size: int) -> List[Tuple[int, int, int]]:
+    """Merge consecutive spans while they fit in chunk_size tokens, siblings or not."""
+    packed: List[Tuple[int, int, int]] = []
+    for start, end, tokens in spans:
+        if packed and packed[-1][2] + tokens <= chunk_size:
+            packed[-1] = (packed[-1][0], end, packed[-1][2] + tokens)
+        else:
+            packed.append((start, end, tokens))
+    return packed
+
+
+def _count_tokens(span: bytes) -> int:
+    return len(tokenizer.encode(_decode(span), disallowed_special=()))
+
+
+def _decode(span: bytes) -> str:
+    return span.decode("utf-8", errors="ignore")
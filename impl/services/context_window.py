@@ -0,0 +1,103 @@
+import functools
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import litellm
+import tiktoken
+from loguru import logger
+
+# prompt budget for models litellm doesn't know the context window of
+DEFAULT_MAX_PROMPT_TOKENS = int(os.getenv("DEFAULT_MAX_PROMPT_TOKENS", 32000))
+# completion tokens kept free when a run doesn't set max_completion_tokens
+DEFAULT_COMPLETION_RESERVE_TOKENS = int(os.getenv("DEFAULT_COMPLETION_RESERVE_TOKENS", 4096))
+# share of the prompt budget kept for file_search chunks, history that doesn't use its share leaves it to the chunks
+CONTEXT_RETRIEVAL_SHARE = float(os.getenv("CONTEXT_RETRIEVAL_SHARE", 0.5))
+# messages read per page while walking a thread back from its newest message
+CONTEXT_PAGE_SIZE = int(os.getenv("CONTEXT_PAGE_SIZE", 50))
+# tokens the chat format adds to every message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: Optional[str]) -> tiktoken.Encoding:
+    """The model's tokenizer when tiktoken knows it, cl100k_base otherwise, close enough for a budget."""
+    try:
+        return tiktoken.encoding_for_model(model.split("/")[-1])
+    except Exception:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@functools.lru_cache(maxsize=8192)
+def _count_tokens(encoding_name: str, text: str) -> int:
+    return len(tiktoken.get_encoding(encoding_name).encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    # runs on the same thread count the same messages over and over, the counts are cached by text
+    return _count_tokens(get_encoding(model).name, text)
+
+
+def message_tokens(message: Dict[str, str], model: Optional[str] = None) -> int:
+    """Tokens of a chat message ({"role": ..., "content": ...})."""
+    return count_tokens(message["content"] or "", model) + MESSAGE_OVERHEAD_TOKENS
+
+
+def prompt_budget(model: str, max_prompt_tokens: Optional[int], max_completion_tokens: Optional[int]) -> int:
+    """Tokens a run's prompt may use: max_prompt_tokens, capped by what the model's context window leaves after the
+    completion."""
+    context_window = _context_window(model)
+    if context_window is None:
+        budget = DEFAULT_MAX_PROMPT_TOKENS
+    else:
+        budget = context_window - (max_completion_tokens or DEFAULT_COMPLETION_RESERVE_TOKENS)
+    if max_prompt_tokens is not None:
+        budget = min(budget, max_prompt_tokens)
+    return max(budget, 0)
+
+
+@functools.lru_cache(maxsize=None)
+def _context_window(model: str) -> Optional[int]:
+    try:
+        return litellm.get_model_info(model).get("max_input_tokens")
+    except Exception:
+        return None
+
+
+async def select_history(
+        messages: AsyncIterator[Dict[str, str]], budget: int, last_messages: Optional[int] = None,
+        model: Optional[str] = None,
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    The newest messages of a thread that fit in `budget` tokens, oldest first, and the tokens they use.
+
+    `messages` yields the thread's chat messages newest first and is only read as far as needed, so a long thread
+    costs about as many reads as the messages that make it into the prompt. last_messages caps the number of
+    messages as well, the way truncation_strategy last_messages does. The newest message is kept even when it alone
+    is over budget, a prompt without it would answer the wrong question.
+    """
+    history = []
+    tokens = 0
+    async for message in messages:
+        if last_messages is not None and len(history) >= last_messages:
+            break
+        cost = message_tokens(message, model)
+        if tokens + cost > budget and history:
+            break
+        history.append(message)
+        tokens += cost
+    history.reverse()
+    return history, tokens
+
+
+def pack_chunks(chunks: List[Dict[str, str]], budget: int, model: Optional[str] = None) -> List[Dict[str, str]]:
+    """The leading chat messages of `chunks`, most relevant first, that fit in `budget` tokens."""
+    packed = []
+    for chunk in chunks:
+        cost = message_tokens(chunk, model)
+        if cost > budget:
+            break
+        packed.append(chunk)
+        budget -= cost
+    if len(packed) < len(chunks):
+        logger.info(f"packed {len(packed)} of {len(chunks)} file_search chunks into the prompt budget")
+    return packed
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+EMBEDDING_CACHE_CASSANDRA = os.getenv("EMBEDDING_CACHE_CASSANDRA", "false").lower() == "true"
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+# uploads reuse the embeddings of chunks any earlier upload to the keyspace already embedded with the same model
+CHUNK_DEDUP = os.getenv("CHUNK_DEDUP", "true").lower() == "true"
+# rows are shared by every file with the chunk so deleting a file can't delete them, they expire instead (0 never does)
+CHUNK_DEDUP_TTL_SECONDS = int(os.getenv("CHUNK_DEDUP_TTL_SECONDS", 30 * 24 * 3600))
+MAX_PARTITIONS_PER_QUERY = 20
+
+# kwargs that change the vector a model returns for the same text
+_VARIANT_KWARGS = ("dimensions", "api_base", "base_url", "api_version", "custom_llm_provider", "aws_region_name")
+# kwargs holding credentials (api_key, aws_secret_access_key, ...)
+_CREDENTIAL_KWARG_PARTS = ("key", "secret", "token", "credentials")
+
+CACHE_REQUESTS = Counter(
+    name="embedding_cache_requests_total",
+    documentation="Embedding cache lookups by tier (memory, cassandra) and result (hit, miss).",
+    labelnames=("tier", "result"),
+)
+
+
+def model_key(model: str, litellm_kwargs: Dict[str, Any]) -> str:
+    """Cache key of the embeddings `model` returns for `litellm_kwargs`, scoped to the credentials in them so a
+    caller only gets embeddings its own credentials paid for."""
+    variant = ",".join(
+        f"{name}={litellm_kwargs[name]}" for name in _VARIANT_KWARGS if litellm_kwargs.get(name) is not None
+    )
+    credentials = sorted(
+        f"{name}={value}" for name, value in litellm_kwargs.items()
+        if value is not None and any(part in name for part in _CREDENTIAL_KWARG_PARTS)
+    )
+    if credentials:
+        variant = f"{variant},credentials={text_hash(','.join(credentials))[:32]}".lstrip(",")
+    return f"{model}|{variant}" if variant else model
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """In-process LRU of float32 embeddings keyed by (model key, text hash), bounded by bytes."""
+
+    def __init__(self, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._embeddings: OrderedDict[Tuple[str, str], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, hash: str) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._embeddings.get((key, hash))
+            if embedding is not None:
+                self._embeddings.move_to_end((key, hash))
+        CACHE_REQUESTS.labels("memory", "miss" if embedding is None else "hit").inc()
+        return embedding
+
+    def put(self, key: str, hash: str, embedding: np.ndarray):
+        if embedding.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._embeddings.pop((key, hash), None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            self._embeddings[(key, hash)] = embedding
+            self.bytes += embedding.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._embeddings.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def __len__(self):
+        return len(self._embeddings)
+
+
+class CassandraEmbeddingStore:
+    """Shared tier in the tenant's own keyspace, so every worker (and restart) can reuse an embedding."""
+
+    def __init__(self, session, prepare: Callable[[str], Any], keyspace: str, ttl: int = EMBEDDING_CACHE_TTL_SECONDS,
+                 table: str = "embedding_cache"):
+        self.session = session
+        self.prepare = prepare
+        self.ttl = ttl
+        self._select = f"SELECT text_hash, embedding FROM {keyspace}.{table} WHERE model = ? AND text_hash IN ?"
+        self._insert = f"INSERT INTO {keyspace}.{table} (model, text_hash, embedding) VALUES (?, ?, ?) USING TTL ?"
+
+    def get_many(self, key: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        select = self.prepare(self._select)
+        # Astra rejects an IN over too many partitions, large lookups go out as several concurrent queries
+        futures = [
+            self.session.execute_async(select, (key, hashes[i: i + MAX_PARTITIONS_PER_QUERY]))
+            for i in range(0, len(hashes), MAX_PARTITIONS_PER_QUERY)
+        ]
+        found = {
+            row.text_hash: np.frombuffer(row.embedding, dtype=np.float32)
+            for future in futures for row in future.result()
+        }
+        CACHE_REQUESTS.labels("cassandra", "hit").inc(len(found))
+        CACHE_REQUESTS.labels("cassandra", "miss").inc(len(hashes) - len(found))
+        return found
+
+    def put_many(self, key: str, embeddings: Dict[str, np.ndarray]):
+        insert = self.prepare(self._insert)
+        for hash, embedding in embeddings.items():
+            # fire and forget, a lost write only costs a recomputation
+            future = self.session.execute_async(insert, (key, hash, embedding.tobytes(), self.ttl))
+            future.add_errback(lambda e: logger.debug(f"embedding cache write failed: {e}"))
+
+
+def cached_embeddings(
+        texts: List[str],
+        key: str,
+        embed: Callable[[List[str]], List[List[float]]],
+        store: Optional[CassandraEmbeddingStore] = None,
+        cache: Optional[EmbeddingCache] = None,
+) -> List[List[float]]:
+    """Embeddings for `texts`, calling `embed` only for distinct texts neither tier has."""
+    if cache is None:
+        cache = embedding_cache
+    hashes = [text_hash(text) for text in texts]
+    found, missing = _lookup(hashes, key, store, cache)
+    if missing:
+        text_by_hash = dict(zip(hashes, texts))
+        embedded = embed([text_by_hash[hash] for hash in missing])
+        found.update(_remember(key, missing, embedded, store, cache))
+    return [found[hash].tolist() for hash in hashes]
+
+
+async def cached_embeddings_async(
+        texts: List[str],
+        key: str,
+        embed: Callable[[List[str]], Awaitable[List[List[float]]]],
+        store: Optional[CassandraEmbeddingStore] = None,
+        cache: Optional[EmbeddingCache] = None,
+) -> Tuple[List[List[float]], int]:
+    """cached_embeddings for an async `embed`, also returns how many of `texts` were reused."""
+    if cache is None:
+        cache = embedding_cache
+    hashes = [text_hash(text) for text in texts]
+    found, missing = await asyncio.to_thread(_lookup, hashes, key, store, cache)
+    if missing:
+        text_by_hash = dict(zip(hashes, texts))
+        embedded = await embed([text_by_hash[hash] for hash in missing])
+        found.update(await asyncio.to_thread(_remember, key, missing, embedded, store, cache))
+    return [found[hash].tolist() for hash in hashes], len(texts) - len(missing)
+
+
+def _lookup(
+        hashes: List[str], key: str, store: Optional[CassandraEmbeddingStore], cache: EmbeddingCache
+) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """The embeddings either tier has for `hashes`, and the distinct hashes it has not."""
+    found: Dict[str, np.ndarray] = {}
+    for hash in set(hashes):
+        embedding = cache.get(key, hash)
+        if embedding is not None:
+            found[hash] = embedding
+
+    missing = [hash for hash in dict.fromkeys(hashes) if hash not in found]
+    if missing and store is not None:
+        try:
+            shared = store.get_many(key, missing)
+        except Exception as e:
+            logger.warning(f"embedding cache lookup failed: {e}")
+            shared = {}
+        for hash, embedding in shared.items():
+            cache.put(key, hash, embedding)
+        found.update(shared)
+        missing = [hash for hash in missing if hash not in found]
+    return found, missing
+
+
+def _remember(
+        key: str,
+        hashes: List[str],
+        embedded: List[List[float]],
+        store: Optional[CassandraEmbeddingStore],
+        cache: EmbeddingCache,
+) -> Dict[str, np.ndarray]:
+    computed = {hash: np.asarray(embedding, dtype=np.float32) for hash, embedding in zip(hashes, embedded)}
+    for hash, embedding in computed.items():
+        cache.put(key, hash, embedding)
+    if store is not None:
+        try:
+            store.put_many(key, computed)
+        except Exception as e:
+            logger.warning(f"embedding cache write failed: {e}")
+    return computed
+
+
+embedding_cache = EmbeddingCache()
+# chunks of uploads get their own memory tier, a large upload would otherwise evict every cached query embedding
+chunk_embedding_cache = EmbeddingCache()
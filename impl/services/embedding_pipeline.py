@@ -0,0 +1,169 @@
+import asyncio
+import os
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from litellm import get_llm_provider
+from loguru import logger
+from prometheus_client import Histogram
+
+from impl.services.embedding_cache import (
+    CassandraEmbeddingStore,
+    cached_embeddings_async,
+    chunk_embedding_cache,
+    model_key,
+)
+from impl.services.inference_utils import (
+    embeddings_from_response,
+    get_embeddings_response_async,
+)
+
+DEFAULT_EMBEDDINGS_BATCH_SIZE = int(
+    os.getenv("OPENAI_EMBEDDING_BATCH_SIZE", 64)
+)  # The number of embeddings to request at a time
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 8))  # in flight batches per provider and worker
+# 0 means no token budget, providers still answer 429s which are retried
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 0))
+
+# most inputs a provider accepts in one embedding request
+PROVIDER_MAX_BATCH_SIZE = {
+    "bedrock": 1,
+    "cohere": 96,
+    "vertex_ai": 250,
+    "voyage": 128,
+    "openai": 2048,
+    "azure": 2048,
+}
+
+BATCH_SECONDS = Histogram(
+    name="embedding_batch_seconds",
+    documentation="Latency of embedding requests made while ingesting files, by provider.",
+    labelnames=("provider",),
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for english text, close enough for budgeting
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """`tokens_per_minute` refilled continuously, acquire waits until the tokens are there."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+
+    async def acquire(self, tokens: int):
+        # a batch bigger than the whole budget would wait forever, let it through once the bucket is full
+        tokens = min(tokens, self.capacity)
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.capacity / 60)
+            self.updated_at = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) * 60 / self.capacity)
+
+
+class ProviderBudget:
+    def __init__(self, concurrency: int, tokens_per_minute: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+
+
+# asyncio primitives belong to the loop they were first used on, a closed loop's budgets go with it
+_budgets: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, ProviderBudget]]" = weakref.WeakKeyDictionary()
+
+
+def provider_budget(provider: str) -> ProviderBudget:
+    budgets = _budgets.setdefault(asyncio.get_running_loop(), {})
+    budget = budgets.get(provider)
+    if budget is None:
+        budget = ProviderBudget(EMBEDDING_CONCURRENCY, EMBEDDING_TOKENS_PER_MINUTE)
+        budgets[provider] = budget
+    return budget
+
+
+def embedding_provider(model: str, litellm_kwargs: Dict[str, Any]) -> str:
+    if litellm_kwargs.get("aws_access_key_id") is not None:
+        return "bedrock"
+    try:
+        return get_llm_provider(model)[1]
+    except Exception:
+        return "openai"
+
+
+def batch_size_for(provider: str, batch_size: Optional[int] = None) -> int:
+    batch_size = batch_size or DEFAULT_EMBEDDINGS_BATCH_SIZE
+    return max(1, min(batch_size, PROVIDER_MAX_BATCH_SIZE.get(provider, batch_size)))
+
+
+async def embed_texts(
+        texts: List[str],
+        model: str,
+        batch_size: Optional[int] = None,
+        on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+        **litellm_kwargs: Any,
+) -> List[List[float]]:
+    """Embeddings for `texts`, in the same order, requested in batches sized for the provider.
+
+    Batches run concurrently within the provider's budget: at most EMBEDDING_CONCURRENCY requests in flight per
+    worker and, when EMBEDDING_TOKENS_PER_MINUTE is set, that many estimated tokens per minute. `on_progress` is
+    awaited after every batch with the number of texts embedded so far and the total.
+    """
+    if not texts:
+        return []
+    provider = embedding_provider(model, litellm_kwargs)
+    size = batch_size_for(provider, batch_size)
+    budget = provider_budget(provider)
+    batches = [texts[i: i + size] for i in range(0, len(texts), size)]
+    done = 0
+
+    async def embed_batch(index: int, batch: List[str]) -> List[List[float]]:
+        nonlocal done
+        async with budget.semaphore:
+            if budget.bucket is not None:
+                await budget.bucket.acquire(sum(estimate_tokens(text) for text in batch))
+            start = time.perf_counter()
+            response = await get_embeddings_response_async(batch, model=model, **litellm_kwargs)
+            elapsed = time.perf_counter() - start
+        BATCH_SECONDS.labels(provider).observe(elapsed)
+        logger.debug(f"embedding batch {index + 1}/{len(batches)} of {len(batch)} for {model} in {elapsed:.3f}s")
+        embeddings = embeddings_from_response(response, litellm_kwargs)
+        if len(embeddings) != len(batch):
+            raise ValueError(f"{provider} returned {len(embeddings)} embeddings for a batch of {len(batch)}")
+        done += len(batch)
+        if on_progress is not None:
+            await on_progress(done, len(texts))
+        return embeddings
+
+    # gather returns results in the order of the batches, not the order they finished in
+    results = await asyncio.gather(*[embed_batch(i, batch) for i, batch in enumerate(batches)])
+    return [embedding for embeddings in results for embedding in embeddings]
+
+
+async def embed_texts_deduplicated(
+        texts: List[str],
+        model: str,
+        store: Optional[CassandraEmbeddingStore] = None,
+        batch_size: Optional[int] = None,
+        on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+        **litellm_kwargs: Any,
+) -> Tuple[List[List[float]], int]:
+    """embed_texts, only for the distinct texts whose embedding isn't already cached or in `store`.
+
+    Returns the embeddings for all of `texts` and how many of them were reused instead of embedded. `on_progress`
+    counts the texts that are embedded.
+    """
+    async def embed(missing: List[str]) -> List[List[float]]:
+        return await embed_texts(
+            missing, model=model, batch_size=batch_size, on_progress=on_progress, **litellm_kwargs
+        )
+
+    return await cached_embeddings_async(
+        texts, model_key(model, litellm_kwargs), embed, store=store, cache=chunk_embedding_cache
+    )
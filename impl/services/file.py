@@ -1,8 +1,10 @@
+import codecs
 import csv
+import io
 import mimetypes
 import os
-from io import BufferedReader
-from typing import Optional
+import tempfile
+from typing import BinaryIO, Iterator, Optional
 
 import docx2txt
 import pptx
@@ -11,7 +13,6 @@ from loguru import logger
 from PyPDF2 import PdfReader
 
 from impl.astra_vector import HandledResponse
-from impl.models import Document
 
 exclude_exts: list[str] = [
     ".map",
@@ -65,16 +66,30 @@ exclude_exts: list[str] = [
     ".lock",
 ]
 
-async def get_document_from_file(file: UploadFile, file_id: str) -> Document:
-    extracted_text = await extract_text_from_from_file(file)
+SPOOL_BLOCK_BYTES = 1024 * 1024
+# text files are decoded and handed to the chunker this many bytes at a time
+TEXT_BLOCK_BYTES = 256 * 1024
+CODE_EXTENSIONS = (".c", ".cpp", ".css", ".html", ".java", ".js", ".json", ".md", ".php", ".py", ".rb", ".ts", ".xml")
 
-    doc = Document(id=file_id, text=extracted_text)
 
-    return doc
+async def spool_upload(file: UploadFile) -> str:
+    """Copy an upload to a temporary file that outlives the request, keeping its extension for mimetype detection.
 
+    The caller removes the file.
+    """
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file.filename)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            await file.seek(0)
+            while chunk := await file.read(SPOOL_BLOCK_BYTES):
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
 
-def extract_text_from_filepath(filepath: str, mimetype: Optional[str] = None) -> str:
-    """Return the text content of a file given its filepath."""
+
+def resolve_mimetype(filepath: str, mimetype: Optional[str] = None) -> str:
     if mimetype is None or mimetype == "application/octet-stream":
         # Get the mimetype of the file based on its extension
         mimetype, _ = mimetypes.guess_type(filepath)
@@ -83,99 +98,79 @@ def extract_text_from_filepath(filepath: str, mimetype: Optional[str] = None) ->
     if not mimetype:
         # when there's no mimetype, treat other valid extensions as text/plain, including files without extensions (i.e. Dockerfile)
         if extension not in exclude_exts:
-            mimetype = "text/plain"
-        else:
-            # Unsupported file type
-            raise HTTPException(
-                status_code=400,
-                detail="Unsupported file type: {}".format(filepath),
-            )
-    else:
-        # treat programming language extensions as text/plain regardless of mimetype
-        if extension in (".c", ".cpp", ".css", ".html", ".java", ".js", ".json", ".md", ".php", ".py", ".rb", ".ts", ".xml"):
-            mimetype = "text/plain"
+            return "text/plain"
+        # Unsupported file type
+        raise HTTPException(
+            status_code=400,
+            detail="Unsupported file type: {}".format(filepath),
+        )
+    # treat programming language extensions as text/plain regardless of mimetype
+    if extension in CODE_EXTENSIONS:
+        return "text/plain"
+    return mimetype
+
+
+def extract_text_from_filepath(filepath: str, mimetype: Optional[str] = None) -> str:
+    """Return the text content of a file given its filepath."""
+    return "".join(iter_text_from_filepath(filepath, mimetype))
+
+
+def iter_text_from_filepath(filepath: str, mimetype: Optional[str] = None) -> Iterator[str]:
+    """Yield the text content of a file piece by piece (pages, slides, rows or blocks), never all of it at once."""
+    mimetype = resolve_mimetype(filepath, mimetype)
     try:
         with open(filepath, "rb") as file:
-            extracted_text = extract_text_from_file(file, mimetype)
+            yield from iter_text_from_file(file, mimetype)
     except Exception as e:
         logger.error(e)
         raise e
 
-    return extracted_text
 
+def extract_text_from_file(file: BinaryIO, mimetype: str) -> str:
+    return "".join(iter_text_from_file(file, mimetype))
 
-def extract_text_from_file(file: BufferedReader, mimetype: str) -> str:
-    filetype = mimetype
+
+def iter_text_from_file(file: BinaryIO, mimetype: str) -> Iterator[str]:
     if mimetype == "application/pdf":
-        # Extract text from pdf using PyPDF2
+        # Extract text from pdf using PyPDF2, a page at a time
         reader = PdfReader(file)
-        extracted_text = " ".join([page.extract_text() for page in reader.pages])
-    elif mimetype == "text/plain" or mimetype == "text/markdown" or "application/sql":
-        # Read text from plain text file
-        extracted_text = file.read().decode("utf-8")
+        for i, page in enumerate(reader.pages):
+            yield (" " if i > 0 else "") + page.extract_text()
     elif (
         mimetype
         == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     ):
         # Extract text from docx using docx2txt
-        extracted_text = docx2txt.process(file)
+        yield docx2txt.process(file)
     # TODO: supported formats should be Supported formats: "c", "cpp", "css", "csv", "docx", "gif", "html", "java", "jpeg", "jpg", "js", "json", "md", "pdf", "php", "png", "pptx", "py", "rb", "tar", "tex", "ts", "txt", "xlsx", "xml", "zip"
     # figure out what they do with the images.
     elif mimetype == "text/csv":
-        # Extract text from csv using csv module
-        extracted_text = ""
-        decoded_buffer = (line.decode("utf-8") for line in file)
+        # Extract text from csv using csv module, a row at a time
+        decoded_buffer = io.TextIOWrapper(file, encoding="utf-8", newline="")
         reader = csv.reader(decoded_buffer)
         for row in reader:
-            extracted_text += " ".join(row) + "\n"
+            yield " ".join(row) + "\n"
     elif (
         mimetype
         == "application/vnd.openxmlformats-officedocument.presentationml.presentation"
     ):
-        # Extract text from pptx using python-pptx
-        extracted_text = ""
+        # Extract text from pptx using python-pptx, a slide at a time
         presentation = pptx.Presentation(file)
         for slide in presentation.slides:
+            runs = []
             for shape in slide.shapes:
                 if shape.has_text_frame:
                     for paragraph in shape.text_frame.paragraphs:
                         for run in paragraph.runs:
-                            extracted_text += run.text + " "
-                    extracted_text += "\n"
+                            runs.append(run.text + " ")
+                    runs.append("\n")
+            yield "".join(runs)
     else:
-        # Unsupported file type
-        raise HTTPException(
-            status_code=400,
-            detail="Unsupported file type: {}".format(mimetype),
-        )
-    return extracted_text
-
-
-# Extract text from a file based on its mimetype
-async def extract_text_from_from_file(file: UploadFile):
-    """Return the text content of a file."""
-    # get the file body from the upload file object
-    mimetype = file.content_type
-    logger.info(f"mimetype: {mimetype}")
-    logger.info(f"file.file: {file.file}")
-    logger.info("file: ", file)
-
-    file_stream = await file.read()
-
-    temp_file_path = "/tmp/"+file.filename
-
-    # write the file to a temporary location
-    with open(temp_file_path, "wb") as f:
-        f.write(file_stream)
-
-    try:
-        extracted_text = extract_text_from_filepath(temp_file_path, mimetype)
-    except Exception as e:
-        logger.error(e)
-        os.remove(temp_file_path)
-        raise e
+        # Read anything else as a plain text file (text/plain, text/markdown, application/sql, ...), the
+        # incremental decoder keeps multi byte characters split across blocks intact
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while block := file.read(TEXT_BLOCK_BYTES):
+            yield decoder.decode(block)
+        yield decoder.decode(b"", final=True)
 
-    # remove file from temp location
-    os.remove(temp_file_path)
 
-    return extracted_text
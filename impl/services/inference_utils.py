@@ -6,11 +6,13 @@ import litellm
 from fastapi import HTTPException
 from litellm import (
     EmbeddingResponse,
-    embedding as get_litellm_embedding, acompletion, get_llm_provider
+    embedding as get_litellm_embedding, aembedding as get_litellm_embedding_async, acompletion, get_llm_provider
 )
 from loguru import logger
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from impl.services.embedding_cache import CassandraEmbeddingStore, cached_embeddings, model_key
+
 litellm.add_function_to_prompt=True
 litellm.telemetry = False
 litellm.drop_params = True
@@ -58,19 +60,51 @@ def get_embeddings_response(
         raise e
 
 
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
+async def get_embeddings_response_async(
+    texts: List[str],
+    model: str,
+    **litellm_kwargs: Any,
+) -> EmbeddingResponse:
+    try:
+        if "base_url" in litellm_kwargs:
+            litellm_kwargs = litellm_kwargs.copy()
+            litellm_kwargs["api_base"] = litellm_kwargs.pop("base_url")
+
+        return await get_litellm_embedding_async(
+            model=model,
+            input=texts,
+            **litellm_kwargs,
+        )
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        raise e
+
+
 def get_embeddings(
     texts: Union[str, List[str]],
     model: str,
     deployment_id: Optional[str] = None,
+    store: Optional[CassandraEmbeddingStore] = None,
     **litellm_kwargs: Any,
 ) -> List[List[float]]:
-    response = get_embeddings_response(
-        texts=texts,
-        model=model,
-        deployment_id=deployment_id,
-        **litellm_kwargs,
-    )
+    """Embeddings for texts, served from the embedding cache (and `store`, the tenant's shared tier) when possible."""
+    if isinstance(texts, str):
+        texts = [texts]
+
+    def embed(missing_texts: List[str]) -> List[List[float]]:
+        response = get_embeddings_response(
+            texts=missing_texts,
+            model=model,
+            deployment_id=deployment_id,
+            **litellm_kwargs,
+        )
+        return embeddings_from_response(response, litellm_kwargs)
+
+    return cached_embeddings(texts, model_key(model, litellm_kwargs), embed, store=store)
+
 
+def embeddings_from_response(response: EmbeddingResponse, litellm_kwargs: Dict[str, Any]) -> List[List[float]]:
     # Return the embeddings as a list of lists of floats
     try:
         if litellm_kwargs.get("aws_access_key_id") is not None:
@@ -0,0 +1,86 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from cassandra.query import PreparedStatement
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATEMENT_CACHE_SIZE = int(os.getenv("PREPARED_STATEMENT_CACHE_SIZE", 512))
+
+# the [keyspace.]table a statement reads or writes
+TABLE_REFERENCE = re.compile(r"\b(?:from|into|update|on)\s+(?:\w+\.)?(\w+)", re.IGNORECASE)
+
+
+class PreparedStatementCache:
+    """Bounded LRU registry of prepared statements for a single session.
+
+    Statements are keyed by (CQL text, consistency level) so the consistency level only has to be set once,
+    when the statement is first prepared.
+    """
+
+    def __init__(self, prepare: Callable[[str], PreparedStatement], maxsize: int = DEFAULT_STATEMENT_CACHE_SIZE):
+        self._prepare = prepare
+        self.maxsize = maxsize
+        self._statements: OrderedDict[Tuple[str, Optional[int]], PreparedStatement] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, query_string: str, consistency_level: Optional[int] = None) -> PreparedStatement:
+        key = (query_string, consistency_level)
+        with self._lock:
+            statement = self._statements.get(key)
+            if statement is not None:
+                self._statements.move_to_end(key)
+                self.hits += 1
+                return statement
+            self.misses += 1
+
+        # prepare outside the lock, it's a round trip to the cluster
+        statement = self._prepare(query_string)
+        if consistency_level is not None:
+            statement.consistency_level = consistency_level
+
+        with self._lock:
+            self._statements[key] = statement
+            self._statements.move_to_end(key)
+            while len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+                self.evictions += 1
+        return statement
+
+    def invalidate(self, table: Optional[str] = None) -> int:
+        """Drop cached statements that reference `table` (or everything if no table is given).
+
+        Needed after DDL on a table, otherwise `SELECT *` statements keep serving the old result metadata.
+        """
+        with self._lock:
+            if table is None:
+                removed = len(self._statements)
+                self._statements.clear()
+            else:
+                stale = [key for key in self._statements if table in TABLE_REFERENCE.findall(key[0])]
+                for key in stale:
+                    del self._statements[key]
+                removed = len(stale)
+        if removed > 0:
+            logger.debug(f"invalidated {removed} prepared statements for {table or 'all tables'}")
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._statements),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._statements)
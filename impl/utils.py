@@ -4,7 +4,7 @@ import hashlib
 import json
 import logging
 import secrets
-from typing import Type, Dict, Any, List, get_origin, Annotated, get_args, Union
+from typing import Type, Dict, Any, List, Optional, Tuple, get_origin, Annotated, get_args, Union
 
 from fastapi import HTTPException
 from pydantic import BaseModel
@@ -13,6 +13,8 @@ from impl.astra_vector import CassandraClient
 
 logger = logging.getLogger(__name__)
 
+HASH_BLOCK_BYTES = 1024 * 1024
+
 def map_model(source_instance: BaseModel, target_model_class: Type[BaseModel],
               extra_fields: Dict[str, Any] = {}) -> BaseModel:
     combined_fields = combine_fields(extra_fields, source_instance, target_model_class)
@@ -75,17 +77,17 @@ async def store_object(astradb: CassandraClient, obj: BaseModel, target_class: T
             if key != "metadata" and isinstance(value, dict):
                 obj_dict[key] = json.dumps(value)
 
-        astradb.upsert_table_from_dict(table_name=table_name, obj=obj_dict)
+        await astradb.upsert_table_from_dict_async(table_name=table_name, obj=obj_dict)
         return combined_obj
     except Exception as e:
         logger.error(f"store_object failed {e} for table {table_name} and object {obj}")
         raise HTTPException(status_code=500, detail=f"Error reading {table_name}: {e}")
 
 
-def read_object(astradb: CassandraClient, target_class: Type[BaseModel], table_name: str, partition_keys: List[str],
-                 args: Dict[str, Any]):
+async def read_object(astradb: CassandraClient, target_class: Type[BaseModel], table_name: str,
+                      partition_keys: List[str], args: Dict[str, Any]):
     try:
-        objs = read_objects(astradb, target_class, table_name, partition_keys, args)
+        objs = await read_objects(astradb, target_class, table_name, partition_keys, args)
     except Exception as e:
         logger.error(f"read_object failed {e} for table {table_name}")
         raise HTTPException(status_code=404, detail=f"{target_class.__name__} not found.")
@@ -96,82 +98,112 @@ def read_object(astradb: CassandraClient, target_class: Type[BaseModel], table_n
 
 
 
-def read_objects(astradb: CassandraClient, target_class: Type[BaseModel], table_name: str, partition_keys: List[str],
-                args: Dict[str, Any]):
+async def read_objects(astradb: CassandraClient, target_class: Type[BaseModel], table_name: str,
+                       partition_keys: List[str], args: Dict[str, Any]):
     try:
-        json_objs = astradb.select_from_table_by_pk(table=table_name, partition_keys=partition_keys, args=args)
+        json_objs = await astradb.select_from_table_by_pk_async(table=table_name, partition_keys=partition_keys,
+                                                                args=args)
         if len(json_objs) == 0:
             raise HTTPException(status_code=404, detail=f"{args} not found in table {table_name}.")
 
-        obj_list = []
-        for json_obj in json_objs:
-            for field_name, field_type in target_class.__fields__.items():
-                annotation = field_type.annotation
-                if (
-                        annotation is not None
-                        and json_obj[field_name] is not None
-                        and hasattr(annotation, 'from_json')
-                ):
-                    if 'actual_instance' in annotation.__fields__:
-                        try:
-                            json_obj[field_name] = annotation(actual_instance=json_obj[field_name])
-                        except Exception as e:
-                            try:
-                                json_obj[field_name] = annotation.from_json(json_obj[field_name])
-                            except Exception as e:
-                                raise e
-                    else:
-                        json_obj[field_name] = annotation.from_json(json_obj[field_name])
-                elif get_origin(annotation) is list:
-                    if json_obj[field_name] is None:
-                        json_obj[field_name] = []
-                    else:
-                        for i in range(len(json_obj[field_name])):
-                            if isinstance(json_obj[field_name][i], str):
-                                json_obj[field_name][i] = annotation.__args__[0].from_json(json_obj[field_name][i])
-                            else:
-                                if 'actual_instance' in annotation.__args__[0].__fields__:
-                                     json_obj[field_name][i] = annotation.__args__[0](actual_instance=json_obj[field_name][i])
-                                else:
-                                    logger.error(f"error reading object from {table_name} - {field_name} is an object: {json_obj[field_name][i]}  but {annotation} does not take objects.")
-                                    raise HTTPException(status_code=500, detail=f"Error reading {table_name}: {field_name}.")
-                elif get_origin(annotation) is Union:
-                    if hasattr(get_args(annotation)[0], 'from_json'):
-                        if json_obj[field_name] is not None and isinstance(json_obj[field_name], str):
-                            if 'actual_instance' in get_args(annotation)[0].__fields__:
-                                json_obj[field_name] = get_args(annotation)[0](actual_instance=json_obj[field_name])
-                            else:
-                                json_obj[field_name] = get_args(annotation)[0].from_json(json_obj[field_name])
-                    if get_origin(get_args(annotation)[0]) is Annotated:
-                        if get_args(get_args(annotation)[0])[0] is int and isinstance(json_obj[field_name], datetime.datetime):
-                            json_obj[field_name] = int(json_obj[field_name].timestamp()*1000)
-                elif annotation is int and isinstance(json_obj[field_name], datetime.datetime):
-                    json_obj[field_name] = int(json_obj[field_name].timestamp()*1000)
-
-            obj = target_class(**json_obj)
-            obj_list.append(obj)
-        return obj_list
+        return rows_to_objects(target_class, table_name, json_objs)
     except Exception as e:
         if hasattr(e, 'status_code') and e.status_code== 404:
             raise e
-        msg = f"read_objects failed {e} for table {table_name}"
-        if obj is not None:
-            msg += f"for object {obj}"
-        logger.error(msg)
+        logger.error(f"read_objects failed {e} for table {table_name}")
         raise HTTPException(status_code=500, detail=f"Error reading {table_name}: {e}")
 
 
+async def read_objects_page(astradb: CassandraClient, target_class: Type[BaseModel], table_name: str,
+                            partition_key: str, value: Any, limit: Optional[int], order: str,
+                            after: Optional[str], before: Optional[str]) -> Tuple[List[BaseModel], bool]:
+    """read_objects for one page of a partition clustered by (created_at, id), an empty page isn't an error."""
+    json_objs, has_more = await astradb.select_page_async(
+        table=table_name, partition_key=partition_key, value=value, limit=limit, order=order, after=after,
+        before=before,
+    )
+    try:
+        return rows_to_objects(target_class, table_name, json_objs), has_more
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"read_objects_page failed {e} for table {table_name}")
+        raise HTTPException(status_code=500, detail=f"Error reading {table_name}: {e}")
+
+
+def rows_to_objects(target_class: Type[BaseModel], table_name: str, json_objs: List[Dict[str, Any]]):
+    obj_list = []
+    for json_obj in json_objs:
+        for field_name, field_type in target_class.__fields__.items():
+            annotation = field_type.annotation
+            if (
+                    annotation is not None
+                    and json_obj[field_name] is not None
+                    and hasattr(annotation, 'from_json')
+            ):
+                if 'actual_instance' in annotation.__fields__:
+                    try:
+                        json_obj[field_name] = annotation(actual_instance=json_obj[field_name])
+                    except Exception as e:
+                        try:
+                            json_obj[field_name] = annotation.from_json(json_obj[field_name])
+                        except Exception as e:
+                            raise e
+                else:
+                    json_obj[field_name] = annotation.from_json(json_obj[field_name])
+            elif get_origin(annotation) is list:
+                if json_obj[field_name] is None:
+                    json_obj[field_name] = []
+                else:
+                    for i in range(len(json_obj[field_name])):
+                        if isinstance(json_obj[field_name][i], str):
+                            json_obj[field_name][i] = annotation.__args__[0].from_json(json_obj[field_name][i])
+                        else:
+                            if 'actual_instance' in annotation.__args__[0].__fields__:
+                                 json_obj[field_name][i] = annotation.__args__[0](actual_instance=json_obj[field_name][i])
+                            else:
+                                logger.error(f"error reading object from {table_name} - {field_name} is an object: {json_obj[field_name][i]}  but {annotation} does not take objects.")
+                                raise HTTPException(status_code=500, detail=f"Error reading {table_name}: {field_name}.")
+            elif get_origin(annotation) is Union:
+                if hasattr(get_args(annotation)[0], 'from_json'):
+                    if json_obj[field_name] is not None and isinstance(json_obj[field_name], str):
+                        if 'actual_instance' in get_args(annotation)[0].__fields__:
+                            json_obj[field_name] = get_args(annotation)[0](actual_instance=json_obj[field_name])
+                        else:
+                            json_obj[field_name] = get_args(annotation)[0].from_json(json_obj[field_name])
+                if get_origin(get_args(annotation)[0]) is Annotated:
+                    if get_args(get_args(annotation)[0])[0] is int and isinstance(json_obj[field_name], datetime.datetime):
+                        json_obj[field_name] = int(json_obj[field_name].timestamp()*1000)
+            elif annotation is int and isinstance(json_obj[field_name], datetime.datetime):
+                json_obj[field_name] = int(json_obj[field_name].timestamp()*1000)
+
+        obj = target_class(**json_obj)
+        obj_list.append(obj)
+    return obj_list
+
+
 def generate_id(prefix: str, num_bytes=24):
     random_bytes = secrets.token_bytes(num_bytes)
     random_string = base64.urlsafe_b64encode(random_bytes).rstrip(b'=').decode('utf-8')
     return f"{prefix}_{random_string}"
 
 
+def upload_size(upload_file) -> int:
+    spooled_file = upload_file.file
+    spooled_file.seek(0, 2)
+    size = spooled_file.tell()
+    spooled_file.seek(0)
+    return size
+
+
 def generate_id_from_upload_file(upload_file, prefix="file", length=24):
     spooled_file = upload_file.file
     spooled_file.seek(0)
-    file_data = upload_file.filename.encode('utf-8') + spooled_file.read()
-    sha256_hash = hashlib.sha256(file_data).digest()
+    # hashed a block at a time, a large upload stays on disk
+    hasher = hashlib.sha256(upload_file.filename.encode('utf-8'))
+    while block := spooled_file.read(HASH_BLOCK_BYTES):
+        hasher.update(block)
+    sha256_hash = hasher.digest()
     base64_encoded_hash = base64.urlsafe_b64encode(sha256_hash).rstrip(b'=').decode('utf-8')[:length]
     spooled_file.seek(0)
 
@@ -0,0 +1,192 @@
+"""Multi-partition ann search: full rows from every partition + sort vs key/score top-k merge + hydration.
+
+Runs CassandraClient.annSearch_async against a stand-in session holding CHUNKS_PER_FILE chunks of CONTENT_BYTES per
+file. Each query costs QUERY_LATENCY_MS plus its payload on a link shared by all queries at BANDWIDTH_MB_S, so
+fetching content that is thrown away shows up in the timings.
+
+    PYTHONPATH=. python tests/perf/bench_ann_search.py
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from impl.astra_vector import CASSANDRA_KEYSPACE, CassandraClient
+from impl.statement_cache import PreparedStatementCache
+
+PARTITIONS = [int(n) for n in os.getenv("PARTITIONS", "10,100,1000").split(",")]
+CHUNKS_PER_FILE = int(os.getenv("CHUNKS_PER_FILE", 50))
+CONTENT_BYTES = int(os.getenv("CONTENT_BYTES", 2000))
+QUERY_LATENCY_MS = float(os.getenv("QUERY_LATENCY_MS", 3))
+BANDWIDTH_MB_S = float(os.getenv("BANDWIDTH_MB_S", 100))
+LIMIT = 20
+
+VECTOR_COLUMN = "embedding_bench"
+COLUMNS = [
+    {"column_name": "file_id", "kind": "partition_key", "type": "text", "position": 0},
+    {"column_name": "chunk_id", "kind": "clustering", "type": "text", "position": 0},
+    {"column_name": "content", "kind": "regular", "type": "text", "position": -1},
+    {"column_name": "created_at", "kind": "regular", "type": "timestamp", "position": -1},
+    {"column_name": VECTOR_COLUMN, "kind": "regular", "type": "vector<float, 3>", "position": -1},
+]
+
+
+class FakeStatement:
+    consistency_level = None
+    retry_policy = None
+
+    def __init__(self, query_string):
+        self.query_string = query_string
+
+
+class Link:
+    """Delivers responses from a single thread, one payload at a time, like a connection would."""
+
+    def __init__(self):
+        self._due = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._free_at = 0.0
+        threading.Thread(target=self._deliver, daemon=True).start()
+
+    def send(self, payload, callback, rows):
+        with self._condition:
+            start = max(time.monotonic() + QUERY_LATENCY_MS / 1000, self._free_at)
+            self._free_at = start + payload / (BANDWIDTH_MB_S * 1024 * 1024)
+            heapq.heappush(self._due, (self._free_at, next(self._counter), callback, rows))
+            self._condition.notify()
+
+    def _deliver(self):
+        while True:
+            with self._condition:
+                while not self._due or self._due[0][0] > time.monotonic():
+                    self._condition.wait(None if not self._due else self._due[0][0] - time.monotonic())
+                _, _, callback, rows = heapq.heappop(self._due)
+            callback(rows)
+
+
+class FakeResponseFuture:
+    has_more_pages = False
+
+    def __init__(self, link, payload, rows):
+        self.link = link
+        self.payload = payload
+        self.rows = rows
+
+    def add_callbacks(self, callback, errback):
+        self.link.send(self.payload, callback, self.rows)
+
+
+class FakeCluster:
+    def shutdown(self):
+        pass
+
+
+class StandInSession:
+    """file_chunks as {file_id: [(score, chunk_id, content)]}, scores fixed per chunk and sorted descending."""
+    cluster = FakeCluster()
+
+    def __init__(self, num_partitions):
+        rng = random.Random(num_partitions)
+        self.files = {}
+        for f in range(num_partitions):
+            chunks = [(rng.random(), f"{c:05d}", "x" * CONTENT_BYTES) for c in range(CHUNKS_PER_FILE)]
+            self.files[f"file_{f}"] = sorted(chunks, reverse=True)
+        self.queries = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.link = Link()
+
+    def prepare(self, query_string):
+        return FakeStatement(query_string)
+
+    def execute_async(self, statement, parameters=None, timeout=None, execution_profile=None):
+        query = statement.query_string
+        if " IN ?" in query:
+            file_id, chunk_ids = parameters
+            wanted = set(chunk_ids)
+            rows = [{"file_id": file_id, "chunk_id": chunk_id, "content": content}
+                    for _, chunk_id, content in self.files[file_id] if chunk_id in wanted]
+        elif "LIMIT ?" in query:
+            _, file_id, _, limit = parameters
+            rows = [{"file_id": file_id, "chunk_id": chunk_id, "score": score}
+                    for score, chunk_id, _ in self.files[file_id][:limit]]
+        else:
+            _, file_id, _ = parameters
+            limit = int(query.rsplit("LIMIT", 1)[1])
+            rows = [{"file_id": file_id, "chunk_id": chunk_id, "content": content, "score": score}
+                    for score, chunk_id, content in self.files[file_id][:limit]]
+        payload = sum(len(str(value)) for row in rows for value in row.values())
+        with self.lock:
+            self.queries += 1
+            self.bytes += payload
+        return FakeResponseFuture(self.link, payload, rows)
+
+    def shutdown(self):
+        pass
+
+
+def make_client(num_partitions):
+    client = CassandraClient(token=None, dbid="bench")
+    client.session = StandInSession(num_partitions)
+    client.statement_cache = PreparedStatementCache(client.session.prepare)
+    client.get_columns = lambda table: COLUMNS
+    client.get_indexes = lambda table: [VECTOR_COLUMN]
+    client._search_embedding = lambda *args: [0.1, 0.2, 0.3]
+    return client
+
+
+async def full_rows_then_sort(client, partitions):
+    """What handle_multiple_partitions used to do: LIMIT 20 full rows per partition, sort everything."""
+    statement = client.prepare(
+        f"SELECT file_id, chunk_id, content, similarity_cosine(?, {VECTOR_COLUMN}) as score "
+        f"FROM {CASSANDRA_KEYSPACE}.file_chunks WHERE file_id = ? ORDER BY {VECTOR_COLUMN} ann of ? LIMIT {LIMIT}"
+    )
+    semaphore = asyncio.Semaphore(100)
+
+    async def query(partition):
+        async with semaphore:
+            return await client.execute_async(statement, ([0.1, 0.2, 0.3], partition, [0.1, 0.2, 0.3]))
+
+    json_rows = []
+    for rows in await asyncio.gather(*[query(partition) for partition in partitions]):
+        json_rows.extend(rows)
+    return sorted(json_rows, key=lambda x: x["score"], reverse=True)[:LIMIT]
+
+
+async def merged(client, partitions):
+    return await client.annSearch_async(
+        table="file_chunks",
+        vector_index_column="embedding",
+        search_string="bench",
+        litellm_kwargs={},
+        embedding_model="bench",
+        embedding_api_key=None,
+        partitions=partitions,
+        limit=LIMIT,
+    )
+
+
+def run(search, num_partitions):
+    client = make_client(num_partitions)
+    partitions = list(client.session.files.keys())
+    start = time.perf_counter()
+    rows = asyncio.run(search(client, partitions))
+    elapsed = time.perf_counter() - start
+    return rows, elapsed, client.session.queries, client.session.bytes
+
+
+if __name__ == "__main__":
+    print(f"chunks/file={CHUNKS_PER_FILE} content={CONTENT_BYTES}B latency={QUERY_LATENCY_MS}ms "
+          f"bandwidth={BANDWIDTH_MB_S}MB/s top={LIMIT}")
+    for num_partitions in PARTITIONS:
+        for name, search in [("full rows + sort", full_rows_then_sort), ("top-k merge", merged)]:
+            rows, elapsed, queries, payload = run(search, num_partitions)
+            print(f"partitions={num_partitions:<5} {name:<17} {elapsed * 1000:8.1f}ms "
+                  f"queries={queries:<5} payload={payload / 1024:9.1f}KiB")
+        baseline = [(row["file_id"], row["chunk_id"]) for row in run(full_rows_then_sort, num_partitions)[0]]
+        candidate = [(row["file_id"], row["chunk_id"]) for row in run(merged, num_partitions)[0]]
+        assert baseline == candidate, "merged search returned different winners"
@@ -0,0 +1,98 @@
+"""Latency of concurrent reads on a single event loop, blocking session.execute vs execute_async.
+
+Simulates one uvicorn worker serving CONCURRENCY requests that each read a row. The session is a stand-in that
+answers every query after LATENCY_MS, so the numbers only reflect how the event loop is used, not the database.
+
+    PYTHONPATH=. python tests/perf/bench_async_data_path.py
+"""
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+from impl.astra_vector import CassandraClient
+from impl.statement_cache import PreparedStatementCache
+
+CONCURRENCY = int(os.getenv("CONCURRENCY", 200))
+LATENCY_MS = float(os.getenv("LATENCY_MS", 20))
+
+
+class FakeStatement:
+    consistency_level = None
+
+    def bind(self, values):
+        return self
+
+
+class FakeResponseFuture:
+    has_more_pages = False
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def add_callbacks(self, callback, errback):
+        threading.Timer(LATENCY_MS / 1000, callback, [self.rows]).start()
+
+
+class FakeCluster:
+    def shutdown(self):
+        pass
+
+
+class LatencySession:
+    cluster = FakeCluster()
+
+    def prepare(self, query_string):
+        return FakeStatement()
+
+    def execute(self, statement, parameters=None, timeout=None, execution_profile=None):
+        time.sleep(LATENCY_MS / 1000)
+        return [{"id": "thread_1", "object": "thread"}]
+
+    def execute_async(self, statement, parameters=None, timeout=None, execution_profile=None):
+        return FakeResponseFuture([{"id": "thread_1", "object": "thread"}])
+
+
+def make_client():
+    client = CassandraClient(token=None, dbid="bench")
+    client.session = LatencySession()
+    client.statement_cache = PreparedStatementCache(client.session.prepare)
+    return client
+
+
+async def blocking_request(client):
+    start = time.perf_counter()
+    client.select_from_table_by_pk(table="threads", partition_keys=["id"], args={"id": "thread_1"})
+    return time.perf_counter() - start
+
+
+async def async_request(client):
+    start = time.perf_counter()
+    await client.select_from_table_by_pk_async(table="threads", partition_keys=["id"], args={"id": "thread_1"})
+    return time.perf_counter() - start
+
+
+async def run(request):
+    client = make_client()
+    # requests are queued on the loop at the same time, latency is measured from when the batch starts
+    batch_start = time.perf_counter()
+
+    async def timed():
+        await request(client)
+        return time.perf_counter() - batch_start
+
+    return await asyncio.gather(*[timed() for _ in range(CONCURRENCY)])
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{name:<14} requests={len(latencies)} p50={p50:8.1f}ms p99={p99:8.1f}ms")
+
+
+if __name__ == "__main__":
+    print(f"concurrency={CONCURRENCY} simulated query latency={LATENCY_MS}ms")
+    report("execute", asyncio.run(run(blocking_request)))
+    report("execute_async", asyncio.run(run(async_request)))
@@ -0,0 +1,90 @@
+"""Chunking time: the original get_text_chunks loop vs the compat and offsets chunkers.
+
+The text of tests/fixtures/language_models_are_unsupervised_multitask_learners.pdf is repeated REPEATS times. The
+original loop re-slices the remaining tokens for every chunk, so it is quadratic in the length of the text and only
+runs up to ORIGINAL_MAX_REPEATS. Compat mode must cut exactly the chunks the original loop did.
+
+    PYTHONPATH=. python tests/perf/bench_chunker.py
+"""
+import os
+import time
+
+REPEATS = [int(n) for n in os.getenv("REPEATS", "1,10,50").split(",")]
+ORIGINAL_MAX_REPEATS = int(os.getenv("ORIGINAL_MAX_REPEATS", 10))
+FIXTURE = "tests/fixtures/language_models_are_unsupervised_multitask_learners.pdf"
+
+os.environ.setdefault("MAX_NUM_CHUNKS", str(10 ** 9))
+
+from impl.services.chunking import (  # noqa: E402
+    CHUNK_SIZE,
+    MIN_CHUNK_LENGTH_TO_EMBED,
+    MIN_CHUNK_SIZE_CHARS,
+    split_text,
+    tokenizer,
+)
+from impl.services.file import extract_text_from_filepath  # noqa: E402
+
+
+def original(text, chunk_size=CHUNK_SIZE):
+    """get_text_chunks before the chunker rewrite."""
+    tokens = tokenizer.encode(text, disallowed_special=())
+    chunks = []
+    while tokens:
+        chunk = tokens[:chunk_size]
+        chunk_text = tokenizer.decode(chunk)
+        if not chunk_text or chunk_text.isspace():
+            tokens = tokens[len(chunk):]
+            continue
+        last_punctuation = max(
+            chunk_text.rfind("."), chunk_text.rfind("?"), chunk_text.rfind("!"), chunk_text.rfind("\n")
+        )
+        if last_punctuation != -1 and last_punctuation > MIN_CHUNK_SIZE_CHARS:
+            chunk_text = chunk_text[: last_punctuation + 1]
+        chunk_text_to_append = chunk_text.replace("\n", " ").strip()
+        if len(chunk_text_to_append) > MIN_CHUNK_LENGTH_TO_EMBED:
+            chunks.append(chunk_text_to_append)
+        tokens = tokens[len(tokenizer.encode(chunk_text, disallowed_special=())):]
+    return chunks
+
+
+def compat(text):
+    chunks, _, _ = split_text(text, mode="compat")
+    return chunks
+
+
+def offsets(text):
+    chunks, _, _ = split_text(text, mode="offsets")
+    return chunks
+
+
+def timed(chunker, text):
+    start = time.perf_counter()
+    chunks = chunker(text)
+    return chunks, time.perf_counter() - start
+
+
+def without_whitespace(chunks):
+    return "".join("".join(chunks).split())
+
+
+if __name__ == "__main__":
+    pdf_text = extract_text_from_filepath(FIXTURE, "application/pdf")
+    print(f"{'text':>14} {'tokens':>9} {'chunker':<9} {'time':>8} {'chunks':>7}  notes")
+    for repeats in REPEATS:
+        text = pdf_text * repeats
+        num_tokens = len(tokenizer.encode(text, disallowed_special=()))
+        compat_chunks, compat_time = timed(compat, text)
+        offsets_chunks, offsets_time = timed(offsets, text)
+        if repeats <= ORIGINAL_MAX_REPEATS:
+            original_chunks, original_time = timed(original, text)
+            print(f"{len(text) // 1024:>12}KB {num_tokens:>9} {'original':<9} {original_time:>7.2f}s "
+                  f"{len(original_chunks):>7}")
+            same = "same chunks as original" if compat_chunks == original_chunks else "DIFFERENT CHUNKS"
+        else:
+            same = "original skipped"
+        print(f"{len(text) // 1024:>12}KB {num_tokens:>9} {'compat':<9} {compat_time:>7.2f}s "
+              f"{len(compat_chunks):>7}  {same}")
+        lossless = "no text dropped" if without_whitespace(offsets_chunks) == without_whitespace([text]) \
+            else "text dropped"
+        print(f"{len(text) // 1024:>12}KB {num_tokens:>9} {'offsets':<9} {offsets_time:>7.2f}s "
+              f"{len(offsets_chunks):>7}  {lossless}")
@@ -0,0 +1,96 @@
+"""File ingestion embeddings: thread pool + as_completed vs the asyncio embedding pipeline.
+
+Starts a local OpenAI compatible embedding server that answers every request after LATENCY_MS and returns, for each
+input, a vector derived from the text, so misplaced embeddings can be counted. Both paths go through litellm.
+
+    PYTHONPATH=. python tests/perf/bench_embedding_pipeline.py
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNKS = int(os.getenv("CHUNKS", 2000))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 64))
+LATENCY_MS = float(os.getenv("LATENCY_MS", 200))
+# latency varies per request so batches finish out of order
+JITTER_MS = float(os.getenv("JITTER_MS", 150))
+DIMS = 8
+
+os.environ.setdefault("OPENAI_EMBEDDING_BATCH_SIZE", str(BATCH_SIZE))
+
+from impl.services.embedding_pipeline import embed_texts  # noqa: E402
+from impl.services.inference_utils import get_embeddings_response  # noqa: E402
+
+
+def fake_embedding(text):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [byte / 255 for byte in digest[:DIMS]]
+
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        time.sleep((LATENCY_MS + random.uniform(0, JITTER_MS)) / 1000)
+        payload = json.dumps({
+            "object": "list",
+            "model": body["model"],
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                     for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def thread_pool(texts, **litellm_kwargs):
+    """What get_document_chunks used to do."""
+    batches = [texts[i: i + BATCH_SIZE] for i in range(0, len(texts), BATCH_SIZE)]
+    embeddings = []
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = [executor.submit(get_embeddings_response, batch, **litellm_kwargs) for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            embeddings.extend(result["embedding"] for result in future.result().data)
+    return embeddings
+
+
+def pipeline(texts, **litellm_kwargs):
+    return asyncio.run(embed_texts(texts, **litellm_kwargs))
+
+
+def run(name, embed, texts, **litellm_kwargs):
+    start = time.perf_counter()
+    embeddings = embed(texts, **litellm_kwargs)
+    elapsed = time.perf_counter() - start
+    misplaced = sum(
+        1 for text, embedding in zip(texts, embeddings)
+        if [round(x, 4) for x in embedding] != [round(x, 4) for x in fake_embedding(text)]
+    )
+    print(f"{name:<26} {elapsed:6.2f}s {len(texts) / elapsed:8.1f} chunks/s misplaced={misplaced}")
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EmbeddingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    litellm_kwargs = {
+        "model": "openai/fake-embedding",
+        "api_base": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "api_key": "fake",
+    }
+    texts = [f"chunk {i} " + "lorem ipsum " * 60 for i in range(CHUNKS)]
+    print(f"chunks={CHUNKS} batch={BATCH_SIZE} latency={LATENCY_MS}ms+{JITTER_MS}ms jitter cpus={os.cpu_count()}")
+    run("thread pool + as_completed", thread_pool, texts, **litellm_kwargs)
+    run("asyncio pipeline", pipeline, texts, **litellm_kwargs)
+    server.shutdown()
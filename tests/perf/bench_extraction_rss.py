@@ -0,0 +1,97 @@
+"""Peak RSS of turning an uploaded file into chunks, whole file in memory vs streaming extraction and chunking.
+
+For each size in SIZES_MB a text and a csv file are generated and every path runs in its own process, so the
+reported ru_maxrss (minus the RSS right after imports) belongs to that path alone.
+
+- whole file: what upload + extract_text_from_from_file + get_text_chunks used to hold, the upload bytes, the decoded
+  text and the token list of the entire file. The old chunk loop itself is skipped, it is quadratic in the number of
+  tokens and would not finish on these sizes.
+- streaming: iter_text_from_filepath -> iter_document_chunks, consumed INGESTION_CHUNK_BATCH chunks at a time like
+  an ingestion job, with MAX_NUM_CHUNKS lifted so the whole file is chunked.
+
+    PYTHONPATH=. python tests/perf/bench_extraction_rss.py
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SIZES_MB = [int(n) for n in os.getenv("SIZES_MB", "10,100,500").split(",")]
+KINDS = os.getenv("KINDS", "txt,csv").split(",")
+# the whole file path needs >10x the file size in memory, larger sizes only run the streaming path
+WHOLE_FILE_MAX_MB = int(os.getenv("WHOLE_FILE_MAX_MB", 100))
+LINE = "The quick brown fox jumps over the lazy dog. Pack my box with five dozen liquor jugs!\n"
+ROW = "1234,quick brown fox,\"lazy, dog\",liquor jugs,42.5\n"
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def generate(kind, size_mb, directory):
+    path = os.path.join(directory, f"bench_{size_mb}mb.{kind}")
+    line = (ROW if kind == "csv" else LINE).encode("utf-8")
+    block = line * (1024 * 1024 // len(line) + 1)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block[:1024 * 1024])
+    return path
+
+
+def whole_file(path, mimetype):
+    from impl.services.chunking import tokenizer
+    with open(path, "rb") as f:
+        upload = f.read()
+    text = upload.decode("utf-8")
+    tokens = tokenizer.encode(text, disallowed_special=())
+    return len(tokens)
+
+
+def streaming(path, mimetype):
+    from impl.ingestion import INGESTION_CHUNK_BATCH, take
+    from impl.services.chunks import iter_document_chunks
+    from impl.services.file import iter_text_from_filepath
+    chunks = iter_document_chunks("file-bench", iter_text_from_filepath(path, mimetype), None)
+    count = 0
+    while batch := take(chunks, INGESTION_CHUNK_BATCH):
+        count += len(batch)
+    return count
+
+
+def child(mode, path, mimetype):
+    # imports first, so the baseline includes the tokenizer and the rest of impl
+    import impl.ingestion  # noqa: F401
+    import impl.services.chunks  # noqa: F401
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    result = {"whole": whole_file, "stream": streaming}[mode](path, mimetype)
+    print(f"{peak_rss_mb() - baseline:.1f} {time.perf_counter() - start:.1f} {result}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        child(*sys.argv[1:])
+        sys.exit(0)
+
+    env = dict(os.environ, MAX_NUM_CHUNKS=str(10 ** 9))
+    print(f"{'file':<14} {'path':<11} {'peak RSS over baseline':>23} {'time':>8}  result")
+    with tempfile.TemporaryDirectory() as directory:
+        for size_mb in SIZES_MB:
+            for kind in KINDS:
+                path = generate(kind, size_mb, directory)
+                mimetype = "text/csv" if kind == "csv" else "text/plain"
+                for mode, name in [("whole", "whole file"), ("stream", "streaming")]:
+                    if mode == "whole" and size_mb > WHOLE_FILE_MAX_MB:
+                        print(f"{size_mb:>5}MB {kind:<6} {name:<11} {'skipped':>22}")
+                        continue
+                    output = subprocess.run(
+                        [sys.executable, __file__, mode, path, mimetype],
+                        env=env, capture_output=True, text=True, check=True,
+                    ).stdout.split()
+                    rss, elapsed, result = output[-3:]
+                    unit = "tokens" if mode == "whole" else "chunks"
+                    print(f"{size_mb:>5}MB {kind:<6} {name:<11} {float(rss):>20.1f}MB {float(elapsed):>7.1f}s  "
+                          f"{result} {unit}")
+                os.remove(path)
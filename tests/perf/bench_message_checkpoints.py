@@ -0,0 +1,121 @@
+"""Checkpoint write volume of concurrent runs: the whole message every second vs deltas from the checkpoint writer.
+
+RUNS runs generate TOKENS tokens of TOKEN_CHARS characters each at TOKENS_PER_SECOND, FOLLOWED of them with a
+stream following the run. Completed messages get their deltas deleted. The session only records what would be sent
+to Cassandra: requests (a batch is one) and bytes of message text.
+
+    PYTHONPATH=. python tests/perf/bench_message_checkpoints.py
+"""
+import asyncio
+import os
+import time
+
+RUNS = int(os.getenv("RUNS", 200))
+FOLLOWED = float(os.getenv("FOLLOWED", 0.25))
+TOKENS = int(os.getenv("TOKENS", 1000))
+TOKEN_CHARS = int(os.getenv("TOKEN_CHARS", 4))
+TOKENS_PER_SECOND = float(os.getenv("TOKENS_PER_SECOND", 100))
+
+from impl.message_checkpoints import MessageCheckpointer, MessageCheckpointWriter  # noqa: E402
+from impl.run_events import run_event_bus  # noqa: E402
+
+
+class RecordingSession:
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+
+    def execute_async(self, statement):
+        self.requests += 1
+        # deltas, the deletes that compact them have no text
+        self.bytes += sum(len(values[3]) for _, _, values in statement._statements_and_parameters if len(values) > 3)
+        return Done()
+
+
+class Done:
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        callback(None, *callback_args)
+
+
+class RecordingClient:
+    def __init__(self):
+        self.session = RecordingSession()
+
+    def prepare(self, query_string):
+        return query_string
+
+
+async def generate(run_id, update):
+    text = ""
+    for _ in range(TOKENS):
+        text += "x" * TOKEN_CHARS
+        update(text)
+        await asyncio.sleep(1 / TOKENS_PER_SECOND)
+    return text
+
+
+async def every_second(client):
+    """maybe_checkpoint before the checkpoint writer: the whole message every second."""
+    async def run(n):
+        saved_at = time.monotonic()
+
+        def update(text):
+            nonlocal saved_at
+            if time.monotonic() - saved_at >= 1:
+                saved_at = time.monotonic()
+                client.session.requests += 1
+                client.session.bytes += len(text)
+        await generate(f"run_{n}", update)
+
+    await asyncio.gather(*[run(n) for n in range(RUNS)])
+
+
+async def checkpoint_writer(client):
+    writer = MessageCheckpointWriter()
+
+    async def run(n):
+        run_id = f"run_{n}"
+        log = run_event_bus.open(run_id)
+        follower = None
+        if n < RUNS * FOLLOWED:
+            follower = asyncio.create_task(drain(log))
+        checkpointer = MessageCheckpointer(client, f"thread_{n}", f"msg_{n}", run_id, writer=writer)
+        await generate(run_id, checkpointer.update)
+        checkpointer.complete()
+        run_event_bus.close(run_id)
+        if follower is not None:
+            await follower
+
+    await asyncio.gather(*[run(n) for n in range(RUNS)])
+    await asyncio.sleep(writer.flush_seconds * 2)
+
+
+async def drain(log):
+    async for _ in log.follow():
+        pass
+
+
+def patch_batches():
+    """BatchStatement.add wants a real prepared statement, record the parameters instead."""
+    import impl.message_checkpoints as checkpoints
+
+    class Batch:
+        def __init__(self, batch_type):
+            self._statements_and_parameters = []
+
+        def add(self, statement, params):
+            self._statements_and_parameters.append((statement, None, params))
+
+    checkpoints.BatchStatement = Batch
+
+
+if __name__ == "__main__":
+    patch_batches()
+    seconds = TOKENS / TOKENS_PER_SECOND
+    print(f"{RUNS} runs, {FOLLOWED:.0%} followed, {TOKENS} tokens of {TOKEN_CHARS} chars at "
+          f"{TOKENS_PER_SECOND:g}/s ({seconds:g}s per run)")
+    for name, strategy in (("every second", every_second), ("checkpoint writer", checkpoint_writer)):
+        client = RecordingClient()
+        asyncio.run(strategy(client))
+        print(f"{name:<18} requests {client.session.requests:>7} ({client.session.requests / seconds:7.1f}/s)  "
+              f"text written {client.session.bytes / 1024 / 1024:8.2f}MB")
@@ -0,0 +1,128 @@
+"""Cross-worker run event fan-out over the unix socket transport, with hundreds of concurrent streams.
+
+PUBLISHERS processes play the gunicorn workers executing runs. Each opens RUNS_PER_PUBLISHER runs on its own
+RunEventBus and publishes TOKENS deltas per run at TOKENS_PER_SECOND, each carrying the time it was published.
+SUBSCRIBERS processes play the workers that received the streaming requests. They split STREAMS streams between
+them, each finds one of the runs in another process with run_event_bus.find and follows it to the end. The
+latency is from publish to receipt.
+
+Polling Cassandra once a second, which streams on another worker used to do, adds 500ms on average and up to a
+second per delta.
+
+    PYTHONPATH=. python tests/perf/bench_run_event_fanout.py
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PUBLISHERS = int(os.getenv("PUBLISHERS", 4))
+RUNS_PER_PUBLISHER = int(os.getenv("RUNS_PER_PUBLISHER", 50))
+SUBSCRIBERS = int(os.getenv("SUBSCRIBERS", 4))
+STREAMS = int(os.getenv("STREAMS", 400))
+TOKENS = int(os.getenv("TOKENS", 200))
+TOKENS_PER_SECOND = float(os.getenv("TOKENS_PER_SECOND", 50))
+# time for every publisher to open its runs before subscribers look for them
+WARMUP_SECONDS = float(os.getenv("WARMUP_SECONDS", 3))
+
+
+async def publish(index, started_at):
+    from impl.run_events import MESSAGE_DELTA, RUN_STATUS, run_event_bus
+
+    run_ids = [f"run_{index}_{i}" for i in range(RUNS_PER_PUBLISHER)]
+    for run_id in run_ids:
+        run_event_bus.open(run_id)
+    await asyncio.sleep(started_at + WARMUP_SECONDS - time.time())
+
+    async def generate(run_id):
+        for _ in range(TOKENS):
+            run_event_bus.publish(run_id, MESSAGE_DELTA, repr(time.time()), "msg_bench")
+            await asyncio.sleep(1 / TOKENS_PER_SECOND)
+        run_event_bus.publish(run_id, RUN_STATUS, "completed")
+        run_event_bus.close(run_id)
+
+    await asyncio.gather(*[generate(run_id) for run_id in run_ids])
+    # keep serving streams that are still draining
+    await asyncio.sleep(5)
+    await run_event_bus.shutdown()
+
+
+async def subscribe(index, started_at):
+    from impl.run_events import (
+        MESSAGE_DELTA,
+        RUN_STATUS,
+        TERMINAL_RUN_STATUSES,
+        run_event_bus,
+    )
+
+    runs = [f"run_{p}_{r}" for p in range(PUBLISHERS) for r in range(RUNS_PER_PUBLISHER)]
+    streams = range(index, STREAMS, SUBSCRIBERS)
+    await asyncio.sleep(started_at + WARMUP_SECONDS / 2 - time.time())
+
+    async def stream(n):
+        run_id = runs[n % len(runs)]
+        start = time.perf_counter()
+        events = await run_event_bus.find(run_id)
+        find_seconds = time.perf_counter() - start
+        if events is None:
+            return find_seconds, None
+        latencies = []
+        async for event in events.follow():
+            if event.type == MESSAGE_DELTA:
+                latencies.append(time.time() - float(event.data))
+            elif event.type == RUN_STATUS and event.data in TERMINAL_RUN_STATUSES:
+                break
+        return find_seconds, latencies
+
+    results = await asyncio.gather(*[stream(n) for n in streams])
+    print(json.dumps({
+        "find": [find_seconds for find_seconds, _ in results],
+        "latencies": [latency for _, latencies in results if latencies for latency in latencies],
+        "missing": sum(1 for _, latencies in results if latencies is None),
+        "short": sum(1 for _, latencies in results if latencies is not None and len(latencies) != TOKENS),
+    }))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        role, index, started_at = sys.argv[1], int(sys.argv[2]), float(sys.argv[3])
+        asyncio.run((publish if role == "publish" else subscribe)(index, started_at))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as socket_dir:
+        env = dict(os.environ, RUN_EVENTS_SOCKET_DIR=socket_dir, RUN_EVENTS_TRANSPORT="unix")
+        started_at = time.time() + 5  # imports take a while
+        publishers = [
+            subprocess.Popen([sys.executable, __file__, "publish", str(i), str(started_at)], env=env)
+            for i in range(PUBLISHERS)
+        ]
+        subscribers = [
+            subprocess.Popen([sys.executable, __file__, "subscribe", str(i), str(started_at)], env=env,
+                             stdout=subprocess.PIPE, text=True)
+            for i in range(SUBSCRIBERS)
+        ]
+        results = [json.loads(subscriber.communicate()[0].strip().splitlines()[-1]) for subscriber in subscribers]
+        for publisher in publishers:
+            publisher.wait()
+
+    find = [seconds for result in results for seconds in result["find"]]
+    latencies = [latency for result in results for latency in result["latencies"]]
+    missing = sum(result["missing"] for result in results)
+    short = sum(result["short"] for result in results)
+    expected = STREAMS * TOKENS
+    print(f"{PUBLISHERS} publishers x {RUNS_PER_PUBLISHER} runs, {SUBSCRIBERS} subscriber processes x "
+          f"{STREAMS // SUBSCRIBERS} streams, {TOKENS} deltas per run at {TOKENS_PER_SECOND:g}/s")
+    print(f"deltas delivered {len(latencies)}/{expected}, runs not found {missing}, incomplete streams {short}")
+    print(f"find   p50 {percentile(find, 50) * 1000:6.1f}ms p99 {percentile(find, 99) * 1000:6.1f}ms")
+    print(f"delta  p50 {percentile(latencies, 50) * 1000:6.1f}ms p95 {percentile(latencies, 95) * 1000:6.1f}ms "
+          f"p99 {percentile(latencies, 99) * 1000:6.1f}ms max {max(latencies) * 1000:6.1f}ms "
+          f"mean {statistics.mean(latencies) * 1000:6.1f}ms")
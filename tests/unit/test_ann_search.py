@@ -0,0 +1,107 @@
+import asyncio
+import random
+
+from impl import astra_vector
+from impl.astra_vector import (
+    ANN_MIN_PARTITION_LIMIT,
+    CassandraClient,
+    TopK,
+    ann_search_plan,
+)
+
+COLUMNS = [
+    {"column_name": "file_id", "kind": "partition_key", "type": "text", "position": 0},
+    {"column_name": "chunk_id", "kind": "clustering", "type": "text", "position": 0},
+    {"column_name": "content", "kind": "regular", "type": "text", "position": -1},
+    {"column_name": "embedding_test", "kind": "regular", "type": "vector<float, 3>", "position": -1},
+]
+
+
+def test_top_k_keeps_the_highest_scores():
+    top = TopK(3)
+    for score, key in [(0.1, "a"), (0.9, "b"), (0.5, "c"), (0.7, "d"), (0.2, "e")]:
+        top.push(score, key)
+
+    assert top.items() == [(0.9, "b"), (0.7, "d"), (0.5, "c")]
+    assert top.threshold() == 0.5
+
+
+def test_top_k_ignores_duplicates_and_low_scores():
+    top = TopK(2)
+
+    assert top.threshold() == float("-inf")
+    assert top.push(0.5, "a")
+    assert not top.push(0.8, "a")
+    assert top.push(0.6, "b")
+    assert not top.push(0.1, "c")
+    assert top.push(0.7, "c")
+    assert top.items() == [(0.7, "c"), (0.6, "b")]
+    # "a" was evicted, it may come back
+    assert top.push(0.9, "a")
+
+
+def test_ann_search_plan():
+    assert ann_search_plan(1, 20) == (20, 1)
+    assert ann_search_plan(2, 20) == (20, 2)
+    assert ann_search_plan(1000, 20) == (ANN_MIN_PARTITION_LIMIT, min(1000, astra_vector.QUERY_CONCURRENCY))
+    assert ann_search_plan(5, 20)[0] == max(ANN_MIN_PARTITION_LIMIT, 8)
+
+
+class Statement:
+    def __init__(self, query_string):
+        self.query_string = query_string
+        self.retry_policy = None
+
+
+def fake_client(chunks):
+    """A CassandraClient whose queries are answered from `chunks`: {file_id: {chunk_id: score}}."""
+    client = CassandraClient("token")
+    client.queries = []
+    client.prepare = lambda query_string, consistency_level=None: Statement(query_string)
+    client._ann_columns = lambda table, column, model: (COLUMNS, "embedding_test")
+    client._search_embedding = lambda *args: [1.0, 0.0, 0.0]
+
+    async def execute_async(statement, parameters=None, timeout=None):
+        client.queries.append((statement.query_string, parameters))
+        if "ann of" in statement.query_string:
+            _, file_id, _, limit = parameters
+            ranked = sorted(chunks[file_id].items(), key=lambda item: -item[1])[:limit]
+            return [{"file_id": file_id, "chunk_id": chunk_id, "score": score} for chunk_id, score in ranked]
+        file_id, chunk_ids = parameters
+        return [{"file_id": file_id, "chunk_id": chunk_id, "content": chunk_id} for chunk_id in chunk_ids]
+
+    client.execute_async = execute_async
+    return client
+
+
+def search(client, partitions, limit):
+    return asyncio.run(client.annSearch_async(
+        "file_chunks", "embedding", "query", {}, "test", "key", partitions, limit=limit
+    ))
+
+
+def test_ann_search_merges_the_top_rows_of_every_partition():
+    random.seed(7)
+    chunks = {f"file_{f}": {f"file_{f}_chunk_{c}": random.random() for c in range(30)} for f in range(40)}
+    # one partition holds most of the winners, it has to be asked again past the first round
+    chunks["file_0"] = {f"file_0_chunk_{c}": 2 + c for c in range(30)}
+    client = fake_client(chunks)
+
+    rows = search(client, list(chunks), limit=20)
+
+    expected = sorted(
+        ((score, chunk_id) for partition in chunks.values() for chunk_id, score in partition.items()), reverse=True
+    )[:20]
+    assert [(row["score"], row["chunk_id"]) for row in rows] == expected
+    assert all(row["content"] == row["chunk_id"] for row in rows)
+
+
+def test_ann_search_hydrates_winners_once_per_partition():
+    chunks = {"file_a": {"a1": 0.9, "a2": 0.8}, "file_b": {"b1": 0.7}, "file_c": {"c1": 0.1}}
+    client = fake_client(chunks)
+
+    rows = search(client, list(chunks), limit=3)
+
+    assert [row["chunk_id"] for row in rows] == ["a1", "a2", "b1"]
+    hydrations = [parameters for query, parameters in client.queries if "ann of" not in query]
+    assert sorted(hydrations) == [("file_a", ["a1", "a2"]), ("file_b", ["b1"])]
@@ -0,0 +1,102 @@
+import asyncio
+import io
+import os
+import zipfile
+
+import pytest
+
+import impl.bundle_cache as bundle_cache_module
+from impl.bundle_cache import SecureBundleCache, is_valid_bundle
+
+
+def bundle_bytes(config: str = "{}") -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as bundle:
+        bundle.writestr("config.json", config)
+    return buffer.getvalue()
+
+
+class Response:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """Bytes the next downloads return, and the urls they were made for."""
+    served = {"contents": [], "urls": []}
+
+    class AsyncClient:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            pass
+
+        async def get(self, url):
+            served["urls"].append(url)
+            return Response(served["contents"].pop(0))
+
+    monkeypatch.setattr(bundle_cache_module.httpx, "AsyncClient", AsyncClient)
+    return served
+
+
+async def get_url():
+    return "https://bundles/db"
+
+
+def test_downloads_once_then_serves_the_file(tmp_path, downloads):
+    cache = SecureBundleCache(directory=str(tmp_path))
+    downloads["contents"] = [bundle_bytes()]
+
+    first = asyncio.run(cache.get("db", get_url))
+    second = asyncio.run(cache.get("db", get_url))
+
+    assert first == second == cache.path("db")
+    assert is_valid_bundle(first)
+    assert len(downloads["urls"]) == 1
+
+
+def test_refresh_downloads_again(tmp_path, downloads):
+    cache = SecureBundleCache(directory=str(tmp_path))
+    downloads["contents"] = [bundle_bytes("{}"), bundle_bytes('{"rotated": true}')]
+
+    asyncio.run(cache.get("db", get_url))
+    path = asyncio.run(cache.get("db", get_url, refresh=True))
+
+    with zipfile.ZipFile(path) as bundle:
+        assert bundle.read("config.json") == b'{"rotated": true}'
+
+
+def test_invalid_download_keeps_the_previous_bundle(tmp_path, downloads):
+    cache = SecureBundleCache(directory=str(tmp_path))
+    downloads["contents"] = [bundle_bytes(), b"<html>not a zip</html>"]
+    asyncio.run(cache.get("db", get_url))
+
+    with pytest.raises(ValueError):
+        asyncio.run(cache.get("db", get_url, refresh=True))
+
+    assert is_valid_bundle(cache.path("db"))
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".bundle-")]
+
+
+def test_stale_bundle_is_replaced(tmp_path, downloads):
+    cache = SecureBundleCache(directory=str(tmp_path), max_age=-1)
+    downloads["contents"] = [bundle_bytes(), bundle_bytes()]
+
+    asyncio.run(cache.get("db", get_url))
+    asyncio.run(cache.get("db", get_url))
+
+    assert len(downloads["urls"]) == 2
+
+
+def test_bundle_without_config_is_invalid(tmp_path):
+    path = tmp_path / "db.zip"
+    with zipfile.ZipFile(path, "w") as bundle:
+        bundle.writestr("ca.crt", "")
+
+    assert not is_valid_bundle(str(path))
+    assert not is_valid_bundle(str(tmp_path / "missing.zip"))
@@ -0,0 +1,91 @@
+import random
+
+from impl.services.chunking import (
+    MIN_CHUNK_LENGTH_TO_EMBED,
+    MIN_CHUNK_SIZE_CHARS,
+    chunk_document_text,
+    split_text,
+    tokenizer,
+)
+
+WORDS = ["alpha", "beta", "gamma", "delta", "épsilon", "ζήτα", "東京", "naïve", "🙂", "x"]
+
+
+def sample_text(seed: int, sentences: int = 300) -> str:
+    rng = random.Random(seed)
+    text = []
+    for _ in range(sentences):
+        text.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 25))))
+        text.append(rng.choice([". ", "? ", "!\n", "\n\n", ", "]))
+    return "".join(text)
+
+
+def original_chunks(text, chunk_size):
+    """get_text_chunks before the chunker was rewritten, re-slicing the remaining tokens after every chunk."""
+    tokens = tokenizer.encode(text, disallowed_special=())
+    chunks = []
+    while tokens:
+        chunk_text = tokenizer.decode(tokens[:chunk_size])
+        if not chunk_text or chunk_text.isspace():
+            tokens = tokens[chunk_size:]
+            continue
+        last_punctuation = max(chunk_text.rfind(mark) for mark in (".", "?", "!", "\n"))
+        if last_punctuation != -1 and last_punctuation > MIN_CHUNK_SIZE_CHARS:
+            chunk_text = chunk_text[: last_punctuation + 1]
+        chunk_text_to_append = chunk_text.replace("\n", " ").strip()
+        if len(chunk_text_to_append) > MIN_CHUNK_LENGTH_TO_EMBED:
+            chunks.append(chunk_text_to_append)
+        tokens = tokens[len(tokenizer.encode(chunk_text, disallowed_special=())):]
+    return chunks
+
+
+def test_compat_mode_cuts_the_original_chunks():
+    for seed in range(5):
+        text = sample_text(seed)
+        for chunk_size in (50, 200):
+            chunks, rest, _ = split_text(text, chunk_size, mode="compat")
+            assert rest == ""
+            assert chunks == original_chunks(text, chunk_size)
+
+
+def test_offsets_mode_keeps_all_the_text():
+    for seed in range(5):
+        text = sample_text(seed)
+        chunks, rest, _ = split_text(text, 100, mode="offsets", overlap=0)
+
+        assert rest == ""
+        assert "".join("".join(chunks).split()) == "".join(text.split())
+
+
+def test_offsets_mode_chunks_fit_the_chunk_size():
+    text = sample_text(1)
+    chunks, _, _ = split_text(text, 100, mode="offsets", overlap=0)
+
+    # encoded on its own, with newlines turned into spaces, a chunk's edges can tokenize a little differently
+    assert all(len(tokenizer.encode(chunk)) <= 105 for chunk in chunks)
+    assert len(chunks) >= len(tokenizer.encode(text)) // 100
+
+
+def test_offsets_mode_overlap():
+    text = sample_text(2)
+    chunks, _, _ = split_text(text, 100, mode="offsets", overlap=20)
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk[:10] in previous
+
+
+def test_split_text_keeps_the_tail_and_counts_chunks():
+    text = sample_text(3)
+    chunks, rest, used = split_text(text, 100, keep=100, mode="offsets")
+
+    assert 0 < len(tokenizer.encode(rest)) <= 101
+    assert used >= len(chunks)
+
+    chunks, _, used = split_text(text, 100, max_chunks=3, mode="offsets")
+    assert used == 3
+
+
+def test_chunk_document_text():
+    assert chunk_document_text("") == []
+    assert chunk_document_text("   \n ") == []
+    assert chunk_document_text("A short sentence.") == ["A short sentence."]
@@ -0,0 +1,65 @@
+import asyncio
+
+from impl import connection_manager as manager_module
+from impl.connection_manager import TenantConnectionManager
+
+
+class Session:
+    def __init__(self):
+        self.pool_state_reads = 0
+
+    def get_pool_state(self):
+        self.pool_state_reads += 1
+        return {"host": {"open_count": 2, "in_flights": [1, 0]}}
+
+
+class Client:
+    def __init__(self, dbid):
+        self.dbid = dbid
+        self.session = Session()
+
+    def shutdown(self):
+        self.session = None
+
+
+class DataStore:
+    async def setupSession(self, token, dbid):
+        return Client(dbid)
+
+
+def test_cache_hits_do_not_read_pool_state(monkeypatch):
+    monkeypatch.setattr(manager_module, "AstraVectorDataStore", DataStore)
+    manager = TenantConnectionManager()
+
+    async def requests():
+        clients = [await manager.get_client("token", f"db{i}") for i in range(3)]
+        reads = sum(client.session.pool_state_reads for client in clients)
+        for _ in range(10):
+            for i in range(3):
+                assert await manager.get_client("token", f"db{i}") is clients[i]
+        return clients, reads
+
+    clients, reads = asyncio.run(requests())
+
+    assert sum(client.session.pool_state_reads for client in clients) == reads
+    assert manager_module.IN_FLIGHT._value.get() == 3
+
+
+def test_gauges_are_sampled_on_a_timer(monkeypatch):
+    monkeypatch.setattr(manager_module, "AstraVectorDataStore", DataStore)
+    monkeypatch.setattr(manager_module, "METRICS_REFRESH_SECONDS", 0.01)
+    manager = TenantConnectionManager()
+
+    async def sampled():
+        manager.start()
+        client = await manager.get_client("token", "db")
+        reads = client.session.pool_state_reads
+        await asyncio.sleep(0.05)
+        sampled_reads = client.session.pool_state_reads
+        manager.shutdown()
+        return reads, sampled_reads
+
+    reads, sampled_reads = asyncio.run(sampled())
+
+    assert sampled_reads > reads
+    assert manager._metrics_task is None
@@ -0,0 +1,194 @@
+import asyncio
+
+import pytest
+
+import impl.message_checkpoints as checkpoints
+from impl.message_checkpoints import (
+    DELTA_INSERT,
+    DELTAS_DELETE,
+    MessageCheckpointer,
+    MessageCheckpointWriter,
+    read_message_deltas,
+)
+
+
+class Batch:
+    def __init__(self, batch_type):
+        self.statements = []
+
+    def add(self, statement, params):
+        self.statements.append((statement, params))
+
+
+class Future:
+    def __init__(self, error=None):
+        self.error = error
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        if self.error is None:
+            callback(None, *callback_args)
+        else:
+            errback(self.error, *errback_args)
+
+
+class Session:
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def execute_async(self, batch):
+        self.batches.append(batch.statements)
+        return Future(self.error)
+
+
+class Client:
+    def __init__(self, error=None):
+        self.session = Session(error)
+
+    def prepare(self, query_string):
+        return query_string
+
+
+@pytest.fixture(autouse=True)
+def batches(monkeypatch):
+    monkeypatch.setattr(checkpoints, "BatchStatement", Batch)
+
+
+def flush(writer):
+    async def wait():
+        await asyncio.sleep(writer.flush_seconds * 2)
+        # the batches are built on the default executor
+        await asyncio.get_running_loop().run_in_executor(None, lambda: None)
+    return wait()
+
+
+def test_pending_deltas_of_a_message_are_coalesced():
+    client = Client()
+    writer = MessageCheckpointWriter(flush_seconds=0.01)
+
+    async def run():
+        writer.append(client, "thread", "msg", 0, "Hello")
+        writer.append(client, "thread", "msg", 5, ", world")
+        writer.append(client, "thread", "other", 0, "Hi")
+        await flush(writer)
+        writer.append(client, "thread", "msg", 12, "!")
+        await flush(writer)
+
+    asyncio.run(run())
+
+    first, second = client.session.batches
+    assert sorted(params[:4] for _, params in first) == [
+        ("thread", "msg", 0, "Hello, world"), ("thread", "other", 0, "Hi")
+    ]
+    assert [params[:4] for _, params in second] == [("thread", "msg", 12, "!")]
+
+
+def test_delete_replaces_pending_deltas():
+    client = Client()
+    writer = MessageCheckpointWriter(flush_seconds=0.01)
+
+    async def run():
+        writer.append(client, "thread", "msg", 0, "Hello")
+        writer.delete(client, "thread", "msg")
+        await flush(writer)
+
+    asyncio.run(run())
+
+    [batch] = client.session.batches
+    assert [query for query, _ in batch] == [DELTAS_DELETE]
+
+
+def test_batches_are_capped_in_bytes():
+    client = Client()
+    writer = MessageCheckpointWriter(flush_seconds=0.01, batch_bytes=10)
+
+    async def run():
+        for n in range(5):
+            writer.append(client, "thread", f"msg_{n}", 0, "x" * 6)
+        await flush(writer)
+
+    asyncio.run(run())
+
+    assert [len(batch) for batch in client.session.batches] == [1, 1, 1, 1, 1]
+    assert all(query == DELTA_INSERT for batch in client.session.batches for query, _ in batch)
+
+
+def test_failed_batches_are_dropped():
+    client = Client(error=Exception("unavailable"))
+    writer = MessageCheckpointWriter(flush_seconds=0.01)
+    failed = checkpoints.CHECKPOINTS.labels("failed")._value.get()
+
+    async def run():
+        writer.append(client, "thread", "msg", 0, "Hello")
+        await flush(writer)
+
+    asyncio.run(run())
+
+    assert checkpoints.CHECKPOINTS.labels("failed")._value.get() == failed + 1
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.appended = []
+        self.deleted = []
+
+    def append(self, astradb, thread_id, message_id, position, delta):
+        self.appended.append((position, delta))
+
+    def delete(self, astradb, thread_id, message_id):
+        self.deleted.append(message_id)
+
+
+class Bus:
+    """run_event_bus with a stream following "run_followed"."""
+
+    class Log:
+        subscribers = 1
+
+    def get(self, run_id):
+        return self.Log() if run_id == "run_followed" else None
+
+
+def test_checkpointer_appends_the_text_since_the_last_checkpoint(monkeypatch):
+    monkeypatch.setattr(checkpoints, "run_event_bus", Bus())
+    monkeypatch.setattr(checkpoints, "MESSAGE_CHECKPOINT_SECONDS", 0.000001)
+    writer = RecordingWriter()
+    checkpointer = MessageCheckpointer(None, "thread", "msg", "run_followed", writer=writer)
+
+    checkpointer._saved_at = 0
+    checkpointer.update("Hello")
+    checkpointer._saved_at = 0
+    checkpointer.update("Hello, world")
+    checkpointer.update("Hello, world")
+    checkpointer.complete()
+
+    assert writer.appended == [(0, "Hello"), (5, ", world")]
+    assert writer.deleted == ["msg"]
+
+
+def test_checkpointer_without_an_interval_writes_nothing(monkeypatch):
+    monkeypatch.setattr(checkpoints, "run_event_bus", Bus())
+    monkeypatch.setattr(checkpoints, "MESSAGE_CHECKPOINT_IDLE_SECONDS", 0)
+    writer = RecordingWriter()
+    checkpointer = MessageCheckpointer(None, "thread", "msg", "run_unfollowed", writer=writer)
+    checkpointer._saved_at = 0
+
+    checkpointer.update("Hello")
+    checkpointer.complete()
+
+    assert writer.appended == []
+    assert writer.deleted == []
+
+
+def test_read_message_deltas_stops_at_a_gap():
+    class Reader:
+        def prepare(self, query_string):
+            return query_string
+
+        async def execute_async(self, statement, parameters):
+            _, _, position = parameters
+            rows = [{"position": 0, "delta": "Hello"}, {"position": 5, "delta": ", "}, {"position": 12, "delta": "!"}]
+            return [row for row in rows if row["position"] >= position]
+
+    assert asyncio.run(read_message_deltas(Reader(), "thread", "msg")) == "Hello, "
+    assert asyncio.run(read_message_deltas(Reader(), "thread", "msg", 5)) == ", "
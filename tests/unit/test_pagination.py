@@ -0,0 +1,132 @@
+import asyncio
+import operator
+import re
+
+import pytest
+from fastapi import HTTPException
+
+from impl.astra_vector import CassandraClient
+from impl.routes_v2.threads_v2 import get_runs_page
+
+OPERATORS = {"=": operator.eq, "<": operator.lt, ">": operator.gt, "IN": lambda value, values: value in values}
+
+
+class Statement:
+    def __init__(self, query_string):
+        self.query_string = query_string
+
+
+def fake_client(tables):
+    """A CassandraClient answering the selects of select_page_async from `tables`: {table: [row]}."""
+    client = CassandraClient("token")
+    client.rows_read = 0
+    client.prepare = lambda query_string, consistency_level=None: Statement(query_string)
+
+    async def execute_async(statement, parameters=None, timeout=None):
+        query = statement.query_string
+        table = re.search(r"FROM \w+\.(\w+) WHERE", query).group(1)
+        partition_key = re.search(r"WHERE (\w+) = \?", query).group(1)
+        parameters = list(parameters)
+        value = parameters.pop(0)
+        rows = [row for row in tables[table] if row[partition_key] == value]
+        for column, op in re.findall(r"AND (\w+) (=|<|>|IN) \?", query):
+            param = parameters.pop(0)
+            rows = [row for row in rows if OPERATORS[op](row[column], param)]
+        order = re.search(r"ORDER BY created_at (ASC|DESC)", query)
+        rows.sort(key=lambda row: (row["created_at"], row["id"]), reverse=order is not None and order.group(1) == "DESC")
+        limit = re.search(r"LIMIT (\d+)", query)
+        if limit:
+            rows = rows[:int(limit.group(1))]
+        client.rows_read += len(rows)
+        return [dict(row) for row in rows]
+
+    client.execute_async = execute_async
+    return client
+
+
+def messages(n, per_second=3):
+    return [
+        {"thread_id": "t", "id": f"msg_{i:03}", "created_at": i // per_second, "role": "user" if i % 2 else "assistant"}
+        for i in range(n)
+    ]
+
+
+def walk(client, order, limit, tiebreak=lambda row: 0):
+    ids, after = [], None
+    while True:
+        rows, has_more = asyncio.run(client.select_page_async(
+            "messages_v2", "thread_id", "t", limit, order, after=after, tiebreak=tiebreak
+        ))
+        ids.extend(row["id"] for row in rows)
+        if not has_more:
+            return ids
+        after = rows[-1]["id"]
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_pages_cover_the_partition_once(order):
+    rows = messages(50)
+    client = fake_client({"messages_v2": rows})
+
+    ids = walk(client, order, limit=7)
+
+    expected = sorted(rows, key=lambda row: (row["created_at"], row["id"]), reverse=order == "desc")
+    assert ids == [row["id"] for row in expected]
+
+
+def test_page_reads_about_limit_rows():
+    client = fake_client({"messages_v2": messages(1000)})
+
+    rows, has_more = asyncio.run(client.select_page_async("messages_v2", "thread_id", "t", 10, "desc", after="msg_500"))
+
+    assert has_more
+    assert [row["id"] for row in rows] == [f"msg_{i:03}" for i in range(499, 489, -1)]
+    assert client.rows_read < 30
+
+
+def test_tiebreak_orders_rows_sharing_created_at():
+    rows = [
+        {"thread_id": "t", "id": "msg_a", "created_at": 1, "role": "assistant"},
+        {"thread_id": "t", "id": "msg_b", "created_at": 1, "role": "user"},
+        {"thread_id": "t", "id": "msg_c", "created_at": 2, "role": "user"},
+    ]
+    client = fake_client({"messages_v2": rows})
+
+    def user_first(row):
+        return row["role"] != "user"
+
+    assert walk(client, "asc", limit=1, tiebreak=user_first) == ["msg_b", "msg_a", "msg_c"]
+    assert walk(client, "desc", limit=1, tiebreak=user_first) == ["msg_c", "msg_a", "msg_b"]
+
+
+def test_before_returns_the_previous_page():
+    client = fake_client({"messages_v2": messages(20)})
+
+    rows, has_more = asyncio.run(client.select_page_async("messages_v2", "thread_id", "t", 3, "asc", before="msg_010"))
+
+    assert [row["id"] for row in rows] == ["msg_007", "msg_008", "msg_009"]
+    assert has_more
+
+
+def test_unknown_cursor_is_a_bad_request():
+    client = fake_client({"messages_v2": messages(5)})
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(client.select_page_async("messages_v2", "thread_id", "t", 3, "asc", after="msg_missing"))
+    assert e.value.status_code == 400
+
+
+def test_runs_are_paged_through_the_created_at_index(monkeypatch):
+    runs = [{"thread_id": "t", "id": f"run_{i}", "created_at": 100 - i} for i in range(5)]
+    client = fake_client({"runs_v2_by_created_at": runs, "runs_v2": runs})
+    monkeypatch.setattr(
+        "impl.routes_v2.threads_v2.rows_to_objects", lambda target_class, table, rows: [row["id"] for row in rows]
+    )
+
+    page, has_more = asyncio.run(get_runs_page(client, "t", 2, "asc", None, None))
+    assert page == ["run_4", "run_3"]
+    assert has_more
+
+    page, has_more = asyncio.run(get_runs_page(client, "t", 2, "desc", "run_1", None))
+    assert page == ["run_2", "run_3"]
+    assert has_more
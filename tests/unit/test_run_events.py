@@ -0,0 +1,69 @@
+import asyncio
+
+from impl import run_events
+from impl.run_events import (
+    MESSAGE_DELTA,
+    RUN_STATUS,
+    CassandraRunEvents,
+    CassandraRunEventStore,
+    RunEvent,
+)
+
+
+class Session:
+    def execute(self, *args):
+        raise AssertionError("reads go through execute_async")
+
+
+def test_store_reads_through_execute_async():
+    calls = []
+
+    async def execute_async(statement, parameters):
+        calls.append((statement, parameters))
+        return [{"event": RunEvent(type="run.status", data="in_progress", seq=0).to_json()}]
+
+    store = CassandraRunEventStore(Session(), lambda query: query, execute_async, "ks")
+
+    events = asyncio.run(store.read("run_1", -1))
+
+    assert events == [RunEvent(type="run.status", data="in_progress", seq=0)]
+    assert calls == [("SELECT event FROM ks.run_events WHERE run_id = ? AND seq > ? LIMIT ?", ("run_1", -1, 1000))]
+
+
+class Store:
+    def __init__(self, events):
+        self.events = events
+        self.reads = 0
+
+    async def read(self, run_id, after, limit=1000):
+        self.reads += 1
+        return [event for event in self.events if event.seq > after]
+
+
+def follow(events):
+    async def collect():
+        return [event async for event in events.follow()]
+    return asyncio.run(collect())
+
+
+def test_follow_stops_at_a_terminal_status(monkeypatch):
+    monkeypatch.setattr(run_events, "RUN_EVENTS_POLL_SECONDS", 0)
+    store = Store([
+        RunEvent(type=MESSAGE_DELTA, data="hi", message_id="msg_1", seq=0),
+        RunEvent(type=RUN_STATUS, data="completed", seq=1),
+    ])
+
+    events = follow(CassandraRunEvents(store, "run_1"))
+
+    assert [event.seq for event in events] == [0, 1]
+
+
+def test_follow_gives_up_on_a_run_with_no_events(monkeypatch):
+    monkeypatch.setattr(run_events, "RUN_EVENTS_POLL_SECONDS", 0.01)
+    # the worker died before writing the closed marker
+    store = Store([RunEvent(type=RUN_STATUS, data="in_progress", seq=0)])
+
+    events = follow(CassandraRunEvents(store, "run_1", idle_timeout=0.05))
+
+    assert [event.seq for event in events] == [0]
+    assert store.reads > 1
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+from cassandra import InvalidRequest, OperationTimedOut
+
+from impl import schema_migrations
+from impl.schema_migrations import (
+    MIGRATIONS,
+    SCHEMA_VERSION,
+    migrate,
+    read_schema_version,
+)
+
+KEYSPACE = "assistant_api"
+
+
+class FakeClient:
+    """Records the statements a migration runs, schema_version is kept in memory."""
+
+    def __init__(self, version=None, errors=None):
+        self.dbid = "db"
+        self.version = version
+        self.errors = errors or {}
+        self.statements = []
+
+    async def execute_async(self, statement, parameters=None):
+        query = getattr(statement, "query_string", statement)
+        self.statements.append(query)
+        for fragment, error in self.errors.items():
+            if fragment in query:
+                raise error
+        if query.startswith("SELECT version"):
+            if self.version is None:
+                raise InvalidRequest("Error from server: code=2200 [Invalid query] message=\"unconfigured table schema_version\"")
+            return [{"version": self.version}]
+        if "schema_version (keyspace_name" in query:
+            self.version = parameters[1]
+        return []
+
+    def ddl(self):
+        return [query for query in self.statements if not query.startswith(("SELECT", "insert into"))]
+
+
+@pytest.fixture(autouse=True)
+def without_backfill(monkeypatch):
+    monkeypatch.setattr(schema_migrations, "_current", set())
+    # the backfill goes through the driver's session, not execute_async
+    monkeypatch.setattr(schema_migrations, "MIGRATIONS", [
+        schema_migrations.Migration(m.version, m.description, [
+            [step for step in phase if isinstance(step, str)] for phase in m.phases
+        ]) for m in MIGRATIONS
+    ])
+
+
+def ddl_count(after_version):
+    return sum(
+        len([step for step in phase if isinstance(step, str)])
+        for m in MIGRATIONS if m.version > after_version for phase in m.phases
+    )
+
+
+def test_fresh_keyspace_runs_every_migration():
+    client = FakeClient()
+    made = []
+
+    async def make_keyspace():
+        made.append(KEYSPACE)
+
+    assert asyncio.run(migrate(client, KEYSPACE, make_keyspace)) == 0
+    assert made == [KEYSPACE]
+    assert len(client.ddl()) == ddl_count(0)
+    assert client.version == SCHEMA_VERSION
+
+
+def test_resumes_after_the_recorded_version():
+    client = FakeClient(version=3)
+
+    assert asyncio.run(migrate(client, KEYSPACE, make_keyspace=None)) == 3
+    assert len(client.ddl()) == ddl_count(3)
+    assert not any("embedding_dimensions" in query for query in client.ddl())
+    assert client.version == SCHEMA_VERSION
+
+
+def test_current_keyspace_is_read_once_per_process():
+    client = FakeClient(version=SCHEMA_VERSION)
+
+    assert asyncio.run(migrate(client, KEYSPACE)) == SCHEMA_VERSION
+    assert client.statements == [client.statements[0]]
+    assert client.statements[0].startswith("SELECT version")
+
+    client.statements.clear()
+    assert asyncio.run(migrate(client, KEYSPACE)) == SCHEMA_VERSION
+    assert client.statements == []
+
+
+def test_columns_added_before_versions_were_recorded_are_tolerated():
+    conflict = InvalidRequest("Invalid column name chunks_reused because it conflicts with an existing column")
+    client = FakeClient(version=3, errors={"chunks_reused": conflict})
+
+    asyncio.run(migrate(client, KEYSPACE))
+
+    assert client.version == SCHEMA_VERSION
+
+
+def test_failed_migration_is_not_recorded():
+    client = FakeClient(version=3, errors={"message_deltas": OperationTimedOut("timed out")})
+
+    with pytest.raises(OperationTimedOut):
+        asyncio.run(migrate(client, KEYSPACE))
+    assert client.version == 4
+    assert (client.dbid, KEYSPACE) not in schema_migrations._current
+
+
+def test_only_a_missing_table_means_no_version():
+    assert asyncio.run(read_schema_version(FakeClient(), KEYSPACE)) is None
+
+    client = FakeClient(errors={"SELECT version": OperationTimedOut("timed out")})
+    with pytest.raises(OperationTimedOut):
+        asyncio.run(read_schema_version(client, KEYSPACE))
+
+    client = FakeClient(errors={"SELECT version": InvalidRequest("Keyspace 'assistant_api' does not exist")})
+    assert asyncio.run(read_schema_version(client, KEYSPACE)) is None
+
+
+def test_function_steps_are_awaited(monkeypatch):
+    steps = []
+
+    async def step(astradb, keyspace):
+        steps.append((astradb.dbid, keyspace))
+
+    monkeypatch.setattr(schema_migrations, "MIGRATIONS", [
+        schema_migrations.Migration(1, "table", [["create table if not exists {keyspace}.t (id text primary key);"]]),
+        schema_migrations.Migration(2, "backfill", [[step]]),
+    ])
+    client = FakeClient()
+
+    asyncio.run(migrate(client, KEYSPACE))
+
+    assert steps == [("db", KEYSPACE)]
+    assert client.ddl() == ["create table if not exists assistant_api.t (id text primary key);"]
+    assert client.version == 2
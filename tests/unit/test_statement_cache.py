@@ -0,0 +1,84 @@
+from cassandra import ConsistencyLevel
+
+from impl.statement_cache import PreparedStatementCache
+
+
+class Statement:
+    def __init__(self, query_string):
+        self.query_string = query_string
+        self.consistency_level = None
+
+
+class Session:
+    def __init__(self):
+        self.prepared = []
+
+    def prepare(self, query_string):
+        self.prepared.append(query_string)
+        return Statement(query_string)
+
+
+def test_get_prepares_once_and_counts_hits():
+    session = Session()
+    cache = PreparedStatementCache(session.prepare)
+
+    first = cache.get("SELECT * FROM ks.threads WHERE id = ?;")
+    second = cache.get("SELECT * FROM ks.threads WHERE id = ?;")
+
+    assert first is second
+    assert session.prepared == ["SELECT * FROM ks.threads WHERE id = ?;"]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_consistency_level_is_part_of_the_key():
+    session = Session()
+    cache = PreparedStatementCache(session.prepare)
+
+    default = cache.get("SELECT * FROM ks.threads WHERE id = ?;")
+    quorum = cache.get("SELECT * FROM ks.threads WHERE id = ?;", ConsistencyLevel.QUORUM)
+
+    assert default is not quorum
+    assert default.consistency_level is None
+    assert quorum.consistency_level == ConsistencyLevel.QUORUM
+    assert len(cache) == 2
+
+
+def test_least_recently_used_is_evicted():
+    session = Session()
+    cache = PreparedStatementCache(session.prepare, maxsize=2)
+
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    cache.get("c")
+
+    assert cache.stats()["evictions"] == 1
+    cache.get("a")
+    assert session.prepared == ["a", "b", "c"]
+    cache.get("b")
+    assert session.prepared == ["a", "b", "c", "b"]
+
+
+def test_invalidate():
+    session = Session()
+    cache = PreparedStatementCache(session.prepare)
+    cache.get("SELECT * FROM ks.threads WHERE id = ?;")
+    cache.get("SELECT * FROM ks.files WHERE id = ?;")
+
+    assert cache.invalidate("threads") == 1
+    assert len(cache) == 1
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+
+
+def test_invalidate_matches_whole_table_names():
+    session = Session()
+    cache = PreparedStatementCache(session.prepare)
+    cache.get("SELECT * FROM ks.messages WHERE thread_id = ?;")
+    cache.get("SELECT * FROM ks.messages_v2 WHERE thread_id = ?;")
+    cache.get("insert into ks.message_deltas (thread_id, message_id) VALUES (?, ?);")
+    cache.get("SELECT messages FROM ks.threads WHERE id = ?;")
+
+    assert cache.invalidate("messages") == 1
+    assert len(cache) == 3
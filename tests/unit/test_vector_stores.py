@@ -0,0 +1,57 @@
+import asyncio
+
+from impl.ingestion import FILE_STATUS_COMPLETED, FILE_STATUS_IN_PROGRESS
+from impl.model_v2.vector_store_object import VectorStoreObject
+from impl.routes_v2.vector_stores import create_vector_store, get_vector_store
+from openapi_server_v2.models.create_vector_store_request import (
+    CreateVectorStoreRequest,
+)
+from openapi_server_v2.models.vector_store_file_object import VectorStoreFileObject
+
+KEYS = {"files": ["id"], "vector_stores": ["id"], "vector_store_files": ["vector_store_id", "id"]}
+# cassandra returns every column, unset ones as None
+COLUMNS = {
+    "files": ["id", "purpose", "status", "status_details"],
+    "vector_stores": list(VectorStoreObject.model_fields),
+    "vector_store_files": list(VectorStoreFileObject.model_fields),
+}
+
+
+class FakeClient:
+    """The tables the vector store routes read and write, kept in memory."""
+
+    def __init__(self):
+        self.tables = {table: {} for table in KEYS}
+
+    async def upsert_table_from_dict_async(self, table_name, obj):
+        key = tuple(obj[column] for column in KEYS[table_name])
+        self.tables[table_name].setdefault(key, {}).update(obj)
+
+    async def select_from_table_by_pk_async(self, table, partition_keys, args, **kwargs):
+        return [
+            {column: row.get(column) for column in COLUMNS[table]} for row in self.tables[table].values()
+            if all(row[column] == args[column] for column in partition_keys)
+        ]
+
+
+def test_vector_store_completes_when_its_files_do():
+    astradb = FakeClient()
+    file = {"id": "file_1", "purpose": "assistants", "status": FILE_STATUS_IN_PROGRESS}
+    asyncio.run(astradb.upsert_table_from_dict_async("files", file))
+
+    created = asyncio.run(create_vector_store(CreateVectorStoreRequest(name="docs", file_ids=["file_1"]), astradb))
+    assert created.status == "in_progress"
+
+    vector_store = asyncio.run(get_vector_store(created.id, astradb))
+    assert vector_store.status == "in_progress"
+    assert vector_store.file_counts.in_progress == 1
+
+    # ingested after the vector store was created
+    asyncio.run(astradb.upsert_table_from_dict_async("files", {"id": "file_1", "status": FILE_STATUS_COMPLETED}))
+
+    vector_store = asyncio.run(get_vector_store(created.id, astradb))
+    assert vector_store.status == "completed"
+    assert vector_store.file_counts.completed == 1
+    assert vector_store.file_counts.in_progress == 0
+    assert vector_store.file_counts.total == 1
+    assert astradb.tables["vector_stores"][(created.id,)]["status"] == "completed"